@@ -0,0 +1,59 @@
+-- Record upload size and header-probed duration when a transcription is created
+-- The backend now passes file_size_param and duration_param to create_transcription
+
+ALTER TABLE public.transcriptions
+ADD COLUMN IF NOT EXISTS screen_context TEXT;
+
+-- Drop the previous signatures so PostgREST resolves the RPC unambiguously
+DROP FUNCTION IF EXISTS public.create_transcription(TEXT, VARCHAR, VARCHAR, VARCHAR, TEXT, VARCHAR);
+DROP FUNCTION IF EXISTS public.create_transcription(TEXT, VARCHAR, VARCHAR, VARCHAR, TEXT, VARCHAR, TEXT);
+
+CREATE OR REPLACE FUNCTION public.create_transcription(
+    device_id_param TEXT,
+    filename_param VARCHAR DEFAULT NULL,
+    language_param VARCHAR DEFAULT 'auto',
+    model_param VARCHAR DEFAULT 'gpt-4o-transcribe',
+    prompt_param TEXT DEFAULT NULL,
+    active_app_param VARCHAR DEFAULT NULL,
+    screen_context_param TEXT DEFAULT NULL,
+    file_size_param BIGINT DEFAULT NULL,
+    duration_param REAL DEFAULT NULL
+)
+RETURNS UUID AS $$
+DECLARE
+    user_uuid UUID;
+    transcription_uuid UUID;
+BEGIN
+    -- Get or create user
+    SELECT public.get_or_create_user_by_device_id(device_id_param) INTO user_uuid;
+    
+    -- Create transcription record
+    INSERT INTO public.transcriptions (
+        user_id,
+        device_id,
+        filename,
+        language,
+        model,
+        prompt,
+        active_app,
+        screen_context,
+        file_size,
+        duration,
+        status
+    ) VALUES (
+        user_uuid,
+        device_id_param,
+        filename_param,
+        language_param,
+        model_param,
+        prompt_param,
+        active_app_param,
+        screen_context_param,
+        file_size_param,
+        duration_param,
+        'processing'
+    ) RETURNING id INTO transcription_uuid;
+    
+    RETURN transcription_uuid;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
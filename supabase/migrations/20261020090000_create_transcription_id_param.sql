@@ -0,0 +1,60 @@
+-- Let the backend choose the transcription id (id_param), so a create can be
+-- queued in the local write outbox and replayed later without a second row.
+-- Replaying a create whose id already exists is a no-op.
+
+DROP FUNCTION IF EXISTS public.create_transcription(TEXT, VARCHAR, VARCHAR, VARCHAR, TEXT, VARCHAR, TEXT, BIGINT, REAL);
+
+CREATE OR REPLACE FUNCTION public.create_transcription(
+    device_id_param TEXT,
+    filename_param VARCHAR DEFAULT NULL,
+    language_param VARCHAR DEFAULT 'auto',
+    model_param VARCHAR DEFAULT 'gpt-4o-transcribe',
+    prompt_param TEXT DEFAULT NULL,
+    active_app_param VARCHAR DEFAULT NULL,
+    screen_context_param TEXT DEFAULT NULL,
+    file_size_param BIGINT DEFAULT NULL,
+    duration_param REAL DEFAULT NULL,
+    id_param UUID DEFAULT NULL
+)
+RETURNS UUID AS $$
+DECLARE
+    user_uuid UUID;
+    transcription_uuid UUID;
+BEGIN
+    -- Get or create user
+    SELECT public.get_or_create_user_by_device_id(device_id_param) INTO user_uuid;
+    
+    -- Create transcription record
+    INSERT INTO public.transcriptions (
+        id,
+        user_id,
+        device_id,
+        filename,
+        language,
+        model,
+        prompt,
+        active_app,
+        screen_context,
+        file_size,
+        duration,
+        status
+    ) VALUES (
+        COALESCE(id_param, gen_random_uuid()),
+        user_uuid,
+        device_id_param,
+        filename_param,
+        language_param,
+        model_param,
+        prompt_param,
+        active_app_param,
+        screen_context_param,
+        file_size_param,
+        duration_param,
+        'processing'
+    )
+    ON CONFLICT (id) DO NOTHING
+    RETURNING id INTO transcription_uuid;
+    
+    RETURN COALESCE(transcription_uuid, id_param);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
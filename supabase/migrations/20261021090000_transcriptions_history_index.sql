@@ -0,0 +1,7 @@
+-- Transcription history (GET /transcriptions) pages through one device's rows
+-- newest first with a (created_at, id) cursor; this index serves each page as a
+-- single range scan, where idx_transcriptions_created_at alone would walk every
+-- device's rows to find one device's
+
+CREATE INDEX IF NOT EXISTS idx_transcriptions_device_history
+ON public.transcriptions(device_id, created_at DESC, id DESC);
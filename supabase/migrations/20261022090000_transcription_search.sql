@@ -0,0 +1,44 @@
+-- Full-text search over transcription results (GET /transcriptions/search)
+-- The 'simple' configuration lowercases without stemming or stop words, since
+-- dictation arrives in many languages and a per-row language is often 'auto'
+
+ALTER TABLE public.transcriptions
+ADD COLUMN IF NOT EXISTS result_tsv TSVECTOR
+GENERATED ALWAYS AS (to_tsvector('simple', COALESCE(result, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_transcriptions_result_tsv
+ON public.transcriptions USING GIN (result_tsv);
+
+-- Ranks the matching rows first and builds snippets only for the returned page:
+-- ts_headline re-parses the whole document, so it must not run for every match
+CREATE OR REPLACE FUNCTION public.search_transcriptions(
+    device_id_param TEXT,
+    query_param TEXT,
+    limit_param INTEGER DEFAULT 20
+)
+RETURNS TABLE (
+    id UUID,
+    created_at TIMESTAMP WITH TIME ZONE,
+    status VARCHAR,
+    active_app VARCHAR,
+    rank REAL,
+    snippet TEXT
+) AS $$
+    WITH query AS (
+        SELECT plainto_tsquery('simple', query_param) AS q
+    ), ranked AS (
+        SELECT t.id, t.created_at, t.status, t.active_app, t.result,
+               ts_rank_cd(t.result_tsv, query.q) AS rank, query.q
+        FROM public.transcriptions t, query
+        WHERE t.device_id = device_id_param
+          AND t.result_tsv @@ query.q
+        ORDER BY rank DESC, t.created_at DESC
+        LIMIT limit_param
+    )
+    SELECT ranked.id, ranked.created_at, ranked.status, ranked.active_app, ranked.rank,
+           ts_headline('simple', ranked.result, ranked.q,
+                       'StartSel=<mark>, StopSel=</mark>, MaxWords=24, MinWords=8, '
+                       'MaxFragments=2, FragmentDelimiter=" … "')
+    FROM ranked
+    ORDER BY ranked.rank DESC, ranked.created_at DESC;
+$$ LANGUAGE sql STABLE SECURITY DEFINER;
@@ -0,0 +1,73 @@
+-- Per-device, per-app, per-day usage totals for GET /user/{device_id}/app-usage
+-- Maintained by a trigger when a transcription finishes, so analytics read one
+-- row per app and day instead of aggregating transcriptions on every page view
+
+CREATE TABLE IF NOT EXISTS public.app_usage_daily (
+    device_id VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    active_app VARCHAR(255) NOT NULL DEFAULT '',  -- '' when no app was reported
+    transcriptions INTEGER NOT NULL DEFAULT 0,    -- completed
+    failed INTEGER NOT NULL DEFAULT 0,
+    words BIGINT NOT NULL DEFAULT 0,
+    audio_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    processing_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, day, active_app)
+);
+
+ALTER TABLE public.app_usage_daily ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can access app usage" ON public.app_usage_daily
+    FOR ALL USING (auth.role() = 'service_role');
+
+-- Words are approximated as spaces + 1 (no regex in SQLite), the same way on both backends
+CREATE OR REPLACE FUNCTION public.rollup_app_usage()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO public.app_usage_daily AS usage (
+        device_id, day, active_app, transcriptions, failed, words, audio_seconds, processing_seconds
+    ) VALUES (
+        NEW.device_id,
+        (NEW.created_at AT TIME ZONE 'UTC')::DATE,
+        COALESCE(NEW.active_app, ''),
+        CASE WHEN NEW.status = 'completed' THEN 1 ELSE 0 END,
+        CASE WHEN NEW.status = 'failed' THEN 1 ELSE 0 END,
+        CASE WHEN btrim(COALESCE(NEW.result, '')) = '' THEN 0
+             ELSE length(btrim(NEW.result)) - length(replace(btrim(NEW.result), ' ', '')) + 1 END,
+        COALESCE(NEW.duration, 0),
+        COALESCE(NEW.processing_time, 0)
+    )
+    ON CONFLICT (device_id, day, active_app) DO UPDATE SET
+        transcriptions = usage.transcriptions + EXCLUDED.transcriptions,
+        failed = usage.failed + EXCLUDED.failed,
+        words = usage.words + EXCLUDED.words,
+        audio_seconds = usage.audio_seconds + EXCLUDED.audio_seconds,
+        processing_seconds = usage.processing_seconds + EXCLUDED.processing_seconds;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS rollup_app_usage ON public.transcriptions;
+CREATE TRIGGER rollup_app_usage AFTER UPDATE OF status ON public.transcriptions
+    FOR EACH ROW
+    WHEN (NEW.status IN ('completed', 'failed') AND OLD.status IS DISTINCT FROM NEW.status
+          AND NEW.device_id IS NOT NULL)
+    EXECUTE FUNCTION public.rollup_app_usage();
+
+-- Totals for transcriptions that finished before the trigger existed
+INSERT INTO public.app_usage_daily (
+    device_id, day, active_app, transcriptions, failed, words, audio_seconds, processing_seconds
+)
+SELECT
+    device_id,
+    (created_at AT TIME ZONE 'UTC')::DATE,
+    COALESCE(active_app, ''),
+    COUNT(*) FILTER (WHERE status = 'completed'),
+    COUNT(*) FILTER (WHERE status = 'failed'),
+    COALESCE(SUM(CASE WHEN btrim(COALESCE(result, '')) = '' THEN 0
+                      ELSE length(btrim(result)) - length(replace(btrim(result), ' ', '')) + 1 END), 0),
+    COALESCE(SUM(duration), 0),
+    COALESCE(SUM(processing_time), 0)
+FROM public.transcriptions
+WHERE status IN ('completed', 'failed') AND device_id IS NOT NULL
+GROUP BY 1, 2, 3
+ON CONFLICT (device_id, day, active_app) DO NOTHING;
@@ -0,0 +1,78 @@
+-- Device registration in one round trip (POST /register and a device's first request)
+-- Returns the whole public.users row plus "created", so the backend no longer
+-- follows the RPC with a SELECT. Device identities never sign in with a password,
+-- so their auth.users row gets an empty encrypted_password instead of a bcrypt
+-- hash of a shared constant, which cost every new device a bf hash in Postgres
+
+CREATE OR REPLACE FUNCTION public.register_device(device_id_param TEXT)
+RETURNS JSONB AS $$
+DECLARE
+    user_row public.users;
+    user_uuid UUID;
+BEGIN
+    SELECT * INTO user_row FROM public.users WHERE device_id = device_id_param;
+    IF FOUND THEN
+        RETURN to_jsonb(user_row) || jsonb_build_object('created', false);
+    END IF;
+
+    -- Concurrent first requests from one device wait here, then find its user
+    PERFORM pg_advisory_xact_lock(hashtextextended('register_device:' || device_id_param, 0));
+    SELECT * INTO user_row FROM public.users WHERE device_id = device_id_param;
+    IF FOUND THEN
+        RETURN to_jsonb(user_row) || jsonb_build_object('created', false);
+    END IF;
+
+    INSERT INTO auth.users (
+        instance_id,
+        id,
+        aud,
+        role,
+        email,
+        encrypted_password,
+        email_confirmed_at,
+        recovery_sent_at,
+        last_sign_in_at,
+        raw_app_meta_data,
+        raw_user_meta_data,
+        created_at,
+        updated_at,
+        confirmation_token,
+        email_change,
+        email_change_token_new,
+        recovery_token
+    ) VALUES (
+        '00000000-0000-0000-0000-000000000000',
+        gen_random_uuid(),
+        'authenticated',
+        'authenticated',
+        device_id_param || '@device.whisperme.local',
+        '',
+        NOW(),
+        NOW(),
+        NOW(),
+        '{"provider":"device","providers":["device"]}'::jsonb,
+        jsonb_build_object('device_id', device_id_param),
+        NOW(),
+        NOW(),
+        '',
+        '',
+        '',
+        ''
+    ) RETURNING id INTO user_uuid;
+
+    -- handle_new_user has inserted the public.users row
+    UPDATE public.users SET device_id = device_id_param WHERE id = user_uuid
+    RETURNING * INTO user_row;
+
+    RETURN to_jsonb(user_row) || jsonb_build_object('created', true);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- create_transcription and older clients keep calling this; new devices now go
+-- through register_device and skip the bcrypt hash as well
+CREATE OR REPLACE FUNCTION public.get_or_create_user_by_device_id(device_id_param TEXT)
+RETURNS UUID AS $$
+BEGIN
+    RETURN (public.register_device(device_id_param)->>'id')::UUID;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
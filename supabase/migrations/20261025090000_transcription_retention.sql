@@ -0,0 +1,217 @@
+-- Retention tiers for transcriptions
+-- 1. Prompts are stored once in prompt_templates and referenced by prompt_id, instead
+--    of repeating the same text on every row (a trigger converts new rows)
+-- 2. archive_transcriptions() moves the bulky text of finished transcriptions older
+--    than a cutoff (result, screen_context, error_message) to transcriptions_archive,
+--    whose columns are lz4-compressed, and leaves a slim row behind
+-- 3. transcriptions_full joins both back, so reads see archived rows unchanged, and
+--    search_transcriptions keeps finding them: result_tsv outlives the text it indexes
+
+CREATE TABLE IF NOT EXISTS public.prompt_templates (
+    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    text TEXT NOT NULL,
+    digest BYTEA GENERATED ALWAYS AS (sha256(convert_to(text, 'UTF8'))) STORED UNIQUE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE public.transcriptions
+ADD COLUMN IF NOT EXISTS prompt_id BIGINT REFERENCES public.prompt_templates(id),
+ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP WITH TIME ZONE;
+
+CREATE TABLE IF NOT EXISTS public.transcriptions_archive (
+    id UUID PRIMARY KEY REFERENCES public.transcriptions(id) ON DELETE CASCADE,
+    result TEXT,
+    screen_context TEXT,
+    error_message TEXT,
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- lz4 instead of pglz, and compress rows from ~128 bytes up instead of only past 2 kB
+ALTER TABLE public.transcriptions_archive ALTER COLUMN result SET COMPRESSION lz4;
+ALTER TABLE public.transcriptions_archive ALTER COLUMN screen_context SET COMPRESSION lz4;
+ALTER TABLE public.transcriptions_archive ALTER COLUMN error_message SET COMPRESSION lz4;
+ALTER TABLE public.transcriptions_archive SET (toast_tuple_target = 128);
+
+-- Finds the next rows to archive without walking the ones already archived
+CREATE INDEX IF NOT EXISTS idx_transcriptions_unarchived
+ON public.transcriptions(created_at) WHERE archived_at IS NULL;
+
+ALTER TABLE public.prompt_templates ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.transcriptions_archive ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can access prompt templates" ON public.prompt_templates
+    FOR ALL USING (auth.role() = 'service_role');
+CREATE POLICY "Service role can access transcription archive" ON public.transcriptions_archive
+    FOR ALL USING (auth.role() = 'service_role');
+
+CREATE OR REPLACE FUNCTION public.intern_prompt(prompt_param TEXT)
+RETURNS BIGINT AS $$
+DECLARE
+    template_id BIGINT;
+BEGIN
+    INSERT INTO public.prompt_templates (text) VALUES (prompt_param)
+    ON CONFLICT (digest) DO NOTHING
+    RETURNING id INTO template_id;
+    IF template_id IS NULL THEN
+        SELECT id INTO template_id FROM public.prompt_templates
+        WHERE digest = sha256(convert_to(prompt_param, 'UTF8'));
+    END IF;
+    RETURN template_id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION public.dedupe_transcription_prompt()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.prompt IS NOT NULL AND NEW.prompt <> '' THEN
+        NEW.prompt_id := public.intern_prompt(NEW.prompt);
+        NEW.prompt := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS dedupe_transcription_prompt ON public.transcriptions;
+CREATE TRIGGER dedupe_transcription_prompt BEFORE INSERT ON public.transcriptions
+    FOR EACH ROW EXECUTE FUNCTION public.dedupe_transcription_prompt();
+
+-- Existing prompts (one pass over the table; run at a quiet time on large tables)
+INSERT INTO public.prompt_templates (text)
+SELECT DISTINCT prompt FROM public.transcriptions WHERE prompt IS NOT NULL AND prompt <> ''
+ON CONFLICT (digest) DO NOTHING;
+
+UPDATE public.transcriptions t
+SET prompt_id = p.id, prompt = NULL
+FROM public.prompt_templates p
+WHERE t.prompt IS NOT NULL AND t.prompt <> ''
+  AND p.digest = sha256(convert_to(t.prompt, 'UTF8'));
+
+-- Archives up to limit_param finished transcriptions created before cutoff_param,
+-- oldest first, and returns how many. Rows another run has locked are skipped, so
+-- concurrent runs (several workers or hosts) never archive a row twice
+CREATE OR REPLACE FUNCTION public.archive_transcriptions(
+    cutoff_param TIMESTAMP WITH TIME ZONE,
+    limit_param INTEGER DEFAULT 500
+)
+RETURNS INTEGER AS $$
+DECLARE
+    archived_count INTEGER;
+BEGIN
+    WITH batch AS (
+        SELECT id FROM public.transcriptions
+        WHERE archived_at IS NULL AND created_at < cutoff_param AND status IN ('completed', 'failed')
+        ORDER BY created_at
+        LIMIT limit_param
+        FOR UPDATE SKIP LOCKED
+    ), archived AS (
+        INSERT INTO public.transcriptions_archive (id, result, screen_context, error_message)
+        SELECT t.id, t.result, t.screen_context, t.error_message
+        FROM public.transcriptions t JOIN batch ON batch.id = t.id
+        ON CONFLICT (id) DO NOTHING
+        RETURNING id
+    )
+    UPDATE public.transcriptions t
+    SET result = NULL, screen_context = NULL, error_message = NULL, archived_at = NOW()
+    FROM archived
+    WHERE t.id = archived.id;
+
+    GET DIAGNOSTICS archived_count = ROW_COUNT;
+    RETURN archived_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Both run with the owner's rights, so only the backend may call them
+REVOKE EXECUTE ON FUNCTION public.intern_prompt(TEXT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.archive_transcriptions(TIMESTAMP WITH TIME ZONE, INTEGER)
+    FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.intern_prompt(TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION public.archive_transcriptions(TIMESTAMP WITH TIME ZONE, INTEGER) TO service_role;
+
+-- result_tsv was generated from result, so archiving (result = NULL) emptied it. As a
+-- plain column kept by a trigger it holds on to the archived text's vector instead
+ALTER TABLE public.transcriptions ALTER COLUMN result_tsv DROP EXPRESSION IF EXISTS;
+
+CREATE OR REPLACE FUNCTION public.transcription_result_tsv()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.result IS NOT NULL OR NEW.archived_at IS NULL THEN
+        NEW.result_tsv := to_tsvector('simple', COALESCE(NEW.result, ''));
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS transcription_result_tsv ON public.transcriptions;
+CREATE TRIGGER transcription_result_tsv BEFORE INSERT OR UPDATE OF result ON public.transcriptions
+    FOR EACH ROW EXECUTE FUNCTION public.transcription_result_tsv();
+
+-- As in 20261022090000_transcription_search.sql, with snippets of archived rows built
+-- from the archive (still only for the returned page)
+CREATE OR REPLACE FUNCTION public.search_transcriptions(
+    device_id_param TEXT,
+    query_param TEXT,
+    limit_param INTEGER DEFAULT 20
+)
+RETURNS TABLE (
+    id UUID,
+    created_at TIMESTAMP WITH TIME ZONE,
+    status VARCHAR,
+    active_app VARCHAR,
+    rank REAL,
+    snippet TEXT
+) AS $$
+    WITH query AS (
+        SELECT plainto_tsquery('simple', query_param) AS q
+    ), ranked AS (
+        SELECT t.id, t.created_at, t.status, t.active_app, t.result,
+               ts_rank_cd(t.result_tsv, query.q) AS rank, query.q
+        FROM public.transcriptions t, query
+        WHERE t.device_id = device_id_param
+          AND t.result_tsv @@ query.q
+        ORDER BY rank DESC, t.created_at DESC
+        LIMIT limit_param
+    )
+    SELECT ranked.id, ranked.created_at, ranked.status, ranked.active_app, ranked.rank,
+           ts_headline('simple', COALESCE(ranked.result, a.result), ranked.q,
+                       'StartSel=<mark>, StopSel=</mark>, MaxWords=24, MinWords=8, '
+                       'MaxFragments=2, FragmentDelimiter=" … "')
+    FROM ranked
+    LEFT JOIN public.transcriptions_archive a ON a.id = ranked.id
+    ORDER BY ranked.rank DESC, ranked.created_at DESC;
+$$ LANGUAGE sql STABLE SECURITY DEFINER;
+
+-- What the backend reads: every column of transcriptions, with the prompt text and
+-- archived text filled back in. Filters on device_id, created_at and id still use
+-- the transcriptions indexes (the joins are on primary keys). A view runs with its
+-- owner's rights unless it is security_invoker, which would let anon and authenticated
+-- read every device's rows through PostgREST; it is also reserved for the backend
+CREATE OR REPLACE VIEW public.transcriptions_full WITH (security_invoker = true) AS
+SELECT
+    t.id,
+    t.user_id,
+    t.device_id,
+    t.filename,
+    t.file_path,
+    t.file_size,
+    t.duration,
+    t.language,
+    t.model,
+    COALESCE(t.prompt, p.text) AS prompt,
+    t.prompt_id,
+    t.active_app,
+    COALESCE(t.screen_context, a.screen_context) AS screen_context,
+    t.status,
+    t.progress,
+    COALESCE(t.result, a.result) AS result,
+    COALESCE(t.error_message, a.error_message) AS error_message,
+    t.processing_time,
+    t.created_at,
+    t.updated_at,
+    t.completed_at,
+    t.archived_at
+FROM public.transcriptions t
+LEFT JOIN public.prompt_templates p ON p.id = t.prompt_id
+LEFT JOIN public.transcriptions_archive a ON a.id = t.id;
+
+REVOKE ALL ON public.transcriptions_full FROM PUBLIC, anon, authenticated;
+GRANT SELECT ON public.transcriptions_full TO service_role;
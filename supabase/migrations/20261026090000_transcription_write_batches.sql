@@ -0,0 +1,110 @@
+-- Batched transcription writes for the backend's write outbox (OUTBOX_PATH): each
+-- replay round sends the same kind of write for many transcriptions in one call
+-- instead of one round trip per row. The rows arrive as a JSON array.
+
+-- create_transcription for many rows; ids already present are skipped. Returns how
+-- many were inserted
+CREATE OR REPLACE FUNCTION public.create_transcriptions(rows_param JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    created_count INTEGER;
+BEGIN
+    -- Each device's user once, then a single multi-row insert
+    PERFORM public.get_or_create_user_by_device_id(devices.device_id)
+    FROM (SELECT DISTINCT r.device_id FROM jsonb_to_recordset(rows_param) AS r(device_id TEXT)) devices;
+
+    INSERT INTO public.transcriptions (
+        id,
+        user_id,
+        device_id,
+        filename,
+        language,
+        model,
+        prompt,
+        active_app,
+        screen_context,
+        file_size,
+        duration,
+        status
+    )
+    SELECT
+        r.id,
+        u.id,
+        r.device_id,
+        r.filename,
+        COALESCE(r.language, 'auto'),
+        COALESCE(r.model, 'gpt-4o-transcribe'),
+        r.prompt,
+        r.active_app,
+        r.screen_context,
+        r.file_size,
+        r.duration,
+        'processing'
+    FROM jsonb_to_recordset(rows_param) AS r(
+        id UUID, device_id TEXT, filename VARCHAR, language VARCHAR, model VARCHAR, prompt TEXT,
+        active_app VARCHAR, screen_context TEXT, file_size BIGINT, duration REAL
+    )
+    JOIN public.users u ON u.device_id = r.device_id
+    ON CONFLICT (id) DO NOTHING;
+
+    GET DIAGNOSTICS created_count = ROW_COUNT;
+    RETURN created_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- update_transcription_result for many rows; returns how many were found
+CREATE OR REPLACE FUNCTION public.update_transcription_results(results_param JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    updated_count INTEGER;
+BEGIN
+    UPDATE public.transcriptions t
+    SET
+        result = r.result,
+        status = COALESCE(r.status, 'completed'),
+        processing_time = r.processing_time,
+        error_message = r.error_message,
+        completed_at = CASE WHEN COALESCE(r.status, 'completed') = 'completed' THEN NOW() ELSE NULL END,
+        updated_at = NOW()
+    FROM jsonb_to_recordset(results_param) AS r(
+        id UUID, result TEXT, status VARCHAR, processing_time REAL, error_message TEXT
+    )
+    WHERE t.id = r.id;
+
+    GET DIAGNOSTICS updated_count = ROW_COUNT;
+    RETURN updated_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Field updates (progress, size, duration, ...) for many rows, each with its own set
+-- of fields; a field left out keeps its value. Returns how many rows were found
+CREATE OR REPLACE FUNCTION public.update_transcriptions(updates_param JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    updated_count INTEGER;
+BEGIN
+    UPDATE public.transcriptions t
+    SET
+        progress = CASE WHEN u.fields ? 'progress' THEN (u.fields->>'progress')::INTEGER ELSE t.progress END,
+        file_size = CASE WHEN u.fields ? 'file_size' THEN (u.fields->>'file_size')::BIGINT ELSE t.file_size END,
+        duration = CASE WHEN u.fields ? 'duration' THEN (u.fields->>'duration')::REAL ELSE t.duration END,
+        status = CASE WHEN u.fields ? 'status' THEN u.fields->>'status' ELSE t.status END,
+        result = CASE WHEN u.fields ? 'result' THEN u.fields->>'result' ELSE t.result END,
+        error_message = CASE WHEN u.fields ? 'error_message' THEN u.fields->>'error_message'
+                             ELSE t.error_message END,
+        updated_at = NOW()
+    FROM jsonb_to_recordset(updates_param) AS u(id UUID, fields JSONB)
+    WHERE t.id = u.id;
+
+    GET DIAGNOSTICS updated_count = ROW_COUNT;
+    RETURN updated_count;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- They run with the owner's rights, so only the backend may call them
+REVOKE EXECUTE ON FUNCTION public.create_transcriptions(JSONB) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.update_transcription_results(JSONB) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.update_transcriptions(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.create_transcriptions(JSONB) TO service_role;
+GRANT EXECUTE ON FUNCTION public.update_transcription_results(JSONB) TO service_role;
+GRANT EXECUTE ON FUNCTION public.update_transcriptions(JSONB) TO service_role;
@@ -0,0 +1,185 @@
+"""
+Header-only audio duration probe for WhisperMe Backend
+Reads container metadata of WAV, MP3 and M4A files without decoding audio
+"""
+
+import io
+import logging
+import struct
+from typing import BinaryIO, Optional
+
+logger = logging.getLogger(__name__)
+
+# Used to estimate a duration from the upload size when the header gives nothing
+ASSUMED_BYTES_PER_SECOND = 16000  # ~128 kbps
+
+# MPEG audio frame tables, indexed by [version][layer]
+_MPEG_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MPEG_SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    2.5: (11025, 12000, 8000),
+}
+
+# How far into an MP3 we look for the first frame (after any ID3v2 tag)
+_MP3_SYNC_SCAN_BYTES = 64 * 1024
+
+
+def probe_duration(fileobj: BinaryIO, file_size: Optional[int] = None) -> Optional[float]:
+    """Return the duration in seconds from the container header, or None if unknown"""
+    if file_size is None:
+        fileobj.seek(0, io.SEEK_END)
+        file_size = fileobj.tell()
+    fileobj.seek(0)
+    head = fileobj.read(12)
+
+    try:
+        if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+            return _probe_wav(fileobj, file_size)
+        if head[4:8] == b"ftyp":
+            return _probe_mp4(fileobj, file_size)
+        if head[:3] == b"ID3" or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+            return _probe_mp3(fileobj, file_size)
+    except (struct.error, ValueError, IndexError, ZeroDivisionError) as e:
+        logger.warning(f"Audio header probe failed: {str(e)}")
+    return None
+
+
+def probe_duration_bytes(data: bytes) -> Optional[float]:
+    """Probe an in-memory upload"""
+    return probe_duration(io.BytesIO(data), len(data))
+
+
+def estimate_duration(duration: Optional[float], file_size: int) -> float:
+    """Best-effort duration for scheduling when the probe could not read a header"""
+    if duration is not None:
+        return duration
+    return file_size / ASSUMED_BYTES_PER_SECOND
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    """Read `size` bytes; a truncated file raises struct.error, like a short unpack"""
+    data = f.read(size)
+    if len(data) < size:
+        raise struct.error(f"truncated header: expected {size} bytes, got {len(data)}")
+    return data
+
+
+def _probe_wav(f: BinaryIO, file_size: int) -> Optional[float]:
+    f.seek(12)
+    byte_rate = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"fmt ":
+            fmt = f.read(min(chunk_size, 16))
+            byte_rate = struct.unpack("<I", fmt[8:12])[0]
+            f.seek(chunk_size - len(fmt) + (chunk_size & 1), io.SEEK_CUR)
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            # Recorders that stream to disk may leave the size as 0 or 0xFFFFFFFF
+            available = file_size - f.tell()
+            if chunk_size == 0 or chunk_size > available:
+                chunk_size = available
+            return chunk_size / byte_rate
+        else:
+            f.seek(chunk_size + (chunk_size & 1), io.SEEK_CUR)
+
+
+def _probe_mp4(f: BinaryIO, file_size: int) -> Optional[float]:
+    moov = _find_box(f, 0, file_size, b"moov")
+    if moov is None:
+        return None
+    mvhd = _find_box(f, moov[0], moov[1], b"mvhd")
+    if mvhd is None:
+        return None
+    f.seek(mvhd[0])
+    version = _read_exact(f, 1)[0]
+    f.seek(3, io.SEEK_CUR)  # flags
+    if version == 1:
+        _, _, timescale, duration = struct.unpack(">QQIQ", _read_exact(f, 28))
+    else:
+        _, _, timescale, duration = struct.unpack(">IIII", _read_exact(f, 16))
+    return duration / timescale
+
+
+def _find_box(f: BinaryIO, start: int, end: int, box_type: bytes) -> Optional[tuple]:
+    """Return (payload_start, payload_end) of the first box of box_type in [start, end)"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, kind = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return None
+        if kind == box_type:
+            return offset + header_size, offset + size
+        offset += size
+    return None
+
+
+def _probe_mp3(f: BinaryIO, file_size: int) -> Optional[float]:
+    f.seek(0)
+    audio_start = 0
+    id3 = f.read(10)
+    if id3[:3] == b"ID3":
+        if len(id3) < 10:
+            raise struct.error("truncated ID3 header")
+        size = (id3[6] << 21) | (id3[7] << 14) | (id3[8] << 7) | id3[9]
+        audio_start = 10 + size + (10 if id3[5] & 0x10 else 0)
+
+    f.seek(audio_start)
+    window = f.read(_MP3_SYNC_SCAN_BYTES)
+    for i in range(len(window) - 4):
+        if window[i] != 0xFF or window[i + 1] & 0xE0 != 0xE0:
+            continue
+        frame = _parse_mpeg_header(window[i:i + 4])
+        if frame is None:
+            continue
+        version, layer, bitrate, sample_rate, mono = frame
+        frame_start = audio_start + i
+        samples_per_frame = 384 if layer == 1 else (1152 if version == 1 or layer == 2 else 576)
+
+        # VBR files carry a total frame count in a Xing/Info or VBRI header
+        side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+        xing = window[i + 4 + side_info:i + 4 + side_info + 12]
+        if xing[:4] in (b"Xing", b"Info") and struct.unpack(">I", xing[4:8])[0] & 0x1:
+            return struct.unpack(">I", xing[8:12])[0] * samples_per_frame / sample_rate
+        vbri = window[i + 36:i + 36 + 18]
+        if vbri[:4] == b"VBRI":
+            return struct.unpack(">I", vbri[14:18])[0] * samples_per_frame / sample_rate
+
+        # Constant bitrate: the stream length gives the duration
+        return (file_size - frame_start) * 8 / (bitrate * 1000)
+    return None
+
+
+def _parse_mpeg_header(header: bytes) -> Optional[tuple]:
+    version_bits = (header[1] >> 3) & 0x3
+    layer_bits = (header[1] >> 1) & 0x3
+    bitrate_index = header[2] >> 4
+    sample_index = (header[2] >> 2) & 0x3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_index == 3:
+        return None
+
+    version = {0: 2.5, 2: 2, 3: 1}[version_bits]
+    layer = 4 - layer_bits
+    bitrate = _MPEG_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index]
+    sample_rate = _MPEG_SAMPLE_RATES[version][sample_index]
+    mono = (header[3] >> 6) == 3
+    return version, layer, bitrate, sample_rate, mono
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for WhisperMe Backend hot functions
+
+Times small, pure pieces of request handling (no network, no database) and
+compares them with the stored baselines in hot_path_baselines.json. A case is
+reported as a regression, and the script exits with status 1, only when its
+median is slower than the baseline by more than --threshold, by more than the
+noise measured in both runs, and by at least --min-delta-ns.
+
+    python benchmarks/bench_hot_paths.py                    # compare with baselines
+    python benchmarks/bench_hot_paths.py --save-baseline    # record new baselines
+    python benchmarks/bench_hot_paths.py --only calculate verify_token
+
+Each run also times a fixed pure-Python reference workload and compares cases
+relative to it, which absorbs most of the difference between machines and CPU
+frequency; baselines are still best recorded on the machine you compare on.
+"""
+
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import timeit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# main.py reads its configuration at import; nothing here talks to Supabase or OpenAI
+os.environ.update({
+    "OPENAI_API_KEY": "bench",
+    "SUPABASE_URL": "http://127.0.0.1:9",
+    "SUPABASE_SERVICE_ROLE_KEY": "bench",
+    "SECRET_KEY": "bench-secret-key-with-at-least-32-bytes",
+    "LOG_FILE": "",
+    "LOG_LEVEL": "WARNING",
+})
+os.environ.pop("METRICS_DIR", None)
+
+DEFAULT_BASELINES = os.path.join(BACKEND_DIR, "benchmarks", "hot_path_baselines.json")
+REFERENCE_WORDS = [f"word{i % 97}" for i in range(200)]
+
+
+def reference_workload():
+    """Interpreter-bound work with no code from this repo, used to scale results between runs"""
+    counts = {}
+    for word in REFERENCE_WORDS:
+        counts[word] = counts.get(word, 0) + 1
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def build_cases():
+    """name -> zero-argument callable; setup work happens here, outside the timed call"""
+    import main as backend
+    from fastapi.responses import JSONResponse
+    from fastapi.security import HTTPAuthorizationCredentials
+
+    credentials = HTTPAuthorizationCredentials(
+        scheme="Bearer", credentials=backend.create_access_token({"sub": "bench-user"})
+    )
+    chat_response = dict(
+        response="The result is 42. " * 20,
+        function_calls=[backend.FunctionCall(name="calculate", arguments={"expression": "6 * 7"},
+                                             result="6 * 7 = 42", status="completed")],
+        has_function_calls=True,
+    )
+    transcribe_payload = {
+        "success": True,
+        "transcription": "Hi John, thanks for the update on the quarterly numbers. " * 10,
+        "transcription_id": "0b8c2d4e-8f5a-4f0e-9a51-3c7e2f1d9b6a",
+        "model_used": "gpt-4o-transcribe",
+        "language": "en",
+        "usage": {"transcriptions_used": 12, "transcriptions_limit": 50, "subscription_tier": "free"},
+    }
+
+    return {
+        "calculate": lambda: backend.calculate("(12.5 + 7) * 3 ** 2 / -4"),
+        "normalize_phone_number": lambda: backend.normalize_phone_number("(415) 555-0132"),
+        "execute_function": lambda: backend.execute_function("calculate", {"expression": "6 * 7"}),
+        "execute_function_unknown": lambda: backend.execute_function("open_garage", {}),
+        "build_transcription_prompt": lambda: backend.build_transcription_prompt("Names: Anneke, Siobhan"),
+        "chat_response_json": lambda: backend.ChatResponse(**chat_response).model_dump_json(),
+        "json_response_render": lambda: JSONResponse(content=transcribe_payload).body,
+        "verify_token": lambda: backend.verify_token(credentials),
+    }
+
+
+# A slowdown within this many times the combined (root-sum-square) spread of both runs is noise
+NOISE_FACTOR = 3.0
+
+
+def measure(funcs: dict, repeat: int, rounds: int) -> dict:
+    """
+    name -> median per-call time in nanoseconds over `rounds` x `repeat` runs of
+    ~0.2s each, and the spread of those runs: their median absolute deviation as
+    a fraction of the median. Each round times every function in turn, so the
+    spread includes the machine getting slower or faster during the whole run,
+    not only between back-to-back runs.
+    """
+    timers = {}
+    for name, func in funcs.items():
+        timer = timeit.Timer(func)
+        timers[name] = (timer, timer.autorange()[0])
+    runs = {name: [] for name in funcs}
+    for _ in range(rounds):
+        for name, (timer, number) in timers.items():
+            runs[name].extend(total / number * 1e9 for total in timer.repeat(repeat=repeat, number=number))
+    results = {}
+    for name, times in runs.items():
+        median = statistics.median(times)
+        results[name] = {"ns": median, "spread": statistics.median(abs(t - median) for t in times) / median}
+    return results
+
+
+def stored_case(entry) -> dict:
+    """A baseline entry; baselines from before spreads were stored are bare numbers"""
+    return entry if isinstance(entry, dict) else {"ns": entry, "spread": 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", help="Run only these cases")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case in each round")
+    parser.add_argument("--rounds", type=int, default=3, help="Passes over all cases")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed slowdown over baseline as a fraction (default 0.25 = 25%%)")
+    parser.add_argument("--min-delta-ns", type=float, default=200.0,
+                        help="Smallest slowdown per call that counts, in ns (default 200)")
+    parser.add_argument("--baselines", default=DEFAULT_BASELINES)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baselines")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    cases = build_cases()
+    unknown = set(args.only or []) - set(cases)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))} (choose from {', '.join(cases)})")
+
+    stored = {"reference_ns": None, "cases": {}}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            stored = json.load(f)
+    baselines = {name: stored_case(entry) for name, entry in stored["cases"].items()}
+    stored_reference = stored_case(stored["reference_ns"]) if stored["reference_ns"] else None
+
+    selected = {name: func for name, func in cases.items() if not args.only or name in args.only}
+    measured = measure({"reference": reference_workload, **selected}, args.repeat, args.rounds)
+    reference = measured.pop("reference")
+    # Baseline times as they would be on this machine today; the scaling is as noisy as the reference
+    scale = reference["ns"] / stored_reference["ns"] if stored_reference else 1.0
+    reference_spreads = [reference["spread"], stored_reference["spread"] if stored_reference else 0.0]
+
+    results = {}
+    for name, current in measured.items():
+        baseline = baselines.get(name)
+        expected = baseline["ns"] * scale if baseline else None
+        # Independent sources of noise, so their spreads add in quadrature
+        noise = (NOISE_FACTOR * math.hypot(baseline["spread"], current["spread"], *reference_spreads)
+                 if baseline else None)
+        results[name] = {
+            "ns_per_call": round(current["ns"], 1),
+            "spread": round(current["spread"], 4),
+            "baseline_ns": round(expected, 1) if expected else None,
+            "change": round(current["ns"] / expected - 1, 3) if expected else None,
+            "noise": round(noise, 3) if noise is not None else None,
+        }
+    regressions = [name for name, r in results.items()
+                   if r["change"] is not None and r["change"] > max(args.threshold, r["noise"])
+                   and r["ns_per_call"] - r["baseline_ns"] >= args.min_delta_ns]
+
+    if args.save_baseline:
+        # Cases not run this time are rescaled to the new reference
+        baselines = {name: {"ns": round(case["ns"] * scale, 1), "spread": case["spread"]}
+                     for name, case in baselines.items()}
+        baselines.update({name: {"ns": r["ns_per_call"], "spread": r["spread"]} for name, r in results.items()})
+        with open(args.baselines, "w") as f:
+            json.dump({"reference_ns": {"ns": round(reference["ns"], 1), "spread": round(reference["spread"], 4)},
+                       "cases": dict(sorted(baselines.items()))}, f, indent=2)
+            f.write("\n")
+
+    if args.json:
+        print(json.dumps({"threshold": args.threshold, "min_delta_ns": args.min_delta_ns,
+                          "reference_ns": round(reference["ns"], 1), "scale": round(scale, 3),
+                          "results": results, "regressions": regressions}, indent=2))
+    else:
+        print(f"reference workload {reference['ns']:.1f} ns ({scale:.2f}x baseline machine)")
+        print(f"{'case':<28}{'ns/call':>12}{'baseline':>12}{'change':>10}{'noise':>9}")
+        for name, r in results.items():
+            baseline = f"{r['baseline_ns']:.1f}" if r["baseline_ns"] else "-"
+            change = f"{r['change']:+.1%}" if r["change"] is not None else "-"
+            noise = f"±{r['noise']:.1%}" if r["noise"] is not None else "-"
+            flag = "  REGRESSION" if name in regressions else ""
+            print(f"{name:<28}{r['ns_per_call']:>12.1f}{baseline:>12}{change:>10}{noise:>9}{flag}")
+        if args.save_baseline:
+            print(f"Baselines saved to {args.baselines}")
+
+    if regressions and not args.save_baseline:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Transcription model latency benchmark for WhisperMe Backend
+
+Compares latency per model on the bundled sample recordings (g.mp3, minas.mp3)
+through the real dispatch layer (transcription_models.dispatch_transcription).
+
+Replay (default, offline and reproducible):
+    python benchmarks/bench_models.py --iterations 20
+
+Record fresh responses and timings from the OpenAI API (needs OPENAI_API_KEY):
+    python benchmarks/bench_models.py --record
+
+Replay needs a recording with timings for every model and sample; without one
+it exits with an error. --dispatch-only replays the exported texts instantly
+instead, which times the local dispatch layer and nothing upstream.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from audio_probe import probe_duration  # noqa: E402
+from fakes import RecordedOpenAI  # noqa: E402
+from transcription_models import MODEL_PROFILES, dispatch_transcription  # noqa: E402
+
+DEFAULT_SAMPLES = [os.path.join(REPO_DIR, "g.mp3"), os.path.join(REPO_DIR, "minas.mp3")]
+DEFAULT_RECORDING = os.path.join(BACKEND_DIR, "benchmarks", "recorded_transcriptions.json")
+
+# Transcripts exported from each model; used when a recording has no entry
+EXPORTED_TEXTS = {
+    "gpt-4o-transcribe": os.path.join(REPO_DIR, "gpt-4o-transcribe_export.md"),
+    "gpt-4o-mini-transcribe": os.path.join(REPO_DIR, "gpt-4o-mini-transcribe_export.txt"),
+}
+
+
+class _TimedTranscriptions:
+    """Wraps `audio.transcriptions` to timestamp the first streamed event"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.started = None
+        self.first_event = None
+
+    def create(self, **params):
+        self.started = time.perf_counter()
+        self.first_event = None
+        response = self.inner.create(**params)
+        if not params.get("stream"):
+            self.first_event = time.perf_counter()
+            return response
+        return self._timed(response)
+
+    def _timed(self, events):
+        for event in events:
+            if self.first_event is None:
+                self.first_event = time.perf_counter()
+            yield event
+
+
+class _TimedClient:
+    def __init__(self, client):
+        self.audio = type("Audio", (), {})()
+        self.audio.transcriptions = _TimedTranscriptions(client.audio.transcriptions)
+
+
+def load_exported_texts():
+    texts = {}
+    for model, path in EXPORTED_TEXTS.items():
+        if os.path.exists(path):
+            with open(path) as f:
+                texts[model] = f.read().strip()
+    # whisper-1 has no export; replay the gpt-4o-transcribe text for it
+    if "gpt-4o-transcribe" in texts:
+        texts.setdefault("whisper-1", texts["gpt-4o-transcribe"])
+    return texts
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(client, models, samples, iterations):
+    timed = _TimedClient(client)
+    results = []
+    for model in models:
+        for sample in samples:
+            totals, first_events = [], []
+            text, model_used = "", model
+            for _ in range(iterations):
+                start = time.perf_counter()
+                text, model_used = dispatch_transcription(timed, sample, model, "auto", None)
+                totals.append(time.perf_counter() - start)
+                first_events.append(timed.audio.transcriptions.first_event - start)
+            with open(sample, "rb") as f:
+                duration = probe_duration(f)
+            results.append({
+                "model": model,
+                "model_used": model_used,
+                "sample": os.path.basename(sample),
+                "audio_seconds": round(duration or 0.0, 3),
+                "iterations": iterations,
+                "total_p50_ms": round(statistics.median(totals) * 1000, 3),
+                "total_p95_ms": round(percentile(totals, 95) * 1000, 3),
+                "first_event_p50_ms": round(statistics.median(first_events) * 1000, 3),
+                "words": len(text.split()),
+            })
+    return results
+
+
+def record(models, samples, path):
+    """Call the real API once per model and sample and store text plus timings"""
+    from openai import OpenAI
+
+    client = _TimedClient(OpenAI())
+    recording = {}
+    for model in models:
+        for sample in samples:
+            start = time.perf_counter()
+            text, _ = dispatch_transcription(client, sample, model, "auto", None)
+            total = time.perf_counter() - start
+            first = client.audio.transcriptions.first_event - start
+            recording.setdefault(model, {})[os.path.basename(sample)] = {
+                "text": text,
+                "first_delta_s": round(first, 4),
+                "total_s": round(total, 4),
+            }
+            print(f"recorded {model} / {os.path.basename(sample)}: {total * 1000:.0f} ms")
+    with open(path, "w") as f:
+        json.dump(recording, f, indent=2)
+    print(f"Recording written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=list(MODEL_PROFILES))
+    parser.add_argument("--samples", nargs="+", default=DEFAULT_SAMPLES)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--recording", default=DEFAULT_RECORDING)
+    parser.add_argument("--record", action="store_true", help="Record from the live API instead of replaying")
+    parser.add_argument("--dispatch-only", action="store_true",
+                        help="Replay exported texts without upstream timing (local dispatch overhead only)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.models, args.samples, args.recording)
+        return
+
+    if args.dispatch_only:
+        client = RecordedOpenAI({}, load_exported_texts())
+    else:
+        if not os.path.exists(args.recording):
+            parser.error(f"No recording at {args.recording}. Record one with --record (needs OPENAI_API_KEY), "
+                         f"or pass --dispatch-only to time the local dispatch layer alone")
+        with open(args.recording) as f:
+            recording = json.load(f)
+        # An entry without timings would replay instantly and report dispatch overhead as model latency
+        missing = [f"{model} / {os.path.basename(sample)}" for model in args.models for sample in args.samples
+                   if "total_s" not in recording.get(model, {}).get(os.path.basename(sample), {})]
+        if missing:
+            parser.error(f"{args.recording} has no timings for: {', '.join(missing)}. Run --record again")
+        client = RecordedOpenAI(recording)
+
+    results = run(client, args.models, args.samples, args.iterations)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'model':<24}{'sample':<12}{'audio s':>9}{'p50 ms':>11}{'p95 ms':>11}{'first ms':>11}{'words':>7}")
+    for r in results:
+        print(f"{r['model']:<24}{r['sample']:<12}{r['audio_seconds']:>9}{r['total_p50_ms']:>11}"
+              f"{r['total_p95_ms']:>11}{r['first_event_p50_ms']:>11}{r['words']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Device registration benchmark for WhisperMe Backend
+
+Registers a burst of new devices from a thread pool, as after a release, and
+reports registrations per second for two paths:
+
+    legacy    find_user, then get_or_create_user_by_device_id, then a SELECT of
+              the new row (three round trips; the RPC bcrypt-hashes a constant
+              password for every new device)
+    register  storage.register_device: one register_device RPC returning the
+              full row, no password hash
+
+    python benchmarks/bench_registration.py
+    python benchmarks/bench_registration.py --devices 2000 --concurrency 1 16 64 --db-latency 0.03
+    python benchmarks/bench_registration.py --backends sqlite
+
+Supabase is simulated with fakes.FakeSupabase (--db-latency per round trip);
+the legacy RPC runs a real bcrypt hash at pgcrypto's gen_salt('bf') default
+cost, standing in for the work Postgres did per device. The SQLite backend has
+no network or hash, so it shows only the cost of the extra statements.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import bcrypt  # noqa: E402
+
+from fakes import FakeSupabase  # noqa: E402
+from storage import SQLiteStorage, SupabaseStorage  # noqa: E402
+
+PGCRYPTO_BF_ROUNDS = 6  # gen_salt('bf') without an iteration count
+
+
+class HashingSupabase(FakeSupabase):
+    """get_or_create_user_by_device_id hashes a password for each new device, as the original RPC did"""
+
+    def __init__(self, rounds: int, **kwargs):
+        super().__init__(**kwargs)
+        self.rounds = rounds
+
+    def rpc(self, name, params=None):
+        if name == "get_or_create_user_by_device_id":
+            if not any(user["device_id"] == params["device_id_param"] for user in self.tables["users"]):
+                bcrypt.hashpw(b"device-auth", bcrypt.gensalt(self.rounds))
+        return super().rpc(name, params)
+
+
+def legacy_registration(storage, device_id: str):
+    if storage.find_user(device_id):
+        return
+    storage.get_user(storage.get_or_create_user(device_id))
+
+
+def register_device(storage, device_id: str):
+    storage.register_device(device_id)
+
+
+PATHS = {"legacy": legacy_registration, "register": register_device}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def run(storage, path: str, devices: int, concurrency: int, prefix: str) -> dict:
+    register = PATHS[path]
+    latencies = []
+
+    def one(i):
+        began = time.perf_counter()
+        register(storage, f"{prefix}-{i}")
+        latencies.append(time.perf_counter() - began)
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(devices)))
+    elapsed = time.perf_counter() - began
+    return {
+        "registrations_per_second": round(devices / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=["supabase", "sqlite"], default=["supabase", "sqlite"])
+    parser.add_argument("--devices", type=int, default=500, help="New devices per run")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 16, 64])
+    parser.add_argument("--db-latency", type=float, default=0.02, help="Seconds per simulated Supabase round trip")
+    parser.add_argument("--bcrypt-rounds", type=int, default=PGCRYPTO_BF_ROUNDS)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    for _ in range(20):
+        bcrypt.hashpw(b"device-auth", bcrypt.gensalt(args.bcrypt_rounds))
+    hash_ms = (time.perf_counter() - began) / 20 * 1000
+
+    results = []
+    for backend in args.backends:
+        for concurrency in args.concurrency:
+            for path in PATHS:
+                if backend == "supabase":
+                    fake = HashingSupabase(args.bcrypt_rounds, latency=args.db_latency)
+                    storage = SupabaseStorage(fake)
+                else:
+                    directory = tempfile.mkdtemp(prefix="whisperme-registration-")
+                    storage = SQLiteStorage(os.path.join(directory, "users.db"))
+                result = run(storage, path, args.devices, concurrency, f"{path}-{concurrency}")
+                result.update(backend=backend, path=path, concurrency=concurrency)
+                if backend == "supabase":
+                    result["round_trips_per_registration"] = round(fake.round_trips / args.devices, 2)
+                results.append(result)
+
+    if args.json:
+        print(json.dumps({"bcrypt_ms": round(hash_ms, 2), "results": results}, indent=2))
+        return
+    print(f"bcrypt at cost {args.bcrypt_rounds}: {hash_ms:.2f} ms per hash; "
+          f"{args.devices} new devices per run, {args.db_latency * 1000:.0f} ms per Supabase round trip")
+    print(f"{'backend':<10}{'path':<10}{'conc':>5}{'reg/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'trips':>7}")
+    for r in results:
+        trips = r.get("round_trips_per_registration", "-")
+        print(f"{r['backend']:<10}{r['path']:<10}{r['concurrency']:>5}{r['registrations_per_second']:>10}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{trips:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Full-text search benchmark for WhisperMe Backend
+
+Builds a synthetic corpus of dictated transcriptions (Zipf-distributed words,
+spread over many devices) in a SQLite file, then times
+SQLiteStorage.search_transcriptions (FTS5, ranked, with snippets) against the
+scan it replaces (`result LIKE '%word%'` over the device's rows) for rare,
+common and multi-word queries.
+
+    python benchmarks/bench_search.py                         # 200k transcriptions
+    python benchmarks/bench_search.py --rows 1000000 --devices 50
+    python benchmarks/bench_search.py --db /tmp/corpus.db --keep   # reuse the corpus
+
+The Supabase backend runs the same search in Postgres (GIN index on a tsvector,
+see supabase/migrations/20261022090000_transcription_search.sql); time it there
+with EXPLAIN ANALYZE on a copy of the data.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from storage import SQLiteStorage  # noqa: E402
+
+VOCABULARY_SIZE = 20000
+# Words placed at known frequencies so every query class has matches
+PLANTED = {"quarterly": 0.02, "invoice": 0.002, "zanzibar": 0.0002}
+QUERIES = {
+    "rare word": "zanzibar",
+    "uncommon word": "invoice",
+    "common word": "quarterly",
+    "two words": "quarterly invoice",
+    "stop word": "w1",  # in almost every transcription
+}
+
+
+def build_corpus(storage: SQLiteStorage, rows: int, devices: int, seed: int):
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(1, VOCABULARY_SIZE + 1)]
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, VOCABULARY_SIZE + 1)))
+    device_ids = [f"device-{i}" for i in range(devices)]
+    conn = storage._connect()
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    batch = []
+    for i in range(rows):
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(15, 80))
+        for word, rate in PLANTED.items():
+            if rng.random() < rate:
+                words.insert(rng.randrange(len(words)), word)
+        created_at = (start + timedelta(seconds=i * 30)).isoformat(timespec="microseconds")
+        batch.append((str(uuid.uuid4()), rng.choice(device_ids), " ".join(words), created_at, created_at))
+        if len(batch) == 10000:
+            _insert(conn, batch)
+            batch = []
+    _insert(conn, batch)
+    conn.execute("ANALYZE")
+    return device_ids
+
+
+def _insert(conn, batch):
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO transcriptions (id, device_id, result, status, created_at, updated_at) "
+        "VALUES (?, ?, ?, 'completed', ?, ?)", batch)
+    conn.execute("COMMIT")
+
+
+def scan_search(storage: SQLiteStorage, device_id: str, query: str, limit: int):
+    """What a search without an index does: every word as a LIKE over the device's rows"""
+    words = query.split()
+    sql = ("SELECT id, created_at, status, active_app FROM transcriptions WHERE device_id = ? AND "
+           + " AND ".join("result LIKE ?" for _ in words) + " ORDER BY created_at DESC LIMIT ?")
+    return storage._connect().execute(sql, (device_id, *[f"%{w}%" for w in words], limit)).fetchall()
+
+
+def timed(func, device_ids, rounds):
+    """Median and p95 milliseconds over `rounds` calls, each for a different device"""
+    samples, hits = [], 0
+    for i in range(rounds):
+        began = time.perf_counter()
+        hits += len(func(device_ids[i % len(device_ids)]))
+        samples.append((time.perf_counter() - began) * 1000)
+    samples.sort()
+    return {"median_ms": round(samples[len(samples) // 2], 3),
+            "p95_ms": round(samples[int(len(samples) * 0.95)], 3),
+            "avg_hits": round(hits / rounds, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--db", help="Corpus file (default: a temporary file)")
+    parser.add_argument("--keep", action="store_true", help="Keep the corpus file and reuse it next run")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="whisperme-search-"), "corpus.db")
+    reuse = os.path.exists(path)
+    storage = SQLiteStorage(path)
+    if reuse:
+        device_ids = [row[0] for row in storage._connect().execute(
+            "SELECT DISTINCT device_id FROM transcriptions ORDER BY device_id")]
+        corpus_seconds = 0.0
+    else:
+        began = time.perf_counter()
+        device_ids = build_corpus(storage, args.rows, args.devices, args.seed)
+        corpus_seconds = time.perf_counter() - began
+    rows = storage._connect().execute("SELECT COUNT(*) FROM transcriptions").fetchone()[0]
+
+    results = {}
+    for name, query in QUERIES.items():
+        results[name] = {
+            "query": query,
+            "fts": timed(lambda d: storage.search_transcriptions(d, query, args.limit), device_ids, args.rounds),
+            "scan": timed(lambda d: scan_search(storage, d, query, args.limit), device_ids, args.rounds),
+        }
+
+    if not args.keep:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    if args.json:
+        print(json.dumps({"rows": rows, "devices": len(device_ids), "results": results}, indent=2))
+        return
+    print(f"{rows} transcriptions over {len(device_ids)} devices"
+          + (f" (built in {corpus_seconds:.1f}s)" if corpus_seconds else f" (reused {path})"))
+    print(f"{'query':<18}{'fts median':>12}{'fts p95':>10}{'scan median':>13}{'scan p95':>10}{'hits':>7}")
+    for name, r in results.items():
+        print(f"{name:<18}{r['fts']['median_ms']:>12.3f}{r['fts']['p95_ms']:>10.3f}"
+              f"{r['scan']['median_ms']:>13.3f}{r['scan']['p95_ms']:>10.3f}{r['fts']['avg_hits']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
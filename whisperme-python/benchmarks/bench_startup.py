@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark for WhisperMe Backend
+
+Measures, in fresh processes:
+  - import time of main.py
+  - time from launching uvicorn until the first request (GET /status) succeeds
+
+Supabase and OpenAI are pointed at a closed local port, so nothing leaves the
+machine; the startup warmup fails fast and is logged, as it would be offline.
+
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --imports 15   # slowest imports of main.py
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_ENV = {
+    "SUPABASE_URL": "http://127.0.0.1:9",
+    "SUPABASE_SERVICE_ROLE_KEY": "bench",
+    "OPENAI_API_KEY": "bench",
+    "LOG_FILE": "",
+    "LOG_LEVEL": "WARNING",
+}
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import main; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def bench_env():
+    env = dict(os.environ)
+    env.update(BENCH_ENV)
+    env.pop("METRICS_DIR", None)
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=bench_env(),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_first_request(timeout: float = 30.0) -> float:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/status"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=bench_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"No response from {url} within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def slowest_imports(count: int):
+    """Modules imported by main.py, slowest first (python -X importtime)"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR, env=bench_env(),
+        capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # Each nesting level is indented by two spaces; keep what main.py imports directly
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--imports", type=int, default=0, help="Also list the N slowest imports of main.py")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    first_requests = [measure_first_request() for _ in range(args.runs)]
+    results = {
+        "runs": args.runs,
+        "import_ms_median": round(statistics.median(imports) * 1000, 1),
+        "import_ms_min": round(min(imports) * 1000, 1),
+        "first_request_ms_median": round(statistics.median(first_requests) * 1000, 1),
+        "first_request_ms_min": round(min(first_requests) * 1000, 1),
+    }
+    if args.imports:
+        results["slowest_imports_ms"] = {name: round(us / 1000, 1) for us, name in slowest_imports(args.imports)}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"import main.py         median {results['import_ms_median']:>8} ms   min {results['import_ms_min']:>8} ms")
+    print(f"time to first request  median {results['first_request_ms_median']:>8} ms   "
+          f"min {results['first_request_ms_min']:>8} ms")
+    for name, ms in results.get("slowest_imports_ms", {}).items():
+        print(f"  {name:<32}{ms:>10} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Offline load test for WhisperMe Backend
+
+Starts the app with uvicorn in this process, with the OpenAI and Supabase
+clients replaced by fakes (fakes.FakeOpenAI / fakes.FakeSupabase), then drives
+/transcribe, /chat and /user/{device_id}/status at each concurrency level and
+reports throughput and p50/p95/p99 latency. No network access is needed.
+
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --concurrency 1 8 32 --requests 200 \\
+        --openai-latency 0.4 --db-latency 0.02 --openai-error-rate 0.05
+
+The load generator shares the process (and the GIL) with the server, so compare
+numbers between runs on the same machine rather than reading them as capacity.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+# main.py reads its configuration at import
+os.environ.update({
+    "OPENAI_API_KEY": "loadtest",
+    "SUPABASE_URL": "http://supabase.invalid",
+    "SUPABASE_SERVICE_ROLE_KEY": "loadtest",
+    "LOG_FILE": "",
+    "LOG_LEVEL": os.getenv("LOADTEST_LOG_LEVEL", "WARNING"),
+})
+os.environ.pop("METRICS_DIR", None)
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+from fakes import FakeOpenAI, FakeSupabase  # noqa: E402
+
+ENDPOINTS = ("transcribe", "chat", "status")
+DEFAULT_SAMPLE = os.path.join(REPO_DIR, "g.mp3")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                           lifespan="on"))
+    threading.Thread(target=server.run, name="loadtest-server", daemon=True).start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Server did not start within 30s")
+        time.sleep(0.01)
+    return server
+
+
+def build_request(endpoint: str, i: int, devices: int, audio: bytes):
+    device_id = f"loadtest-{i % devices}"
+    if endpoint == "transcribe":
+        return {
+            "method": "POST",
+            "url": "/transcribe",
+            "data": {"device_id": device_id, "model": "gpt-4o-transcribe"},
+            "files": {"audio_file": ("sample.mp3", audio, "audio/mpeg")},
+            # Distinct keys: identical audio would otherwise be deduplicated
+            "headers": {"Idempotency-Key": uuid.uuid4().hex},
+        }
+    if endpoint == "chat":
+        return {
+            "method": "POST",
+            "url": "/chat",
+            "json": {"message": f"What is {i} + {i}?", "enable_functions": True},
+        }
+    return {"method": "GET", "url": f"/user/{device_id}/status"}
+
+
+async def run_level(base_url: str, endpoint: str, concurrency: int, total: int, devices: int,
+                    audio: bytes) -> dict:
+    latencies, statuses = [], {}
+    next_index = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        async def worker():
+            nonlocal next_index
+            while next_index < total:
+                i = next_index
+                next_index += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.request(**build_request(endpoint, i, devices, audio))
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "statuses": statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and level")
+    parser.add_argument("--devices", type=int, default=100, help="Distinct device ids to spread load over")
+    parser.add_argument("--sample", default=DEFAULT_SAMPLE, help="Audio file sent to /transcribe")
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    parser.add_argument("--openai-jitter", type=float, default=0.1)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--openai-error-kind", choices=["connection", "rate_limit", "server"], default="server")
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--db-jitter", type=float, default=0.01)
+    parser.add_argument("--db-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    import main as backend
+
+    fake_openai = FakeOpenAI(latency=args.openai_latency, jitter=args.openai_jitter,
+                             error_rate=args.openai_error_rate, error_kind=args.openai_error_kind, seed=args.seed)
+    fake_supabase = FakeSupabase(latency=args.db_latency, jitter=args.db_jitter,
+                                 error_rate=args.db_error_rate, seed=args.seed)
+    for i in range(args.devices):
+        fake_supabase.add_user(f"loadtest-{i}")
+    backend.openai_client.set(fake_openai)
+    backend.supabase.set(fake_supabase)
+
+    with open(args.sample, "rb") as f:
+        audio = f.read()
+
+    port = free_port()
+    server = start_server(backend.app, port)
+    base_url = f"http://127.0.0.1:{port}"
+
+    results = []
+    if not args.json:
+        print(f"{'endpoint':<11}{'conc':>5}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+              f"{'max ms':>10}   statuses")
+    try:
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                result = asyncio.run(run_level(base_url, endpoint, concurrency, args.requests, args.devices, audio))
+                results.append(result)
+                if not args.json:
+                    statuses = " ".join(f"{code}:{count}" for code, count in sorted(result["statuses"].items()))
+                    print(f"{endpoint:<11}{concurrency:>5}{result['throughput_rps']:>10}{result['p50_ms']:>10}"
+                          f"{result['p95_ms']:>10}{result['p99_ms']:>10}{result['max_ms']:>10}   {statuses}",
+                          flush=True)
+    finally:
+        server.should_exit = True
+
+    if args.json:
+        print(json.dumps({
+            "config": {k: v for k, v in vars(args).items() if k != "json"},
+            "db_round_trips": fake_supabase.round_trips,
+            "results": results,
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Lazily built upstream clients for WhisperMe Backend
+Importing the OpenAI and Supabase SDKs and building their clients is the slowest
+part of starting a worker, so it happens on first use or in a startup warmup
+instead of at import time
+"""
+
+import importlib
+import logging
+import os
+import ssl
+import threading
+import time
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Loaded lazily by the SDKs on first client use; a preloading master imports
+# them up front so forked workers do not each pay for it
+PRELOAD_MODULES = (
+    "openai",
+    "openai.resources.audio",
+    "openai.resources.chat",
+    "openai.resources.models",
+    "supabase",
+    "httpcore",
+)
+
+_ssl_context: Optional[ssl.SSLContext] = None
+
+
+class LazyClient:
+    """
+    Builds a client on first use (thread-safe) and forwards attribute access to it,
+    so `supabase.table(...)` works whether or not the client exists yet.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self._name = name
+        self._factory = factory
+        self._client = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self) -> bool:
+        return self._client is not None and self._pid == os.getpid()
+
+    def get(self) -> Any:
+        if not self.initialized:
+            with self._lock:
+                if not self.initialized:
+                    # Also rebuilt after a fork: pooled connections must not be shared
+                    started = time.perf_counter()
+                    self._client = self._factory()
+                    self._pid = os.getpid()
+                    logger.info(f"✅ {self._name} client initialized in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return self._client
+
+    def set(self, client: Any):
+        """Use an existing client instead of building one (e.g. a fake in load tests)"""
+        with self._lock:
+            self._client = client
+            self._pid = os.getpid()
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.get(), attr)
+
+
+def shared_ssl_context() -> ssl.SSLContext:
+    """CA bundle loaded once per process (or once before fork) instead of per client"""
+    global _ssl_context
+    if _ssl_context is None:
+        import certifi
+        _ssl_context = ssl.create_default_context(cafile=certifi.where())
+    return _ssl_context
+
+
+def preload():
+    """Import the SDK modules and load the CA bundle without building any clients"""
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning(f"Could not preload {name}: {str(e)}")
+    shared_ssl_context()
+
+
+def create_openai_client(api_key: Optional[str], timeout: float = 30.0, max_retries: int = 2):
+    from openai import DefaultHttpxClient, OpenAI
+
+    return OpenAI(api_key=api_key, timeout=timeout, max_retries=max_retries,
+                  http_client=DefaultHttpxClient(verify=shared_ssl_context()))
+
+
+def create_supabase_client(url: str, key: str):
+    from supabase import create_client
+
+    return create_client(url, key)
@@ -0,0 +1,173 @@
+"""
+Signed device tokens for WhisperMe Backend
+/register issues a short-lived HS256 token carrying the user id, device id and
+subscription tier, so a request that presents one needs no database read to
+know its caller. Revoked tokens are kept in a small denylist until they would
+have expired anyway; the list is shared by all workers through one file.
+"""
+
+import json
+import logging
+import math
+import os
+import secrets
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+TOKEN_TYPE = "device"
+# HS256 keys shorter than the hash output are refused (RFC 7518, section 3.2)
+MIN_SECRET_BYTES = 32
+
+
+class InvalidDeviceToken(Exception):
+    """The token is malformed, badly signed, expired or revoked"""
+
+
+class TokenDenylist:
+    """
+    Revoked token ids (jti) and devices whose earlier tokens are all revoked,
+    each kept only until the tokens it covers expire. Revocations are rare, so
+    every one rewrites the file under a lock; workers reload it when it changes,
+    checking at most once per `refresh_interval` seconds.
+    """
+
+    def __init__(self, path: str, refresh_interval: float = 1.0):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._tokens: Dict[str, float] = {}  # jti -> expiry
+        self._devices: Dict[str, Dict[str, float]] = {}  # device_id -> {"before": issued-before, "expires": expiry}
+        self._mtime: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._tokens) + len(self._devices)
+
+    def is_revoked(self, claims: Dict) -> bool:
+        self._refresh()
+        if claims.get("jti") in self._tokens:
+            return True
+        device = self._devices.get(claims.get("device_id"))
+        return device is not None and claims["iat"] <= device["before"]
+
+    def revoke_token(self, jti: str, expires: float):
+        self._update(lambda: self._tokens.__setitem__(jti, expires))
+
+    def revoke_device(self, device_id: str, ttl: float):
+        """Revoke every token issued to the device until now (none outlives `ttl`)"""
+        now = time.time()
+        self._update(lambda: self._devices.__setitem__(device_id, {"before": now, "expires": now + ttl}))
+
+    def _refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._mtime:
+            self._load()
+            self._mtime = mtime
+
+    def _load(self):
+        tokens, devices = {}, {}
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+            tokens, devices = stored.get("tokens", {}), stored.get("devices", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read the token denylist {self.path}: {str(e)}")
+            return
+        now = time.time()
+        self._tokens = {jti: expires for jti, expires in tokens.items() if expires > now}
+        self._devices = {device_id: entry for device_id, entry in devices.items() if entry["expires"] > now}
+
+    def _update(self, change):
+        import fcntl
+
+        with open(f"{self.path}.lock", "a") as lock_file, self._lock:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._load()  # other workers' revocations, minus expired entries
+            change()
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"tokens": self._tokens, "devices": self._devices}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+            self._checked_at = time.monotonic()
+
+
+class DeviceTokens:
+    """
+    Issue and verify device tokens; jwt is imported on first use. Without a
+    secret of at least MIN_SECRET_BYTES, no token is issued or accepted.
+    """
+
+    def __init__(self, secret: Optional[str], ttl: int = 3600, denylist: Optional[TokenDenylist] = None):
+        self.enabled = secret is not None and len(secret.encode()) >= MIN_SECRET_BYTES
+        self.secret = secret if self.enabled else None
+        self.ttl = ttl
+        self.denylist = denylist
+        self.results = {"valid": 0, "expired": 0, "invalid": 0, "revoked": 0}
+
+    def issue(self, user: Dict) -> Optional[Dict]:
+        """A token for the user's device, or None when tokens are disabled"""
+        import jwt
+
+        if not self.enabled:
+            return None
+        now = time.time()
+        claims = {
+            "typ": TOKEN_TYPE,
+            "sub": str(user["id"]),
+            "device_id": user["device_id"],
+            "tier": user["subscription_tier"],
+            "jti": secrets.token_urlsafe(12),
+            # Rounded down: a token issued just before a device revocation must not look newer
+            "iat": math.floor(now * 1000) / 1000,
+            "exp": int(now) + self.ttl,
+        }
+        token = jwt.encode(claims, self.secret, algorithm="HS256")
+        return {"access_token": token, "token_type": "bearer", "expires_in": self.ttl}
+
+    def verify(self, token: str) -> Dict:
+        """The token's claims; raises InvalidDeviceToken"""
+        import jwt
+
+        if not self.enabled:
+            self.results["invalid"] += 1
+            raise InvalidDeviceToken("Device tokens are disabled")
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=["HS256"],
+                                options={"require": ["exp", "iat", "sub", "jti"]})
+        except jwt.ExpiredSignatureError:
+            self.results["expired"] += 1
+            raise InvalidDeviceToken("Token expired")
+        except jwt.PyJWTError as e:
+            self.results["invalid"] += 1
+            raise InvalidDeviceToken(str(e))
+        if claims.get("typ") != TOKEN_TYPE or not claims.get("device_id"):
+            self.results["invalid"] += 1
+            raise InvalidDeviceToken("Not a device token")
+        if self.denylist is not None and self.denylist.is_revoked(claims):
+            self.results["revoked"] += 1
+            raise InvalidDeviceToken("Token revoked")
+        self.results["valid"] += 1
+        return claims
+
+    def revoke(self, claims: Dict):
+        self.denylist.revoke_token(claims["jti"], claims["exp"])
+
+    def revoke_device(self, device_id: str):
+        self.denylist.revoke_device(device_id, self.ttl)
+
+    def stats(self) -> Dict:
+        return {**self.results, "denylisted": len(self.denylist) if self.denylist is not None else 0}
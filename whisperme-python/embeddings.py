@@ -0,0 +1,261 @@
+"""
+Embeddings for WhisperMe semantic search
+Finished transcriptions are queued and embedded in the background, in batches
+(one embeddings request per batch), then added to their device's vector index on
+disk. NumPy and vector_index.py are loaded on first use, not at import.
+"""
+
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LOCAL_MODEL = "local"
+EMBED_MAX_CHARS = 8000  # Longer dictations are embedded by their beginning
+MAX_EMBED_ATTEMPTS = 3
+
+
+class HashingEmbedder:
+    """
+    Deterministic local stand-in for an embedding model: words and character
+    trigrams hashed into a fixed number of dimensions. Texts sharing words or
+    word fragments land close together. No network, and the same vectors on
+    every machine, so it serves tests, load tests and offline installs.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+        self.name = f"{LOCAL_MODEL}-{dimensions}"
+
+    def _features(self, text: str) -> Iterable[Tuple[str, float]]:
+        for word in re.findall(r"\w+", text.lower()):
+            yield word, 1.0
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+    def embed(self, texts: List[str]):
+        import numpy as np
+
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+                sign = 1.0 if digest & 1 else -1.0
+                vectors[row, (digest >> 1) % self.dimensions] += sign * weight
+        return vectors
+
+
+class OpenAIEmbedder:
+    """OpenAI embeddings, shortened to `dimensions` by the API to keep the index compact"""
+
+    def __init__(self, client, model: str = "text-embedding-3-small", dimensions: int = 256):
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+        self.name = f"{model}-{dimensions}"
+
+    def embed(self, texts: List[str]):
+        import numpy as np
+
+        response = self.client.embeddings.create(model=self.model, input=texts, dimensions=self.dimensions)
+        ordered = sorted(response.data, key=lambda item: item.index)
+        return np.array([item.embedding for item in ordered], dtype=np.float32)
+
+
+def create_embedder(model: str, client, dimensions: int = 256):
+    """EMBEDDING_MODEL=local selects the deterministic HashingEmbedder"""
+    if model == LOCAL_MODEL:
+        return HashingEmbedder(dimensions)
+    return OpenAIEmbedder(client, model, dimensions)
+
+
+class VectorStore:
+    """
+    One index file per device under `directory`, shared by all workers. Writes
+    hold a per-device file lock and replace the file atomically; readers reload
+    a cached index when another worker has changed its file.
+    """
+
+    def __init__(self, directory: str, model: str, exact_max: int = 5000, cache_size: int = 64):
+        self.directory = directory
+        self.model = model
+        self.exact_max = exact_max
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[int, object]]" = OrderedDict()
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, device_id: str) -> str:
+        return os.path.join(self.directory, f"{hashlib.sha256(device_id.encode()).hexdigest()[:32]}.npz")
+
+    def exists(self, device_id: str) -> bool:
+        return os.path.exists(self.path(device_id))
+
+    def _load(self, device_id: str):
+        """The device's index as of its file on disk (None if none or built by another model)"""
+        from vector_index import VectorIndex
+
+        path = self.path(device_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._cache.pop(device_id, None)
+            return None
+        cached = self._cache.get(device_id)
+        if cached and cached[0] == mtime:
+            self._cache.move_to_end(device_id)
+            return cached[1]
+        index, model = VectorIndex.load(path, exact_max=self.exact_max)
+        if model != self.model:
+            logger.info(f"Ignoring vector index built with {model} for a device (now {self.model})")
+            return None
+        self._cache[device_id] = (mtime, index)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return index
+
+    def add(self, device_id: str, ids: List[str], vectors):
+        import fcntl
+        from vector_index import VectorIndex
+
+        path = self.path(device_id)
+        with open(f"{path}.lock", "a") as lock_file, self._lock:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            index = self._load(device_id) or VectorIndex(vectors.shape[1], exact_max=self.exact_max)
+            index.add(ids, vectors)
+            index.save(path, self.model)
+            self._cache[device_id] = (os.stat(path).st_mtime_ns, index)
+
+    def ids(self, device_id: str) -> set:
+        with self._lock:
+            index = self._load(device_id)
+            return set(index.ids) if index else set()
+
+    def search(self, device_id: str, query_vector, k: int) -> Tuple[List[Tuple[str, float]], int]:
+        """(id, similarity) matches and the number of vectors the device has"""
+        with self._lock:
+            index = self._load(device_id)
+            if index is None:
+                return [], 0
+            return index.search(query_vector, k), len(index)
+
+
+class EmbeddingPipeline:
+    """
+    `submit()` queues a finished transcription and returns at once; a background
+    thread embeds the queue in batches of up to `batch_size`, waiting at most
+    `max_delay` seconds for a batch to fill. Each worker runs its own.
+    """
+
+    def __init__(self, embedder, store: VectorStore, batch_size: int = 64, max_delay: float = 2.0,
+                 max_queue: int = 10000):
+        self.embedder = embedder
+        self.store = store
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.indexed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Tuple[str, str, str]]" = queue.Queue(maxsize=max_queue)
+        self._backfilling: set = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, device_id: str, transcription_id: str, text: Optional[str]):
+        if not text or not text.strip():
+            return
+        try:
+            self._queue.put_nowait((device_id, transcription_id, text[:EMBED_MAX_CHARS]))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Embedding queue full, not indexing transcription {transcription_id}")
+
+    def backfill(self, device_id: str, rows: Iterable[Dict]):
+        """Queue a device's finished transcriptions that are not in its index yet (once per worker)"""
+        if device_id in self._backfilling:
+            return
+        self._backfilling.add(device_id)
+        queued = 0
+        try:
+            known = self.store.ids(device_id)
+            for row in rows:
+                if row["id"] not in known and row.get("status") == "completed":
+                    self.submit(device_id, row["id"], row.get("result"))
+                    queued += 1
+        except Exception as e:
+            self._backfilling.discard(device_id)  # try again on the next search
+            logger.error(f"Backfilling the vector index of device {device_id} failed: {str(e)}")
+            return
+        logger.info(f"🧭 Queued {queued} transcriptions for the vector index of device {device_id}")
+
+    def search(self, device_id: str, query: str, k: int = 10) -> Tuple[List[Tuple[str, float]], int]:
+        query_vector = self.embedder.embed([query[:EMBED_MAX_CHARS]])[0]
+        return self.store.search(device_id, query_vector, k)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="embedding-pipeline", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _next_batch(self) -> List[Tuple[str, str, str]]:
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._index(batch)
+
+    def _index(self, batch: List[Tuple[str, str, str]]):
+        for attempt in range(1, MAX_EMBED_ATTEMPTS + 1):
+            try:
+                vectors = self.embedder.embed([text for _, _, text in batch])
+                break
+            except Exception as e:
+                if attempt == MAX_EMBED_ATTEMPTS or self._stop.is_set():
+                    self.failed += len(batch)
+                    logger.error(f"Embedding {len(batch)} transcriptions failed, skipping them: {str(e)}")
+                    return
+                logger.warning(f"Embedding batch failed (attempt {attempt}): {str(e)}")
+                self._stop.wait(2 ** attempt)
+
+        by_device: Dict[str, List[int]] = {}
+        for position, (device_id, _, _) in enumerate(batch):
+            by_device.setdefault(device_id, []).append(position)
+        for device_id, positions in by_device.items():
+            try:
+                self.store.add(device_id, [batch[p][1] for p in positions], vectors[positions])
+                self.indexed += len(positions)
+            except Exception as e:
+                self.failed += len(positions)
+                logger.error(f"Could not update the vector index of device {device_id}: {str(e)}")
+
+    def stats(self) -> Dict:
+        return {"queued": self._queue.qsize(), "indexed": self.indexed, "failed": self.failed,
+                "dropped": self.dropped}
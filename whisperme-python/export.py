@@ -0,0 +1,69 @@
+"""
+Transcription history export for WhisperMe Backend
+Rows are encoded as NDJSON or CSV a page at a time, and gzip-compressed as they
+are written when asked, so an export of any size holds one page in memory.
+"""
+
+import csv
+import io
+import json
+import zlib
+from typing import Dict, List, Sequence
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+class ExportEncoder:
+    """
+    Encodes successive pages of rows into the bytes of one export. With
+    `compress` the output is a gzip stream, flushed after every page so the
+    client receives each page as it is encoded; a resumed export is a new gzip
+    member, and members appended to one file decompress as a single file.
+    """
+
+    def __init__(self, fmt: str, columns: Sequence[str], compress: bool = False, header: bool = True):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format: {fmt} (use {' or '.join(FORMATS)})")
+        self.format = fmt
+        self.columns = list(columns)
+        self.rows = 0
+        self._header = header and fmt == "csv"
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+
+    @property
+    def media_type(self) -> str:
+        return "application/gzip" if self._compressor else FORMATS[self.format]
+
+    def filename(self, stem: str) -> str:
+        return f"{stem}.{self.format}" + (".gz" if self._compressor else "")
+
+    def encode(self, rows: List[Dict]) -> bytes:
+        text = self._take_header()
+        if self.format == "ndjson":
+            text += "".join(json.dumps(row, default=str, ensure_ascii=False) + "\n" for row in rows)
+        elif rows:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows([["" if row.get(c) is None else row.get(c) for c in self.columns] for row in rows])
+            text += buffer.getvalue()
+        self.rows += len(rows)
+        return self._output(text.encode(), final=False)
+
+    def finish(self) -> bytes:
+        """The last bytes of the export (the CSV header if there were no rows, the gzip trailer)"""
+        return self._output(self._take_header().encode(), final=True)
+
+    def _take_header(self) -> str:
+        if not self._header:
+            return ""
+        self._header = False
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(self.columns)
+        return buffer.getvalue()
+
+    def _output(self, data: bytes, final: bool) -> bytes:
+        if self._compressor is None:
+            return data
+        if final:
+            return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH)
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH) if data else b""
@@ -0,0 +1,555 @@
+"""
+Local stand-ins for WhisperMe upstream services
+Run standalone:  python fakes.py realtime --port 8765
+then start the backend with OPENAI_REALTIME_URL=ws://127.0.0.1:8765
+
+FakeOpenAI and FakeSupabase replace the SDK clients in-process (see
+benchmarks/loadtest.py), with configurable latency and error injection.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from websockets.asyncio.server import serve
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRANSCRIPT = "Hey Minas, I hope this mail finds you well."
+
+
+class FakeRealtimeUpstream:
+    """
+    Speaks the OpenAI Realtime transcription protocol on a local port.
+
+    On `input_audio_buffer.commit` it streams the scripted transcript word by
+    word as delta events, then sends the completed event. `fail_with` makes it
+    answer the commit with an error event instead.
+    """
+
+    def __init__(self, transcript: str = DEFAULT_TRANSCRIPT, delta_delay: float = 0.0,
+                 host: str = "127.0.0.1", port: int = 0, fail_with: Optional[str] = None):
+        self.transcript = transcript
+        self.delta_delay = delta_delay
+        self.host = host
+        self.port = port
+        self.fail_with = fail_with
+        self.sessions = []
+        self.received_bytes = 0
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await serve(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def _handle(self, ws):
+        item = 0
+        async for message in ws:
+            event = json.loads(message)
+            kind = event.get("type")
+            if kind == "transcription_session.update":
+                self.sessions.append(event["session"])
+                await ws.send(json.dumps({"type": "transcription_session.updated", "session": event["session"]}))
+            elif kind == "input_audio_buffer.append":
+                self.received_bytes += len(base64.b64decode(event["audio"]))
+            elif kind == "input_audio_buffer.commit":
+                item += 1
+                item_id = f"item_{item}"
+                await ws.send(json.dumps({"type": "input_audio_buffer.committed", "item_id": item_id}))
+                if self.fail_with:
+                    await ws.send(json.dumps({"type": "error", "error": {"message": self.fail_with}}))
+                    continue
+                words = self.transcript.split(" ")
+                for i, word in enumerate(words):
+                    if self.delta_delay:
+                        await asyncio.sleep(self.delta_delay)
+                    delta = word if i == 0 else f" {word}"
+                    await ws.send(json.dumps({
+                        "type": "conversation.item.input_audio_transcription.delta",
+                        "item_id": item_id,
+                        "delta": delta,
+                    }))
+                await ws.send(json.dumps({
+                    "type": "conversation.item.input_audio_transcription.completed",
+                    "item_id": item_id,
+                    "transcript": self.transcript,
+                }))
+
+
+def upload_name(file) -> str:
+    """The file name the SDK sends: the name of a (name, file) tuple, else the file's own"""
+    if isinstance(file, tuple):
+        return file[0]
+    return os.path.basename(getattr(file, "name", "audio"))
+
+
+class RecordedTranscriptions:
+    """
+    Replays recorded transcription responses through the OpenAI client interface
+    (`client.audio.transcriptions.create`), including streamed delta events.
+
+    A recording maps model -> sample file name -> {"text", "first_delta_s",
+    "total_s"}. Timings are replayed with sleeps, so latency comparisons between
+    models are reproducible offline. Without timings the replay is immediate
+    and only the local dispatch overhead is measured.
+    """
+
+    def __init__(self, recording: Dict, fallback_texts: Optional[Dict[str, str]] = None):
+        self.recording = recording
+        self.fallback_texts = fallback_texts or {}
+        self.calls = []
+
+    def _response(self, model: str, file_name: str) -> Dict:
+        entry = self.recording.get(model, {}).get(file_name)
+        if entry is None:
+            if model not in self.fallback_texts:
+                raise KeyError(f"No recorded response for {model} / {file_name}")
+            entry = {"text": self.fallback_texts[model]}
+        return entry
+
+    def create(self, file, model: str, stream: bool = False, **params):
+        file_name = upload_name(file)
+        self.calls.append((model, file_name, stream))
+        entry = self._response(model, file_name)
+        if not stream:
+            if entry.get("total_s"):
+                time.sleep(entry["total_s"])
+            return SimpleNamespace(text=entry["text"])
+        return self._stream(entry)
+
+    @staticmethod
+    def _stream(entry: Dict):
+        words = entry["text"].split(" ")
+        first_delta = entry.get("first_delta_s", 0.0)
+        per_word = max(0.0, entry.get("total_s", first_delta) - first_delta) / max(1, len(words))
+        if first_delta:
+            time.sleep(first_delta)
+        for i, word in enumerate(words):
+            if i and per_word:
+                time.sleep(per_word)
+            yield SimpleNamespace(type="transcript.text.delta", delta=word if i == 0 else f" {word}")
+        yield SimpleNamespace(type="transcript.text.done", text=entry["text"])
+
+
+class RecordedOpenAI:
+    """Minimal OpenAI client stand-in exposing `audio.transcriptions`"""
+
+    def __init__(self, recording: Dict, fallback_texts: Optional[Dict[str, str]] = None):
+        self.audio = SimpleNamespace(transcriptions=RecordedTranscriptions(recording, fallback_texts))
+
+
+class FaultProfile:
+    """
+    Latency and error injection for one fake service.
+
+    Each call sleeps `latency` seconds plus up to `jitter` more (uniformly
+    distributed; blocking, like the sync SDK clients the fakes replace) and
+    fails with probability `error_rate`.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def call(self) -> bool:
+        """Wait out the simulated latency; returns True if this call should fail"""
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = self.error_rate > 0 and self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+
+def _openai_error(kind: str, url: str):
+    """An exception of the type the OpenAI SDK raises for `kind`"""
+    import httpx
+    import openai
+
+    request = httpx.Request("POST", url)
+    if kind == "connection":
+        return openai.APIConnectionError(request=request)
+    status, error = {
+        "rate_limit": (429, openai.RateLimitError),
+        "server": (500, openai.InternalServerError),
+        "bad_request": (400, openai.BadRequestError),
+    }[kind]
+    return error(f"Injected {kind} error", response=httpx.Response(status, request=request), body=None)
+
+
+class FakeTranscriptions:
+    """`audio.transcriptions`: streams (or returns) a fixed transcript"""
+
+    def __init__(self, faults: FaultProfile, error_kind: str, transcript: str):
+        self.faults = faults
+        self.error_kind = error_kind
+        self.transcript = transcript
+        self.calls = 0
+        self.file_names = []
+
+    def create(self, file, model: str, stream: bool = False, **params):
+        self.calls += 1
+        self.file_names.append(upload_name(file))
+        if self.faults.call():
+            raise _openai_error(self.error_kind, "https://api.openai.com/v1/audio/transcriptions")
+        if not stream:
+            return SimpleNamespace(text=self.transcript)
+        return self._stream()
+
+    def _stream(self):
+        words = self.transcript.split(" ")
+        for i, word in enumerate(words):
+            yield SimpleNamespace(type="transcript.text.delta", delta=word if i == 0 else f" {word}")
+        yield SimpleNamespace(type="transcript.text.done", text=self.transcript)
+
+
+class FakeChatCompletions:
+    """`chat.completions`: answers every conversation with the same reply"""
+
+    def __init__(self, faults: FaultProfile, error_kind: str, reply: str):
+        self.faults = faults
+        self.error_kind = error_kind
+        self.reply = reply
+        self.calls = 0
+
+    def create(self, model: str, messages: List[Dict], **params):
+        self.calls += 1
+        if self.faults.call():
+            raise _openai_error(self.error_kind, "https://api.openai.com/v1/chat/completions")
+        message = SimpleNamespace(role="assistant", content=self.reply, tool_calls=None)
+        return SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")])
+
+
+class FakeOpenAI:
+    """
+    OpenAI client stand-in for the calls the backend makes: audio transcriptions,
+    chat completions, models.retrieve (warmup) and with_options. `error_kind` is
+    "connection", "rate_limit" or "server", which all trigger model fallback, or
+    "bad_request" (the upstream rejecting the audio itself).
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 error_kind: str = "server", transcript: str = DEFAULT_TRANSCRIPT,
+                 chat_reply: str = "Sure, here is a short answer.", seed: Optional[int] = None):
+        self.faults = FaultProfile(latency, jitter, error_rate, seed)
+        self.audio = SimpleNamespace(transcriptions=FakeTranscriptions(self.faults, error_kind, transcript))
+        self.chat = SimpleNamespace(completions=FakeChatCompletions(self.faults, error_kind, chat_reply))
+        self.models = SimpleNamespace(retrieve=lambda model, **params: SimpleNamespace(id=model, object="model"))
+
+    def with_options(self, **options) -> "FakeOpenAI":
+        return self
+
+
+class FakeSupabaseError(Exception):
+    """Injected Supabase failure"""
+
+
+class _FakeQuery:
+    """The subset of the PostgREST query builder the backend uses"""
+
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.filters = []
+        self.columns = None
+        self.ordering = []
+        self.changes = None
+        self.row_limit = None
+
+    def select(self, *columns, **options):
+        if columns and columns[0] != "*":
+            self.columns = [c.strip() for c in ",".join(columns).split(",")]
+        return self
+
+    def eq(self, column: str, value):
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def gte(self, column: str, value):
+        self.filters.append(lambda row: str(row.get(column)) >= str(value))
+        return self
+
+    def lte(self, column: str, value):
+        self.filters.append(lambda row: str(row.get(column)) <= str(value))
+        return self
+
+    def in_(self, column: str, values):
+        allowed = {str(value) for value in values}
+        self.filters.append(lambda row: str(row.get(column)) in allowed)
+        return self
+
+    def or_(self, filters: str):
+        # Only the form storage.list_transcriptions sends: a.lt."x",and(a.eq."x",b.lt.y)
+        match = re.fullmatch(r'(\w+)\.lt\."([^"]*)",and\(\1\.eq\."\2",(\w+)\.lt\.([^)]*)\)', filters)
+        if match is None:
+            raise FakeSupabaseError(f"Unsupported or filter: {filters}")
+        first, value, second, tie = match.groups()
+        self.filters.append(lambda row: (str(row.get(first)), str(row.get(second))) < (value, tie))
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count: int):
+        self.row_limit = count
+        return self
+
+    def update(self, changes: Dict):
+        self.changes = changes
+        return self
+
+    def execute(self):
+        self.db.round_trip()
+        with self.db.lock:
+            source = self.db.view(self.table)
+            if source is None:
+                source = self.db.tables.setdefault(self.table, [])
+            rows = [row for row in source if all(matches(row) for matches in self.filters)]
+            if self.changes is not None:
+                for row in rows:
+                    row.update(self.changes)
+            for column, desc in reversed(self.ordering):
+                rows.sort(key=lambda row: str(row.get(column)), reverse=desc)
+            if self.row_limit is not None:
+                rows = rows[:self.row_limit]
+            if self.columns is not None:
+                return SimpleNamespace(data=[{c: row.get(c) for c in self.columns} for row in rows])
+            return SimpleNamespace(data=[dict(row) for row in rows])
+
+
+class _FakeRpc:
+    def __init__(self, db: "FakeSupabase", name: str, params: Dict):
+        self.db = db
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        self.db.round_trip()
+        handler = getattr(self.db, f"_rpc_{self.name}", None)
+        if handler is None:
+            raise FakeSupabaseError(f"Unknown RPC {self.name}")
+        with self.db.lock:
+            return SimpleNamespace(data=handler(**self.params))
+
+
+class FakeSupabase:
+    """
+    In-memory Supabase client: `table()` queries and the RPCs from the
+    migrations (get_or_create_user_by_device_id, register_device, create_transcription,
+    update_transcription_result, increment_transcriptions, search_transcriptions,
+    archive_transcriptions), the app_usage_daily rollup and prompt dedupe triggers,
+    and the transcriptions_full view. Every `execute()` is one simulated round trip.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.faults = FaultProfile(latency, jitter, error_rate, seed)
+        self.tables: Dict[str, List[Dict]] = {"users": [], "transcriptions": [], "app_usage_daily": [],
+                                              "prompt_templates": [], "transcriptions_archive": []}
+        self.lock = threading.Lock()
+        self.round_trips = 0
+
+    def round_trip(self):
+        self.round_trips += 1
+        if self.faults.call():
+            raise FakeSupabaseError("Injected Supabase error")
+
+    def table(self, name: str) -> _FakeQuery:
+        return _FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Optional[Dict] = None) -> _FakeRpc:
+        return _FakeRpc(self, name, params or {})
+
+    def view(self, name: str) -> Optional[List[Dict]]:
+        """Rows of transcriptions_full: prompts and archived text filled back in (copies, read-only)"""
+        if name != "transcriptions_full":
+            return None
+        prompts = {template["id"]: template["text"] for template in self.tables["prompt_templates"]}
+        archive = {archived["id"]: archived for archived in self.tables["transcriptions_archive"]}
+        rows = []
+        for transcription in self.tables["transcriptions"]:
+            row = dict(transcription)
+            if row.get("prompt") is None:
+                row["prompt"] = prompts.get(row.get("prompt_id"))
+            archived = archive.get(row["id"], {})
+            for column in ("result", "screen_context", "error_message"):
+                if row.get(column) is None:
+                    row[column] = archived.get(column)
+            rows.append(row)
+        return rows
+
+    def add_user(self, device_id: str, subscription_tier: str = "free") -> Dict:
+        with self.lock:
+            return self._insert_user(device_id, subscription_tier)
+
+    def _insert_user(self, device_id: str, subscription_tier: str = "free") -> Dict:
+        now = datetime.now(timezone.utc).isoformat()
+        user = {
+            "id": str(uuid.uuid4()),
+            "device_id": device_id,
+            "subscription_tier": subscription_tier,
+            "transcriptions_used": 0,
+            "created_at": now,
+            "last_reset": now,
+        }
+        self.tables["users"].append(user)
+        return user
+
+    def _rpc_get_or_create_user_by_device_id(self, device_id_param: str):
+        for user in self.tables["users"]:
+            if user["device_id"] == device_id_param:
+                return user["id"]
+        return self._insert_user(device_id_param)["id"]
+
+    def _rpc_register_device(self, device_id_param: str):
+        for user in self.tables["users"]:
+            if user["device_id"] == device_id_param:
+                return {**user, "created": False}
+        return {**self._insert_user(device_id_param), "created": True}
+
+    def _rpc_create_transcription(self, device_id_param: str, id_param: Optional[str] = None, **params):
+        if id_param and any(t["id"] == id_param for t in self.tables["transcriptions"]):
+            return id_param
+        transcription = {
+            "id": id_param or str(uuid.uuid4()),
+            "device_id": device_id_param,
+            "status": "pending",
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="microseconds"),
+            **{name[:-len("_param")]: value for name, value in params.items()},
+        }
+        if transcription.get("prompt"):
+            # What the dedupe_transcription_prompt trigger does
+            transcription["prompt_id"] = self._intern_prompt(transcription.pop("prompt"))
+            transcription["prompt"] = None
+        self.tables["transcriptions"].append(transcription)
+        return transcription["id"]
+
+    def _rpc_update_transcription_result(self, transcription_id_param: str, result_param: Optional[str],
+                                         status_param: str = "completed", processing_time_param=None,
+                                         error_message_param: Optional[str] = None):
+        for transcription in self.tables["transcriptions"]:
+            if transcription["id"] == transcription_id_param:
+                previous = transcription.get("status")
+                transcription.update(result=result_param, status=status_param,
+                                     processing_time=processing_time_param, error_message=error_message_param)
+                if status_param in ("completed", "failed") and previous != status_param:
+                    self._rollup_app_usage(transcription)
+                return True
+        return False
+
+    def _intern_prompt(self, text: str) -> int:
+        for template in self.tables["prompt_templates"]:
+            if template["text"] == text:
+                return template["id"]
+        template = {"id": len(self.tables["prompt_templates"]) + 1, "text": text}
+        self.tables["prompt_templates"].append(template)
+        return template["id"]
+
+    def _rpc_archive_transcriptions(self, cutoff_param: str, limit_param: int = 500):
+        due = sorted((t for t in self.tables["transcriptions"]
+                      if t.get("archived_at") is None and t["created_at"] < cutoff_param
+                      and t.get("status") in ("completed", "failed")),
+                     key=lambda t: t["created_at"])[:limit_param]
+        now = datetime.now(timezone.utc).isoformat(timespec="microseconds")
+        for transcription in due:
+            self.tables["transcriptions_archive"].append({
+                "id": transcription["id"],
+                "result": transcription.get("result"),
+                "screen_context": transcription.get("screen_context"),
+                "error_message": transcription.get("error_message"),
+                "archived_at": now,
+            })
+            transcription.update(result=None, screen_context=None, error_message=None, archived_at=now)
+        return len(due)
+
+    def _rollup_app_usage(self, transcription: Dict):
+        # What the rollup_app_usage trigger does when a transcription finishes
+        key = (transcription["device_id"], transcription["created_at"][:10], transcription.get("active_app") or "")
+        for usage in self.tables["app_usage_daily"]:
+            if (usage["device_id"], usage["day"], usage["active_app"]) == key:
+                break
+        else:
+            usage = {"device_id": key[0], "day": key[1], "active_app": key[2], "transcriptions": 0, "failed": 0,
+                     "words": 0, "audio_seconds": 0.0, "processing_seconds": 0.0}
+            self.tables["app_usage_daily"].append(usage)
+        completed = transcription["status"] == "completed"
+        usage["transcriptions" if completed else "failed"] += 1
+        text = (transcription.get("result") or "").strip()
+        usage["words"] += text.count(" ") + 1 if text else 0
+        usage["audio_seconds"] += transcription.get("duration") or 0
+        usage["processing_seconds"] += transcription.get("processing_time") or 0
+
+    def _rpc_search_transcriptions(self, device_id_param: str, query_param: str, limit_param: int = 20):
+        # Word containment and match counts stand in for tsvector ranking and ts_headline
+        words = [w.lower() for w in re.findall(r"\w+", query_param)]
+        hits = []
+        for transcription in self.tables["transcriptions"]:
+            text = transcription.get("result") or ""
+            tokens = [w.lower() for w in re.findall(r"\w+", text)]
+            if transcription["device_id"] != device_id_param or not words or not set(words) <= set(tokens):
+                continue
+            snippet = re.sub(r"\w+", lambda m: f"<mark>{m.group()}</mark>" if m.group().lower() in words
+                             else m.group(), text)
+            hits.append({"id": transcription["id"], "created_at": transcription.get("created_at"),
+                         "status": transcription.get("status"), "active_app": transcription.get("active_app"),
+                         "rank": float(sum(tokens.count(w) for w in words)), "snippet": snippet})
+        hits.sort(key=lambda hit: (hit["rank"], hit["created_at"] or ""), reverse=True)
+        return hits[:limit_param]
+
+    def _rpc_increment_transcriptions(self, device_id_param: str):
+        for user in self.tables["users"]:
+            if user["device_id"] == device_id_param:
+                user["transcriptions_used"] += 1
+                return user["transcriptions_used"]
+        return 0
+
+
+async def _serve_forever(fake):
+    async with fake:
+        logger.info(f"Fake realtime upstream listening on {fake.url}")
+        await asyncio.Future()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run a local fake upstream service")
+    parser.add_argument("service", choices=["realtime"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--transcript", default=DEFAULT_TRANSCRIPT)
+    parser.add_argument("--delta-delay", type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(_serve_forever(FakeRealtimeUpstream(
+        transcript=args.transcript, delta_delay=args.delta_delay, host=args.host, port=args.port
+    )))
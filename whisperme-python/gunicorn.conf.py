@@ -0,0 +1,48 @@
+"""
+Gunicorn configuration for WhisperMe Backend (multi-worker production mode)
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The app is imported once in the master (preload_app) and the loaded state is
+frozen before forking, so workers share it copy-on-write. Each worker then
+opens its own upstream connections and only accepts traffic once they are warm.
+"""
+
+import os
+import shutil
+import tempfile
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 8000)}"
+workers = int(os.getenv("WORKERS", 2))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+errorlog = "-"
+loglevel = "info"
+
+# Read by main.py at import: workers warm their clients in the lifespan before serving
+os.environ.setdefault("WARMUP_BEFORE_SERVING", "true")
+# Workers add up each other's metrics through snapshot files
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "whisperme-metrics"))
+
+
+def on_starting(server):
+    # Start with an empty metrics directory so a previous run is not counted
+    metrics_dir = os.environ["METRICS_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    import main
+
+    main.prepare_for_fork()
+
+
+def post_fork(server, worker):
+    import main
+
+    main.after_fork()
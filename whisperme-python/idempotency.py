@@ -0,0 +1,255 @@
+"""
+Idempotency store for WhisperMe Backend
+Deduplicates retried requests: in-flight duplicates join the running job and
+completed ones replay the stored result within a retention window. With a
+shared file, a retry that lands on another worker is deduplicated as well.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    owner INTEGER NOT NULL,
+    result TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_updated ON idempotency(updated_at);
+"""
+
+SQL_LOOKUP = "SELECT state, owner, result, updated_at FROM idempotency WHERE key = ?"
+SQL_CLAIM = (
+    "INSERT OR REPLACE INTO idempotency (key, state, owner, result, updated_at) "
+    "VALUES (?, 'running', ?, NULL, ?)"
+)
+SQL_COMPLETE = "UPDATE idempotency SET state = 'done', result = ?, updated_at = ? WHERE key = ? AND owner = ?"
+SQL_RELEASE = "DELETE FROM idempotency WHERE key = ? AND owner = ? AND state = 'running'"
+# Bounded per claim, like the in-memory expiry
+SQL_EXPIRE = (
+    "DELETE FROM idempotency WHERE key IN "
+    "(SELECT key FROM idempotency WHERE state = 'done' AND updated_at < ? LIMIT 64)"
+)
+
+# Outcomes of claiming a key in the shared file
+CLAIMED, RUNNING, DONE = "claimed", "running", "done"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Entry:
+    __slots__ = ("task", "completed_at")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.completed_at: Optional[float] = None
+
+
+class IdempotencyStore:
+    """
+    Map from idempotency key to a running or finished job.
+
+    Jobs run as their own task, so a client that disconnects mid-request does
+    not cancel the work its retry is about to attach to. Only successful
+    results are retained; a failed job is forgotten so the retry runs again.
+
+    Within a worker, jobs are tracked in memory. With `path`, every worker on
+    the box also claims keys in one SQLite file and stores finished results
+    there as JSON: a retry on another worker waits for the claiming worker and
+    replays its result. A claim whose worker died, or that is older than
+    `lease_seconds`, is taken over.
+    """
+
+    def __init__(self, retention_seconds: float = 600, max_entries: int = 10000, path: Optional[str] = None,
+                 lease_seconds: float = 300, poll_interval: float = 0.1):
+        self.retention_seconds = retention_seconds
+        self.max_entries = max_entries
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._local = threading.local()
+        self.started = 0
+        self.joined = 0
+        self.replayed = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @staticmethod
+    def derive_key(device_id: str, client_key: Optional[str], content: bytes, *params: str) -> str:
+        """Scope a client-supplied key to the device, or hash the request body"""
+        if client_key:
+            return f"{device_id}:key:{client_key}"
+        digest = hashlib.sha256(content)
+        for param in params:
+            digest.update(b"\0" + (param or "").encode())
+        return f"{device_id}:sha256:{digest.hexdigest()}"
+
+    def get(self, key: str) -> Optional[asyncio.Task]:
+        """Return this worker's running or retained job for a key, if any"""
+        entry = self._entries.get(key)
+        return entry.task if entry is not None else None
+
+    async def known(self, key: str) -> bool:
+        """Whether any worker is running or still retains a result for the key"""
+        if key in self._entries:
+            return True
+        if not self.path:
+            return False
+        state, _ = await asyncio.to_thread(self._lookup, key)
+        return state is not None
+
+    async def run(self, key: str, job: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run job once per key; returns (result, replayed)"""
+        self._expire()
+        entry = self._entries.get(key)
+
+        if entry is not None and entry.completed_at is not None:
+            self.replayed += 1
+            self._entries.move_to_end(key)
+            logger.info(f"Idempotent replay for key: {key[:48]}")
+            return entry.task.result(), True
+
+        if entry is not None:
+            self.joined += 1
+            logger.info(f"Joining in-flight request for key: {key[:48]}")
+            return await asyncio.shield(entry.task), True
+
+        if self.path:
+            waited = False
+            state, result = await asyncio.to_thread(self._claim, key)
+            while state == RUNNING:
+                # Another worker (or request here) holds the claim: wait for its result
+                if not waited:
+                    waited = True
+                    self.joined += 1
+                    logger.info(f"Waiting on another worker for key: {key[:48]}")
+                await asyncio.sleep(self.poll_interval)
+                state, result = await asyncio.to_thread(self._claim, key)
+            if state == DONE:
+                self.replayed += 1
+                logger.info(f"Idempotent replay from shared store for key: {key[:48]}")
+                return result, True
+            job = self._shared_job(key, job)
+
+        self.started += 1
+        task = asyncio.ensure_future(job())
+        entry = _Entry(task)
+        self._entries[key] = entry
+        task.add_done_callback(lambda t: self._on_done(key, entry, t))
+        return await asyncio.shield(task), False
+
+    def _shared_job(self, key: str, job: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+        async def run_and_store():
+            try:
+                result = await job()
+            except BaseException:
+                await asyncio.to_thread(self._release, key)
+                raise
+            try:
+                await asyncio.to_thread(self._complete, key, result)
+            except Exception as e:
+                # The caller still gets its result; a retry elsewhere runs the job again
+                logger.warning(f"Could not store idempotent result for key {key[:48]}: {str(e)}")
+                await asyncio.to_thread(self._release, key)
+            return result
+        return run_and_store
+
+    # Shared file
+
+    def _connect(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(IDEMPOTENCY_SCHEMA)
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+    def _current(self, row: Optional[tuple], now: float) -> Tuple[Optional[str], Any]:
+        """(state, result) of a row that is still valid, else (None, None)"""
+        if row is None:
+            return None, None
+        state, owner, result, updated_at = row
+        if state == DONE and now - updated_at <= self.retention_seconds:
+            return DONE, json.loads(result)
+        if state == RUNNING and now - updated_at <= self.lease_seconds and _alive(owner):
+            return RUNNING, None
+        return None, None
+
+    def _lookup(self, key: str) -> Tuple[Optional[str], Any]:
+        return self._current(self._connect().execute(SQL_LOOKUP, (key,)).fetchone(), time.time())
+
+    def _claim(self, key: str) -> Tuple[str, Any]:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state, result = self._current(conn.execute(SQL_LOOKUP, (key,)).fetchone(), now)
+            if state is None:
+                conn.execute(SQL_EXPIRE, (now - self.retention_seconds,))
+                conn.execute(SQL_CLAIM, (key, os.getpid(), now))
+                state = CLAIMED
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return state, result
+
+    def _complete(self, key: str, result: Any):
+        self._connect().execute(SQL_COMPLETE, (json.dumps(result, default=str), time.time(), key, os.getpid()))
+
+    def _release(self, key: str):
+        self._connect().execute(SQL_RELEASE, (key, os.getpid()))
+
+    def _on_done(self, key: str, entry: _Entry, task: asyncio.Task):
+        if task.cancelled() or task.exception() is not None:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+            return
+        entry.completed_at = time.monotonic()
+
+    def _expire(self):
+        # Oldest entries come first; running jobs are skipped, never evicted.
+        # Only a bounded prefix is examined per call to keep requests O(1).
+        now = time.monotonic()
+        for key in list(itertools.islice(self._entries, 64)):
+            entry = self._entries[key]
+            if entry.completed_at is None:
+                continue
+            expired = now - entry.completed_at > self.retention_seconds
+            if not expired and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "in_flight": sum(1 for e in self._entries.values() if e.completed_at is None),
+            "started": self.started,
+            "joined": self.joined,
+            "replayed": self.replayed,
+            "retention_seconds": self.retention_seconds,
+            "shared": bool(self.path),
+        }
@@ -0,0 +1,101 @@
+"""
+Realtime transcription relay for WhisperMe Backend
+Bridges client audio frames to an upstream streaming transcription session
+(OpenAI Realtime API, or a local fake with the same wire protocol)
+"""
+
+import base64
+import json
+import logging
+from typing import AsyncIterator, Dict, Optional
+
+from websockets.asyncio.client import connect
+from websockets.exceptions import WebSocketException
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REALTIME_URL = "wss://api.openai.com/v1/realtime?intent=transcription"
+
+# Realtime input audio is 16-bit little-endian PCM, mono, 24 kHz
+REALTIME_AUDIO_FORMAT = "pcm16"
+REALTIME_SAMPLE_RATE = 24000
+
+
+class RealtimeUpstreamError(Exception):
+    """The upstream session reported an error or closed unexpectedly"""
+
+
+class RealtimeTranscriptionSession:
+    """One upstream transcription session: append audio, commit, read transcripts"""
+
+    def __init__(self, url: str, api_key: Optional[str], model: str,
+                 language: Optional[str] = None, prompt: Optional[str] = None):
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.language = language
+        self.prompt = prompt
+        self._ws = None
+
+    async def __aenter__(self) -> "RealtimeTranscriptionSession":
+        headers = {"OpenAI-Beta": "realtime=v1"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        # PCM frames gain little from deflate; skip it to keep per-frame latency low
+        try:
+            self._ws = await connect(self.url, additional_headers=headers, compression=None,
+                                     max_size=None)
+        except (OSError, WebSocketException) as e:
+            raise RealtimeUpstreamError(f"Could not open upstream session: {str(e)}")
+
+        transcription = {"model": self.model}
+        if self.language and self.language != "auto":
+            transcription["language"] = self.language
+        if self.prompt:
+            transcription["prompt"] = self.prompt
+        await self._send({
+            "type": "transcription_session.update",
+            "session": {
+                "input_audio_format": REALTIME_AUDIO_FORMAT,
+                "input_audio_transcription": transcription,
+                # The client decides when speech ends (hotkey release)
+                "turn_detection": None,
+            },
+        })
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._ws is not None:
+            await self._ws.close()
+
+    async def _send(self, event: Dict):
+        await self._ws.send(json.dumps(event))
+
+    async def append_audio(self, frame: bytes):
+        await self._send({
+            "type": "input_audio_buffer.append",
+            "audio": base64.b64encode(frame).decode("ascii"),
+        })
+
+    async def commit(self):
+        await self._send({"type": "input_audio_buffer.commit"})
+
+    async def transcripts(self) -> AsyncIterator[Dict]:
+        """
+        Yield {"type": "partial", "delta": ...} and {"type": "final", "text": ...}
+        events translated from the upstream protocol.
+        """
+        try:
+            async for message in self._ws:
+                event = json.loads(message)
+                kind = event.get("type")
+                if kind == "conversation.item.input_audio_transcription.delta":
+                    yield {"type": "partial", "delta": event.get("delta", "")}
+                elif kind == "conversation.item.input_audio_transcription.completed":
+                    yield {"type": "final", "text": event.get("transcript", "")}
+                elif kind in ("error", "conversation.item.input_audio_transcription.failed"):
+                    error = event.get("error") or {}
+                    raise RealtimeUpstreamError(error.get("message") or json.dumps(event))
+        except WebSocketException as e:
+            raise RealtimeUpstreamError(f"Upstream session failed: {str(e)}")
+        raise RealtimeUpstreamError("Upstream session closed before a final transcript")
@@ -0,0 +1,213 @@
+"""
+Logging pipeline for WhisperMe Backend
+Request threads only enqueue records; a background listener thread formats
+and writes them (JSON to a rotating, compressed file and text to stdout)
+"""
+
+import atexit
+import copy
+import fcntl
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any `extra=` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotates when the file reaches max_bytes or when rotate_seconds have passed,
+    whichever comes first, and gzips rotated files (whisperme.log.1.gz, ...).
+
+    Every gunicorn worker (and the master) writes the same file, so rotation is
+    coordinated through `<file>.lock`: each write holds a shared lock and first
+    reopens the file if another process has rotated it; rotating takes the lock
+    exclusively and re-checks, so exactly one process rotates and no process
+    writes to the rotated file. The lock file's mtime is the last rotation time.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int,
+                 rotate_seconds: Optional[int] = None, encoding: str = "utf-8"):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.rotate_seconds = rotate_seconds
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = self._compress
+        self.lock_path = f"{self.baseFilename}.lock"
+        self._lock_file = open(self.lock_path, "a")
+        self._file_id = self._stream_id()
+
+    @staticmethod
+    def _compress(source: str, dest: str):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def _stream_id(self):
+        stat = os.fstat(self.stream.fileno())
+        return stat.st_dev, stat.st_ino
+
+    def _reopen_if_rotated(self) -> bool:
+        try:
+            stat = os.stat(self.baseFilename)
+            current = stat.st_dev, stat.st_ino
+        except FileNotFoundError:
+            current = None
+        if current != self._file_id:
+            self.stream.close()
+            self.stream = self._open()
+            self._file_id = self._stream_id()
+            return True
+        return False
+
+    def _rollover_due(self, pending: int = 0) -> bool:
+        if self.rotate_seconds and time.time() - os.fstat(self._lock_file.fileno()).st_mtime >= self.rotate_seconds:
+            return True
+        if self.maxBytes > 0:
+            size = os.fstat(self.stream.fileno()).st_size
+            return size > 0 and size + pending >= self.maxBytes
+        return False
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+            try:
+                self._reopen_if_rotated()
+                super().emit(record)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        except Exception:
+            self.handleError(record)
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        return self._rollover_due(len(self.format(record)) + 1 if self.maxBytes > 0 else 0)
+
+    def doRollover(self):
+        # Called from emit() with the shared lock held; held exclusively while files move
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            # Another process may have rotated while this one waited
+            if not self._reopen_if_rotated():
+                super().doRollover()
+                os.utime(self.lock_path)
+                self._file_id = self._stream_id()
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+
+    def close(self):
+        super().close()
+        self._lock_file.close()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per call site (file and line) for records below WARNING.
+
+    A hot-path log line can emit `burst` records at once and `rate` per second
+    after that; the rest are dropped and counted, and the next record that gets
+    through reports how many were suppressed. Warnings and errors always pass.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, suppressed = self._buckets.get(site, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[site] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[site] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Enqueue a cheap copy of the record; formatting happens on the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = "INFO", log_file: Optional[str] = "whisperme.log",
+                  console_format: str = "text", max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 5, rotate_seconds: Optional[int] = 86400,
+                  rate_limit: float = 20.0, rate_burst: int = 50) -> logging.handlers.QueueListener:
+    """Route all logging through a queue to a background listener thread"""
+    text_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(JsonFormatter() if console_format == "json" else text_formatter)
+    handlers = [console]
+
+    if log_file:
+        file_handler = CompressingRotatingFileHandler(
+            log_file, max_bytes=max_bytes, backup_count=backup_count, rotate_seconds=rotate_seconds
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate_limit, rate_burst))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener: logging.handlers.QueueListener):
+    # QueueListener.stop() fails if called twice (e.g. explicitly, then at exit)
+    if listener._thread is not None:
+        listener.stop()
@@ -0,0 +1,132 @@
+"""
+Event loop lag watchdog for WhisperMe Backend
+A heartbeat task measures how late the event loop runs a timer; a watcher thread
+notices when the heartbeat stops for longer than the threshold and captures the
+stack of whatever is blocking the loop at that moment, so synchronous calls made
+from async handlers show up by call site instead of as unexplained latency.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+from metrics import LOOP_BLOCKED_SECONDS, LOOP_BLOCKS, LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+# Not call sites: this module, and fakes.py standing in for the SDKs in load tests
+NOT_SITES = {os.path.join(APP_ROOT, name) for name in ("loop_watchdog.py", "fakes.py")}
+STACK_LIMIT = 25
+
+
+def _is_app_file(path: str) -> bool:
+    return path.startswith(APP_ROOT) and "site-packages" not in path and path not in NOT_SITES
+
+
+def blocking_site(frame) -> Tuple[str, str]:
+    """
+    (site, call) for a captured loop frame: the innermost frame in this repo's code
+    (the call made from async code) and the innermost frame overall (what it waited in)
+    """
+    innermost = f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+    current = frame
+    while current is not None:
+        path = current.f_code.co_filename
+        if _is_app_file(path):
+            return f"{os.path.relpath(path, APP_ROOT)}:{current.f_lineno} {current.f_code.co_name}", innermost
+        current = current.f_back
+    return innermost, innermost
+
+
+class LoopWatchdog:
+    """
+    Start from the running loop (e.g. the app lifespan) and stop on shutdown.
+    Stalls are attributed to the site captured while they were happening;
+    `offenders()` lists the worst sites since startup.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self._offenders: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._heartbeat = time.monotonic()
+        self._captured_for: Optional[float] = None
+        self._pending: Optional[Tuple[str, str, List[str]]] = None
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._loop_thread: Optional[int] = None
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"🐕 Event loop watchdog started (threshold {self.threshold * 1000:.0f} ms)")
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _beat(self):
+        while True:
+            due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - due)
+            self._heartbeat = now
+            LOOP_LAG.observe(lag)
+            if self._pending is not None:
+                self._record(lag)
+
+    def _watch(self):
+        # Capture once a stall is half the threshold old, so any stall that reaches the
+        # threshold is caught while it is still running; shorter ones are dropped in _record
+        while not self._stop.wait(self.threshold / 4):
+            heartbeat = self._heartbeat
+            if time.monotonic() - heartbeat < self.interval + self.threshold / 2 or self._captured_for == heartbeat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            site, call = blocking_site(frame)
+            self._pending = (site, call, traceback.format_stack(frame, limit=STACK_LIMIT))
+            self._captured_for = heartbeat
+            del frame
+
+    def _record(self, lag: float):
+        site, call, stack = self._pending
+        self._pending = None
+        if lag < self.threshold:
+            return
+        LOOP_BLOCKS.inc(site=site)
+        LOOP_BLOCKED_SECONDS.inc(lag, site=site)
+        with self._lock:
+            entry = self._offenders.setdefault(site, {"site": site, "count": 0, "total_seconds": 0.0,
+                                                      "max_seconds": 0.0, "call": call, "stack": []})
+            entry["count"] += 1
+            entry["total_seconds"] += lag
+            if lag >= entry["max_seconds"]:
+                entry.update(max_seconds=lag, call=call, stack=stack)
+        logger.warning(f"🐢 Event loop blocked for {lag * 1000:.0f} ms at {site} (in {call})")
+
+    def offenders(self, limit: int = 10) -> List[Dict]:
+        """Call sites that blocked the loop, most total time lost first"""
+        with self._lock:
+            entries = sorted(self._offenders.values(), key=lambda e: e["total_seconds"], reverse=True)[:limit]
+            return [{**e, "total_seconds": round(e["total_seconds"], 3), "max_seconds": round(e["max_seconds"], 3),
+                     "stack": "".join(e["stack"])} for e in entries]
@@ -1,52 +1,109 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Header
+from fastapi import (
+    FastAPI, HTTPException, Depends, UploadFile, File, Form, Header, BackgroundTasks, Request,
+    WebSocket, WebSocketDisconnect
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
-import openai
+from typing import Optional, Dict, Any, List, Tuple
 import os
 import tempfile
-import hashlib
-import jwt
 from datetime import datetime, timedelta
-import httpx
 from dotenv import load_dotenv
-import bcrypt
-from passlib.context import CryptContext
 import logging
-import sys
-from supabase import create_client, Client
 import json
-import requests
-from urllib.parse import quote
 import uuid
-import base64
 import asyncio
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-import uvicorn
-from supabase import create_client, Client
-from openai import OpenAI
+import time
+from contextlib import asynccontextmanager
+import clients
+from clients import LazyClient, create_openai_client, create_supabase_client
+from storage import create_storage, decode_cursor, encode_cursor, history_columns
+from outbox import WriteOutbox
+from embeddings import EmbeddingPipeline, VectorStore, create_embedder
+from device_tokens import DeviceTokens, InvalidDeviceToken, TokenDenylist
+from export import ExportEncoder
+from retention import RetentionJob
+from scheduler import UpstreamScheduler, SchedulerQueueFull, parse_lane_weights
+from audio_probe import probe_duration, probe_duration_bytes, estimate_duration
+from idempotency import IdempotencyStore
+from uploads import UploadManager, UploadNotFound, UploadOffsetMismatch, UploadTooLarge
+from transcription_models import dispatch_transcription, resolve_model
+from logging_setup import setup_logging
+import metrics
+import profiler
+from loop_watchdog import LoopWatchdog
+from metrics import (
+    HTTP_REQUESTS, HTTP_LATENCY, HTTP_IN_FLIGHT, WEBSOCKET_SESSIONS, DB_ROUND_TRIPS,
+    CACHE_REQUESTS, CACHE_ENTRIES, SCHEDULER_ACTIVE, SCHEDULER_QUEUED, SCHEDULER_DISPATCHED,
+    SCHEDULER_REJECTED, SCHEDULER_WAIT, OUTBOX_PENDING, OUTBOX_OLDEST, OUTBOX_REPLAYED,
+    EMBEDDINGS, EMBEDDING_QUEUE, DEVICE_TOKEN_CHECKS, TRANSCRIPTIONS_ARCHIVED,
+    db_call, stage, record_stage
+)
+from starlette.routing import Match
+from starlette.websockets import WebSocketState
+from live_transcription import (
+    RealtimeTranscriptionSession, RealtimeUpstreamError, DEFAULT_REALTIME_URL,
+    REALTIME_AUDIO_FORMAT, REALTIME_SAMPLE_RATE
+)
 # import aiofiles  # Not needed for current implementation
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('whisperme.log')
-    ]
+load_dotenv()
+
+# Configure logging: records are queued and written by a background thread,
+# so log I/O stays off the request path
+LOGGING_OPTIONS = dict(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    log_file=os.getenv("LOG_FILE", "whisperme.log") or None,
+    console_format=os.getenv("LOG_FORMAT", "text"),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", 5)),
+    rotate_seconds=int(os.getenv("LOG_ROTATE_SECONDS", 86400)),
+    rate_limit=float(os.getenv("LOG_RATE_LIMIT", 20)),
+    rate_burst=int(os.getenv("LOG_RATE_BURST", 50))
 )
+log_listener = setup_logging(**LOGGING_OPTIONS)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
 logger.info("🚀 Starting WhisperMe Backend Server...")
 
-app = FastAPI(title="WhisperMe Backend", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Check configuration, then build and warm clients without delaying startup"""
+    if storage.name == "supabase" and (not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY):
+        logger.error("Supabase configuration missing! Please set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY")
+        raise Exception("Supabase configuration missing")
+    
+    if LOOP_WATCHDOG_ENABLED:
+        loop_watchdog.start()
+    if write_outbox:
+        write_outbox.start()
+    if embedding_pipeline:
+        embedding_pipeline.start()
+    if retention_job:
+        retention_job.start()
+    if WARMUP_BEFORE_SERVING:
+        # Pre-forked workers: open upstream connections before taking traffic
+        await asyncio.to_thread(warm_clients)
+        warmup = None
+    else:
+        # Requests that arrive before the warmup finishes build the client they need
+        # themselves (LazyClient serializes construction)
+        warmup = asyncio.create_task(asyncio.to_thread(warm_clients))
+    yield
+    if warmup is not None and not warmup.done():
+        logger.info("Shutting down before client warmup finished")
+    if LOOP_WATCHDOG_ENABLED:
+        await loop_watchdog.stop()
+    if write_outbox:
+        await asyncio.to_thread(write_outbox.stop)
+    if embedding_pipeline:
+        await asyncio.to_thread(embedding_pipeline.stop)
+    if retention_job:
+        await asyncio.to_thread(retention_job.stop)
+
+app = FastAPI(title="WhisperMe Backend", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware for your Next.js app and macOS app
 app.add_middleware(
@@ -61,52 +118,317 @@ logger.info("🌐 CORS middleware configured")
 
 # Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this")
+# Upstream statuses that reject the audio itself (malformed, too large, unsupported format)
+UPSTREAM_REJECTED_AUDIO_STATUSES = {400, 413, 415}
+DEFAULT_SECRET_KEY = "your-secret-key-change-this"
+SECRET_KEY = os.getenv("SECRET_KEY", DEFAULT_SECRET_KEY)
 FREE_TRANSCRIPTION_LIMIT = 10
 UNLIMITED_USAGE = 999999  # Large finite number representing unlimited usage (for Pydantic validation)
 RATE_LIMITING_ENABLED = False  # Disable rate limiting for development
 
+# Upstream scheduling (priority lanes per subscription tier)
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", 8))
+SCHEDULER_LANE_WEIGHTS = parse_lane_weights(os.getenv("SCHEDULER_LANE_WEIGHTS", "premium:4,free:1"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", 64))
+SCHEDULER_MAX_QUEUE_PER_DEVICE = int(os.getenv("SCHEDULER_MAX_QUEUE_PER_DEVICE", 8))
+
+# Retry deduplication for /transcribe
+IDEMPOTENCY_RETENTION_SECONDS = int(os.getenv("IDEMPOTENCY_RETENTION_SECONDS", 600))
+# Shared by all workers so a retry landing on another worker is deduplicated too; empty disables
+IDEMPOTENCY_PATH = os.getenv("IDEMPOTENCY_PATH", os.path.join(tempfile.gettempdir(), "whisperme-idempotency.db"))
+
+# Resumable chunked uploads (shared directory so any worker can take the next chunk)
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "whisperme-uploads"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 25 * 1024 * 1024))  # OpenAI audio limit
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 3600))
+UPLOAD_PROGRESS_STEP_BYTES = 256 * 1024  # Write progress to the DB at most once per step
+
+# Transcription history pages (GET /transcriptions)
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+SEARCH_MAX_RESULTS = 50
+EXPORT_PAGE_SIZE = 500  # Rows fetched and encoded at a time by /transcriptions/export
+APP_USAGE_MAX_DAYS = 366
+
+# Semantic search: finished transcriptions are embedded in the background and kept in
+# per-device vector indexes under VECTOR_INDEX_DIR (shared by all workers). Off by
+# default since every transcription is sent to the embedding model;
+# EMBEDDING_MODEL=local uses a deterministic offline embedder instead of OpenAI
+SEMANTIC_SEARCH_ENABLED = os.getenv("SEMANTIC_SEARCH_ENABLED", "false").lower() == "true"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 256))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(tempfile.gettempdir(), "whisperme-vectors"))
+VECTOR_EXACT_MAX = int(os.getenv("VECTOR_EXACT_MAX", 5000))  # Above this, a device's index is approximate
+
+# Device tokens: /register returns a signed token (user id, device id, tier) that
+# /transcribe, /chat and the status endpoint accept as "Authorization: Bearer" in
+# place of a user lookup, and that the per-device reads check against the device_id.
+# Revocations are shared by all workers through one file. Tokens need a SECRET_KEY of
+# at least 32 bytes. DEVICE_TOKEN_REQUIRED=true refuses requests that send only a
+# device_id, once all clients send tokens
+DEVICE_TOKEN_TTL = int(os.getenv("DEVICE_TOKEN_TTL", 3600))
+DEVICE_TOKEN_REQUIRED = os.getenv("DEVICE_TOKEN_REQUIRED", "false").lower() == "true"
+TOKEN_DENYLIST_PATH = os.getenv("TOKEN_DENYLIST_PATH",
+                                os.path.join(tempfile.gettempdir(), "whisperme-token-denylist.json"))
+
+# Retention: the text of finished transcriptions older than RETENTION_DAYS moves to a
+# compressed archive tier (reads still return it; keyword search covers only newer
+# rows). One worker on the box archives, in batches; 0 keeps everything hot
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", 0))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 500))
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", 3600))
+RETENTION_LOCK_PATH = os.getenv("RETENTION_LOCK_PATH",
+                                os.path.join(tempfile.gettempdir(), "whisperme-retention.lock"))
+
+# Finish client warmup before serving (set by gunicorn.conf.py for pre-forked workers)
+WARMUP_BEFORE_SERVING = os.getenv("WARMUP_BEFORE_SERVING", "false").lower() == "true"
+
+# Live dictation over WebSocket (point at a local fake for testing)
+OPENAI_REALTIME_URL = os.getenv("OPENAI_REALTIME_URL", DEFAULT_REALTIME_URL)
+# How long after the client's stop the final transcript may take before the session is failed
+REALTIME_FINAL_TIMEOUT = float(os.getenv("REALTIME_FINAL_TIMEOUT", 30))
+
+# Metrics: with several workers, point METRICS_DIR at a directory shared by all
+# of them (cleared at startup) so /metrics reports the server-wide totals
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+
+# Event loop watchdog: stalls longer than the threshold are traced to their call site
+LOOP_WATCHDOG_ENABLED = os.getenv("LOOP_WATCHDOG_ENABLED", "true").lower() == "true"
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", 100))
+
+# Admin endpoints (/debug/*) require this key in the X-API-Key header; disabled when unset
+PYTHON_SERVICE_API_KEY = os.getenv("PYTHON_SERVICE_API_KEY")
+# Where gunicorn workers exchange profiles requested with all_workers=true
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "whisperme-profiles"))
+
 # Supabase Configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
+# Local database for single-node installs (e.g. sqlite:///whisperme.db); Supabase when unset
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Queue transcription writes in this local file and replay them in the background
+# (shared by all workers on the box); writes go straight to the database when unset
+OUTBOX_PATH = os.getenv("OUTBOX_PATH")
+
 logger.info(f"🔑 OpenAI API Key configured: {'✅ Yes' if OPENAI_API_KEY else '❌ No'}")
 logger.info(f"🗄️  Supabase URL configured: {'✅ Yes' if SUPABASE_URL else '❌ No'}")
 logger.info(f"📊 Free transcription limit: {FREE_TRANSCRIPTION_LIMIT}")
 logger.info("⚠️  RATE LIMITING DISABLED - All users have unlimited transcriptions")
+logger.info(f"🚦 Upstream concurrency: {UPSTREAM_CONCURRENCY}, lanes: {SCHEDULER_LANE_WEIGHTS}")
+
+# The OpenAI and Supabase SDKs dominate import time, so they are imported and the
+# clients built on first use or by the startup warmup rather than at import
 
-# Initialize OpenAI client with optimizations
-openai_client = OpenAI(
+# OpenAI client with optimizations
+openai_client = LazyClient("OpenAI", lambda: create_openai_client(
     api_key=OPENAI_API_KEY,
     timeout=30.0,  # Timeout for requests
     max_retries=2,  # Reduce retries for faster failure
+))
+
+# Supabase client (configuration is checked in the lifespan)
+supabase = LazyClient("Supabase", lambda: create_supabase_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY))
+
+# Users, transcriptions and usage: Supabase, or SQLite when DATABASE_URL is set
+storage = create_storage(DATABASE_URL, supabase)
+logger.info(f"🗄️  Storage backend: {storage.name}")
+
+def apply_outbox_write(op: str, params: Dict):
+    """Replay one queued transcription write against the database (raises to retry)"""
+    with db_call(op):
+        if op == "create_transcription":
+            storage.create_transcription(**params)
+        elif op == "update_transcription_result":
+            if not storage.update_transcription_result(**params):
+                raise LookupError(f"Transcription {params['transcription_id']} not found")
+        elif op == "update_transcription":
+            storage.update_transcription(params["transcription_id"], params["fields"])
+        else:
+            raise ValueError(f"Unknown outbox operation: {op}")
+
+def apply_outbox_writes(op: str, params_list: List[Dict]):
+    """Replay several queued writes of one kind in a single round trip (raises to retry them one by one)"""
+    with db_call(f"{op}_batch"):
+        if op == "create_transcription":
+            storage.create_transcriptions(params_list)
+        elif op == "update_transcription_result":
+            found = storage.update_transcription_results(params_list)
+            if found < len(params_list):
+                raise LookupError(f"{len(params_list) - found} of {len(params_list)} transcriptions not found")
+        elif op == "update_transcription":
+            storage.update_transcriptions({params["transcription_id"]: params["fields"] for params in params_list})
+        else:
+            raise ValueError(f"Unknown outbox operation: {op}")
+
+write_outbox = (WriteOutbox(OUTBOX_PATH, apply_outbox_write, apply_many=apply_outbox_writes)
+                if OUTBOX_PATH else None)
+if write_outbox:
+    logger.info(f"📮 Transcription writes are queued in {OUTBOX_PATH}")
+
+# Semantic search indexing (see embeddings.py)
+embedding_pipeline = None
+if SEMANTIC_SEARCH_ENABLED:
+    embedder = create_embedder(EMBEDDING_MODEL, openai_client, EMBEDDING_DIMENSIONS)
+    embedding_pipeline = EmbeddingPipeline(
+        embedder,
+        VectorStore(VECTOR_INDEX_DIR, embedder.name, exact_max=VECTOR_EXACT_MAX),
+        batch_size=EMBEDDING_BATCH_SIZE,
+    )
+    logger.info(f"🧭 Semantic search enabled ({embedder.name}, indexes in {VECTOR_INDEX_DIR})")
+
+# Archiving of old transcriptions (see retention.py)
+def archive_transcriptions(cutoff: str, limit: int) -> int:
+    with db_call("archive_transcriptions"):
+        return storage.archive_transcriptions(cutoff, limit)
+
+retention_job = None
+if RETENTION_DAYS > 0:
+    retention_job = RetentionJob(archive_transcriptions, RETENTION_DAYS, RETENTION_LOCK_PATH,
+                                 batch_size=RETENTION_BATCH_SIZE, interval=RETENTION_INTERVAL_SECONDS)
+    logger.info(f"🗄️  Transcriptions are archived after {RETENTION_DAYS} days")
+
+# Scheduler in front of the OpenAI transcription pool
+upstream_scheduler = UpstreamScheduler(
+    concurrency=UPSTREAM_CONCURRENCY,
+    lane_weights=SCHEDULER_LANE_WEIGHTS,
+    max_queue_per_lane=SCHEDULER_MAX_QUEUE,
+    max_queue_per_device=SCHEDULER_MAX_QUEUE_PER_DEVICE,
+)
+
+# In-flight and recently completed transcriptions, keyed by idempotency key
+transcription_idempotency = IdempotencyStore(
+    retention_seconds=IDEMPOTENCY_RETENTION_SECONDS, path=IDEMPOTENCY_PATH or None
 )
 
-# Initialize Supabase client
-if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
-    logger.error("Supabase configuration missing! Please set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY")
-    raise Exception("Supabase configuration missing")
+upload_manager = UploadManager(UPLOAD_DIR, max_bytes=UPLOAD_MAX_BYTES, ttl_seconds=UPLOAD_SESSION_TTL)
+
+# Signed device tokens (see device_tokens.py)
+device_tokens = DeviceTokens(None if SECRET_KEY == DEFAULT_SECRET_KEY else SECRET_KEY,
+                             ttl=DEVICE_TOKEN_TTL, denylist=TokenDenylist(TOKEN_DENYLIST_PATH))
+if not device_tokens.enabled:
+    logger.warning("⚠️  SECRET_KEY is not set or shorter than 32 bytes - device tokens are disabled")
+    if DEVICE_TOKEN_REQUIRED:
+        logger.error("DEVICE_TOKEN_REQUIRED is set but device tokens are disabled - per-device requests will fail")
+
+# Started per worker in the lifespan (the heartbeat task needs the running loop)
+loop_watchdog = LoopWatchdog(threshold=LOOP_LAG_THRESHOLD_MS / 1000)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-logger.info("✅ Supabase client initialized successfully")
+metrics.registry.configure(directory=METRICS_DIR, flush_seconds=METRICS_FLUSH_SECONDS)
+
+def collect_component_metrics():
+    """Copy scheduler and idempotency counters into the metrics registry"""
+    stats = upstream_scheduler.stats()
+    SCHEDULER_ACTIVE.set(stats["active"])
+    for name, lane in stats["lanes"].items():
+        SCHEDULER_QUEUED.set(lane["queued"], lane=name)
+        SCHEDULER_DISPATCHED.set(lane["dispatched"], lane=name)
+        SCHEDULER_REJECTED.set(lane["rejected"], lane=name)
+        SCHEDULER_WAIT.set_histogram(list(lane["wait_seconds_buckets"].values()), lane["wait_seconds_sum"], lane=name)
+    CACHE_ENTRIES.set(transcription_idempotency.stats()["entries"], cache="idempotency")
+    if write_outbox:
+        # The file is shared, so only the replaying worker reports its depth (gauges are summed)
+        outbox_stats = write_outbox.stats() if write_outbox.replaying else {}
+        OUTBOX_PENDING.set(outbox_stats.get("pending", 0), state="pending")
+        OUTBOX_PENDING.set(outbox_stats.get("dead", 0), state="dead")
+        OUTBOX_OLDEST.set(outbox_stats.get("oldest_pending_seconds", 0))
+        OUTBOX_REPLAYED.set(write_outbox.replayed)
+    if embedding_pipeline:
+        embedding_stats = embedding_pipeline.stats()
+        EMBEDDING_QUEUE.set(embedding_stats["queued"])
+        for outcome in ("indexed", "failed", "dropped"):
+            EMBEDDINGS.set(embedding_stats[outcome], outcome=outcome)
+    if retention_job:
+        TRANSCRIPTIONS_ARCHIVED.set(retention_job.archived)
+    token_stats = device_tokens.stats()
+    for result in ("valid", "expired", "invalid", "revoked"):
+        DEVICE_TOKEN_CHECKS.set(token_stats[result], result=result)
+
+metrics.registry.add_collector(collect_component_metrics)
+
+def route_template(scope) -> str:
+    """The matched route path (e.g. /uploads/{upload_id}), keeping label cardinality bounded"""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count, time and track in-flight requests and DB round trips per route"""
+    route = route_template(request.scope)
+    token = metrics.start_request()
+    status = 500
+    HTTP_IN_FLIGHT.inc(route=route)
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["Server-Timing"] = metrics.current_timer().server_timing()
+        return response
+    finally:
+        timer = metrics.finish_request(token)
+        HTTP_IN_FLIGHT.inc(-1, route=route)
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=status)
+        HTTP_LATENCY.observe(timer.elapsed(), method=request.method, route=route)
+        DB_ROUND_TRIPS.observe(timer.db_calls, route=route)
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+device_bearer = HTTPBearer(auto_error=False)  # Device tokens are optional while clients move to them
 
-# Database setup - Using Supabase instead of SQLite
+# Database setup - Supabase, or SQLite when DATABASE_URL is set
 def init_db():
-    logger.info("🔍 Checking Supabase database connection...")
+    logger.info(f"🔍 Checking {storage.name} database connection...")
     try:
         # Test connection by checking if our tables exist
-        response = supabase.table('users').select("id").limit(1).execute()
-        logger.info("✅ Supabase database connection successful")
-        logger.info("🗄️  Using Supabase database with public.users and public.transcriptions tables")
+        with db_call("init_db"):
+            storage.check()
+        logger.info(f"✅ {storage.name} database connection successful")
+        logger.info(f"🗄️  Using {storage.name} database with users and transcriptions tables")
     except Exception as e:
-        logger.error(f"❌ Supabase database connection failed: {str(e)}")
+        logger.error(f"❌ {storage.name} database connection failed: {str(e)}")
         raise Exception(f"Database connection failed: {str(e)}")
 
-init_db()
+def warm_clients():
+    """Build both clients and open their pooled connections (runs in a thread at startup)"""
+    started = time.perf_counter()
+    try:
+        # One cheap authenticated call leaves a TLS connection in the OpenAI pool
+        openai_client.with_options(max_retries=0, timeout=10.0).models.retrieve("whisper-1")
+    except Exception as e:
+        logger.error(f"OpenAI warmup failed (connections open on first use): {str(e)}")
+    try:
+        init_db()
+    except Exception as e:
+        logger.error(f"Database warmup failed (requests will retry on first use): {str(e)}")
+    metrics.registry.flush()  # report this worker (and its memory) before any traffic
+    memory = metrics.process_memory()
+    logger.info(
+        f"🔥 Worker {os.getpid()} warmed in {(time.perf_counter() - started) * 1000:.0f} ms - "
+        + ", ".join(f"{kind} {value / 1024 / 1024:.1f} MB" for kind, value in memory.items())
+    )
+
+def prepare_for_fork():
+    """
+    Called in the gunicorn master after the app is preloaded: load the SDK modules
+    and freeze everything allocated so far, so workers share it copy-on-write.
+    Clients are not built here; connections must not be shared across processes.
+    """
+    import gc
+    
+    clients.preload()
+    gc.collect()
+    gc.freeze()
+    logger.info(f"🧊 Preloaded state frozen ({gc.get_freeze_count()} objects shared with workers)")
+
+def after_fork():
+    """Called in each gunicorn worker right after fork"""
+    global log_listener
+    # The master's log listener thread does not exist in the child
+    log_listener = setup_logging(**LOGGING_OPTIONS)
+    profiler.install_signal_handler(PROFILE_DIR)
 
 # Pydantic models
 class TranscriptionRequest(BaseModel):
@@ -115,6 +437,15 @@ class TranscriptionRequest(BaseModel):
     model: Optional[str] = "whisper-1"
     prompt: Optional[str] = ""
 
+class UploadSessionRequest(BaseModel):
+    device_id: Optional[str] = None  # Taken from the device token when one is sent
+    language: Optional[str] = "auto"
+    model: Optional[str] = "gpt-4o-transcribe"
+    prompt: Optional[str] = ""
+    active_app: Optional[str] = ""
+    filename: Optional[str] = "audio.m4a"
+    total_size: Optional[int] = None  # Unknown while still recording
+
 class UserRegistration(BaseModel):
     device_id: str
     email: Optional[str] = None
@@ -157,8 +488,9 @@ class ChatResponse(BaseModel):
 # def get_password_hash(password: str) -> str:
 #     return pwd_context.hash(password)
 
-# JWT token functions
+# JWT token functions (jwt is imported on use; no hot path needs it)
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    import jwt
     logger.info(f"Creating access token for user: {data.get('sub')}")
     to_encode = data.copy()
     if expires_delta:
@@ -171,6 +503,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    import jwt
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=["HS256"])
         user_id: int = payload.get("sub")
@@ -183,61 +516,99 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
         logger.error(f"JWT verification failed: {str(e)}")
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
+def verify_device_token(token: str) -> Dict:
+    try:
+        return device_tokens.verify(token)
+    except InvalidDeviceToken as e:
+        logger.warning(f"Rejected device token: {str(e)}")
+        raise HTTPException(status_code=401, detail="Invalid or expired device token",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+def device_token_claims(credentials: Optional[HTTPAuthorizationCredentials] = Depends(device_bearer)) -> Optional[Dict]:
+    """Claims of the request's device token, or None when it sends none"""
+    if credentials is None:
+        return None
+    return verify_device_token(credentials.credentials)
+
+def websocket_token_claims(websocket: WebSocket, token: Optional[str]) -> Optional[Dict]:
+    """
+    device_token_claims for a WebSocket handshake. Browsers cannot set headers on
+    one, so the token may also come as the `token` query parameter.
+    """
+    scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        token = credentials
+    if not token:
+        return None
+    return verify_device_token(token)
+
+def caller_device_id(claims: Optional[Dict], device_id: Optional[str]) -> str:
+    """The device a request acts for: the token's when one is sent (a device_id sent as well must match)"""
+    if claims is None:
+        if DEVICE_TOKEN_REQUIRED:
+            raise HTTPException(status_code=401, detail="Device token required", headers={"WWW-Authenticate": "Bearer"})
+        if not device_id:
+            raise HTTPException(status_code=400, detail="device_id or a device token is required")
+        return device_id
+    if device_id and device_id != claims["device_id"]:
+        raise HTTPException(status_code=403, detail="Device token was issued to a different device")
+    return claims["device_id"]
+
+def token_user(claims: Dict) -> Dict:
+    """The user fields a device token carries, in place of resolve_user()"""
+    return {"id": claims["sub"], "device_id": claims["device_id"], "subscription_tier": claims["tier"]}
+
+def require_service_key(x_api_key: Optional[str] = Header(None)):
+    """Admin-only endpoints: the caller must send PYTHON_SERVICE_API_KEY as X-API-Key"""
+    import secrets
+    if not PYTHON_SERVICE_API_KEY:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled (PYTHON_SERVICE_API_KEY not set)")
+    if not x_api_key or not secrets.compare_digest(x_api_key, PYTHON_SERVICE_API_KEY):
+        logger.warning("Rejected admin request with a missing or invalid API key")
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
 # Helper functions using Supabase auth.users (web users handled by Next.js)
 # Note: Web user authentication is now handled by Next.js/Supabase Auth
 # These functions are kept for backwards compatibility but should use the auth system
 
 # Helper functions for device-based users using Supabase
+def device_user(user: Dict) -> Dict:
+    return {
+        "id": user["id"],
+        "device_id": user["device_id"],
+        "email": None,  # Email is in auth.users, not public.users
+        "subscription_tier": user["subscription_tier"],
+        "transcriptions_used": user["transcriptions_used"],
+        "created_at": user["created_at"],
+        "last_reset": user["last_reset"]
+    }
+
 def get_user_by_device_id(device_id: str) -> Optional[Dict]:
     try:
-        response = supabase.table('users').select('*').eq('device_id', device_id).execute()
-        if response.data and len(response.data) > 0:
-            user = response.data[0]
-            return {
-                "id": user["id"],
-                "device_id": user["device_id"],
-                "email": None,  # Email is in auth.users, not public.users
-                "subscription_tier": user["subscription_tier"],
-                "transcriptions_used": user["transcriptions_used"],
-                "created_at": user["created_at"],
-                "last_reset": user["last_reset"]
-            }
-        return None
+        with db_call("get_user"):
+            user = storage.find_user(device_id)
+        return device_user(user) if user else None
     except Exception as e:
         logger.error(f"Error getting user by device_id {device_id}: {str(e)}")
         return None
 
-def create_user(device_id: str, email: Optional[str] = None) -> Dict:
-    logger.info(f"Creating new user for device ID: {device_id}")
-    try:
-        # Use the Supabase function to get or create user by device_id
-        response = supabase.rpc('get_or_create_user_by_device_id', {'device_id_param': device_id}).execute()
-        user_uuid = response.data
-        
-        # Get the created user details
-        user_response = supabase.table('users').select('*').eq('id', user_uuid).execute()
-        if user_response.data and len(user_response.data) > 0:
-            user = user_response.data[0]
-            logger.info(f"User created/retrieved successfully - Device ID: {device_id}, User UUID: {user_uuid}")
-            return {
-                "id": user["id"],
-                "device_id": user["device_id"],
-                "email": email,
-                "subscription_tier": user["subscription_tier"],
-                "transcriptions_used": user["transcriptions_used"]
-            }
-        else:
-            raise Exception("Failed to retrieve created user")
+def register_device(device_id: str) -> Tuple[Dict, bool]:
+    """The device's user, created on first contact, and whether it was just created (one database call)"""
+    try:
+        with db_call("register_device"):
+            user, created = storage.register_device(device_id)
     except Exception as e:
-        logger.error(f"Error creating user for device_id {device_id}: {str(e)}")
+        logger.error(f"Error registering device_id {device_id}: {str(e)}")
         raise Exception(f"Failed to create user: {str(e)}")
+    if created:
+        logger.info(f"User created successfully - Device ID: {device_id}, User UUID: {user['id']}")
+    return device_user(user), created
 
 def increment_usage(device_id: str):
     logger.info(f"Incrementing usage for device ID: {device_id}")
     try:
-        # Use the Supabase function to increment transcriptions
-        response = supabase.rpc('increment_transcriptions', {'device_id_param': device_id}).execute()
-        new_count = response.data
+        with db_call("increment_transcriptions"):
+            new_count = storage.increment_transcriptions(device_id)
         logger.info(f"Usage incremented for device ID: {device_id}, new count: {new_count}")
         return new_count
     except Exception as e:
@@ -338,9 +709,13 @@ AVAILABLE_FUNCTIONS = {
     }
 }
 
+# Tool schemas sent with every chat request, built once (and shared by pre-forked workers)
+CHAT_TOOLS = [{"type": "function", "function": func_def} for func_def in AVAILABLE_FUNCTIONS.values()]
+
 def execute_function(function_name: str, arguments: Dict[str, Any]) -> str:
     """Execute a function call and return the result"""
-    logger.info(f"Executing function: {function_name} with arguments: {arguments}")
+    logger.info(f"Executing function: {function_name}")
+    logger.debug(f"Function arguments: {arguments}")
     
     try:
         if function_name == "get_current_weather":
@@ -441,30 +816,38 @@ def calculate(expression: str) -> str:
     except Exception as e:
         return f"Error calculating '{expression}': {str(e)}"
 
+def normalize_phone_number(phone_number: str) -> Optional[str]:
+    """Normalize a spoken/typed phone number to +<digits>, or None if it cannot be a number"""
+    import re
+
+    # Clean the phone number - remove all non-digit characters except + at the beginning
+    cleaned_number = re.sub(r'[^\d+]', '', phone_number)
+    
+    # Handle different phone number formats
+    if not cleaned_number.startswith('+'):
+        if cleaned_number.startswith('1') and len(cleaned_number) == 11:
+            # US number starting with 1
+            cleaned_number = '+' + cleaned_number
+        elif len(cleaned_number) == 10:
+            # 10-digit US number
+            cleaned_number = '+1' + cleaned_number
+        else:
+            # Assume it's a valid number, just add + if it looks international
+            if len(cleaned_number) > 10:
+                cleaned_number = '+' + cleaned_number
+    
+    # More lenient validation - allow various international formats
+    if len(cleaned_number) < 5 or len(cleaned_number) > 16:
+        return None
+    return cleaned_number
+
 def call_phone_number(phone_number: str, contact_name: str = None) -> str:
     """Make a phone call using macOS system functionality"""
     import subprocess
-    import re
     
     try:
-        # Clean the phone number - remove all non-digit characters except + at the beginning
-        cleaned_number = re.sub(r'[^\d+]', '', phone_number)
-        
-        # Handle different phone number formats
-        if not cleaned_number.startswith('+'):
-            if cleaned_number.startswith('1') and len(cleaned_number) == 11:
-                # US number starting with 1
-                cleaned_number = '+' + cleaned_number
-            elif len(cleaned_number) == 10:
-                # 10-digit US number
-                cleaned_number = '+1' + cleaned_number
-            else:
-                # Assume it's a valid number, just add + if it looks international
-                if len(cleaned_number) > 10:
-                    cleaned_number = '+' + cleaned_number
-        
-        # More lenient validation - allow various international formats
-        if len(cleaned_number) < 5 or len(cleaned_number) > 16:
+        cleaned_number = normalize_phone_number(phone_number)
+        if cleaned_number is None:
             return f"❌ Invalid phone number format: {phone_number} (too short or too long)"
         
         # Format for display
@@ -519,22 +902,28 @@ def call_phone_number(phone_number: str, contact_name: str = None) -> str:
 
 # Transcription helper functions using Supabase
 def create_transcription_record(device_id: str, filename: str = None, language: str = "auto", 
-                               model: str = "whisper-1", prompt: str = None, active_app: str = None) -> str:
+                               model: str = "whisper-1", prompt: str = None, active_app: str = None,
+                               file_size: int = None, duration: float = None) -> str:
     """Create a new transcription record and return the transcription UUID"""
     logger.info(f"Creating transcription record for device ID: {device_id}")
     if active_app:
         logger.info(f"Active app: {active_app}")
     try:
-        response = supabase.rpc('create_transcription', {
-            'device_id_param': device_id,
-            'filename_param': filename,
-            'language_param': language,
-            'model_param': model,
-            'prompt_param': prompt,
-            'active_app_param': active_app,
-            'screen_context_param': None
-        }).execute()
-        transcription_uuid = response.data
+        if write_outbox:
+            # The id is chosen here so the response does not wait for the database. Until
+            # the outbox replays the create, reads (history, export, search) do not see it
+            transcription_uuid = str(uuid.uuid4())
+            write_outbox.record("create_transcription", transcription_uuid, {
+                "device_id": device_id, "filename": filename, "language": language, "model": model,
+                "prompt": prompt, "active_app": active_app, "file_size": file_size, "duration": duration,
+                "transcription_id": transcription_uuid
+            })
+            return transcription_uuid
+        with db_call("create_transcription"):
+            transcription_uuid = storage.create_transcription(
+                device_id, filename=filename, language=language, model=model, prompt=prompt,
+                active_app=active_app, file_size=file_size, duration=duration
+            )
         logger.info(f"Transcription record created successfully: {transcription_uuid}")
         return transcription_uuid
     except Exception as e:
@@ -546,20 +935,69 @@ def update_transcription_result(transcription_id: str, result: str, status: str
     """Update transcription with result"""
     logger.info(f"Updating transcription result for ID: {transcription_id}")
     try:
-        response = supabase.rpc('update_transcription_result', {
-            'transcription_id_param': transcription_id,
-            'result_param': result,
-            'status_param': status,
-            'processing_time_param': processing_time,
-            'error_message_param': error_message
-        }).execute()
-        success = response.data
+        if write_outbox:
+            write_outbox.record("update_transcription_result", transcription_id, {
+                "transcription_id": transcription_id, "result": result, "status": status,
+                "processing_time": processing_time, "error_message": error_message
+            })
+            return True
+        with db_call("update_transcription_result"):
+            success = storage.update_transcription_result(
+                transcription_id, result, status=status, processing_time=processing_time,
+                error_message=error_message
+            )
         logger.info(f"Transcription result updated successfully: {transcription_id}")
         return success
     except Exception as e:
         logger.error(f"Error updating transcription result: {str(e)}")
         return False
 
+def update_transcription_upload(transcription_id: str, progress: int, file_size: int = None,
+                                duration: float = None) -> bool:
+    """Record upload progress (bytes received) and, once known, size and duration"""
+    fields = {"progress": progress}
+    if file_size is not None:
+        fields["file_size"] = file_size
+    if duration is not None:
+        fields["duration"] = duration
+    try:
+        if write_outbox:
+            write_outbox.record("update_transcription", transcription_id,
+                                {"transcription_id": transcription_id, "fields": fields})
+            return True
+        with db_call("update_transcription_upload"):
+            storage.update_transcription(transcription_id, fields)
+        return True
+    except Exception as e:
+        logger.error(f"Error updating upload progress for {transcription_id}: {str(e)}")
+        return False
+
+def index_transcription(device_id: str, transcription_id: str, text: Optional[str]):
+    """Queue a finished transcription for semantic search (returns at once)"""
+    if embedding_pipeline:
+        embedding_pipeline.submit(device_id, transcription_id, text)
+
+def fetch_transcription_page(device_id: str, limit: int, cursor: Optional[str] = None,
+                             columns: Tuple[str, ...] = ()) -> Tuple[List[Dict], Optional[str]]:
+    """One page of a device's history (newest first) and the cursor of the next page, if any"""
+    before = decode_cursor(cursor) if cursor else None
+    # One extra row tells whether another page exists without a count query
+    with db_call("list_transcriptions"):
+        rows = storage.list_transcriptions(device_id, limit + 1, before=before, columns=columns)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+def iter_transcription_history(device_id: str, columns: Tuple[str, ...]):
+    """Every transcription of a device, newest first, fetched a page at a time"""
+    cursor = None
+    while True:
+        rows, cursor = fetch_transcription_page(device_id, HISTORY_MAX_PAGE_SIZE, cursor, columns)
+        yield from rows
+        if not cursor:
+            return
+
 # API Endpoints
 @app.get("/")
 async def root():
@@ -587,21 +1025,44 @@ async def get_server_status():
 # Existing endpoints for device-based authentication
 @app.post("/register")
 async def register_user(registration: UserRegistration):
-    """Register a new device/user"""
+    """
+    Register a new device/user. Also returns a device token; registering again
+    is how a client replaces an expired or revoked one.
+    """
     logger.info(f"Device registration attempt for device ID: {registration.device_id}")
-    existing_user = get_user_by_device_id(registration.device_id)
-    if existing_user:
+    try:
+        user, created = await asyncio.to_thread(register_device, registration.device_id)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Failed to register device")
+    if not created:
         logger.info(f"Device already registered: {registration.device_id}")
-        return {"message": "User already registered", "user": existing_user}
+        return {"message": "User already registered", "user": user, "token": device_tokens.issue(user)}
     
-    user = create_user(registration.device_id, registration.email)
     logger.info(f"Device registered successfully: {registration.device_id}")
-    return {"message": "User registered successfully", "user": user}
+    user["email"] = registration.email
+    return {"message": "User registered successfully", "user": user, "token": device_tokens.issue(user)}
+
+@app.post("/tokens/revoke")
+async def revoke_token(claims: Optional[Dict] = Depends(device_token_claims)):
+    """Revoke the device token sent with this request (e.g. when signing out)"""
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Device token required", headers={"WWW-Authenticate": "Bearer"})
+    await asyncio.to_thread(device_tokens.revoke, claims)
+    logger.info(f"Device token revoked for device ID: {claims['device_id']}")
+    return {"revoked": True}
+
+@app.post("/devices/{device_id}/tokens/revoke", dependencies=[Depends(require_service_key)])
+async def revoke_device_tokens(device_id: str):
+    """Revoke every token issued to a device so far (admin)"""
+    await asyncio.to_thread(device_tokens.revoke_device, device_id)
+    logger.info(f"All device tokens revoked for device ID: {device_id}")
+    return {"revoked": True, "device_id": device_id}
 
 @app.get("/user/{device_id}/status")
-async def get_user_status(device_id: str):
+async def get_user_status(device_id: str, claims: Optional[Dict] = Depends(device_token_claims)):
     """Get user's current status and usage"""
     logger.info(f"Status request for device ID: {device_id}")
+    caller_device_id(claims, device_id)
     check_daily_reset()
     
     user = get_user_by_device_id(device_id)
@@ -622,68 +1083,248 @@ async def get_user_status(device_id: str):
         "is_premium": is_premium
     }
 
-# Simplified transcription function - using standard OpenAI API for all models
-async def transcribe_audio_file(file_path: str, model: str, language: str, prompt: str = None) -> str:
+def summarize_app_usage(rows: List[Dict], daily: bool = False) -> Dict:
+    """Totals per app (most used first) and overall from app_usage_daily rows"""
+    sums = ("transcriptions", "failed", "words", "audio_seconds", "processing_seconds")
+    apps: Dict[str, Dict] = {}
+    days: Dict[str, Dict] = {}
+    for row in rows:
+        app_totals = apps.setdefault(row["active_app"], {"active_app": row["active_app"] or None,
+                                                         **{s: 0 for s in sums}, "last_used": None})
+        day_totals = days.setdefault(str(row["day"]), {"day": str(row["day"]), **{s: 0 for s in sums}})
+        for s in sums:
+            app_totals[s] += row[s]
+            day_totals[s] += row[s]
+        app_totals["last_used"] = max(app_totals["last_used"] or "", str(row["day"]))
+    totals = {s: sum(a[s] for a in apps.values()) for s in sums}
+    for values in (*apps.values(), *days.values(), totals):
+        values["audio_seconds"] = round(values["audio_seconds"], 1)
+        values["processing_seconds"] = round(values["processing_seconds"], 1)
+    summary = {
+        "apps": sorted(apps.values(), key=lambda a: (-a["transcriptions"], a["active_app"] or "")),
+        "totals": totals
+    }
+    if daily:
+        summary["daily"] = sorted(days.values(), key=lambda d: d["day"])
+    return summary
+
+@app.get("/user/{device_id}/app-usage")
+async def get_app_usage(device_id: str, days: int = 30, daily: bool = False,
+                        claims: Optional[Dict] = Depends(device_token_claims)):
     """
-    Transcribe audio file using standard OpenAI API
+    Transcriptions, failures, words and audio per active app over the last `days`
+    days (UTC, including today), from the app_usage_daily rollups: the cost grows
+    with days and apps used, not with the number of transcriptions. `daily=true`
+    adds totals per day. Transcriptions without an app are under active_app null.
     """
+    caller_device_id(claims, device_id)
+    if not 1 <= days <= APP_USAGE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {APP_USAGE_MAX_DAYS}")
+    logger.info(f"App usage request for device ID: {device_id}")
+    end_day = datetime.utcnow().date()
+    start_day = end_day - timedelta(days=days - 1)
+    
+    def load():
+        with db_call("app_usage"):
+            return storage.app_usage(device_id, start_day.isoformat(), end_day.isoformat())
     try:
-        # openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY")) # This line is now redundant
-        
-        with open(file_path, "rb") as audio_file:
-            # All models use whisper-1 for now - gpt-4o-transcribe support coming soon
-            actual_model = "whisper-1"
-            transcription_params = {
-                "file": audio_file,
-                "model": actual_model
-            }
-            
-            if language and language != "auto":
-                transcription_params["language"] = language
-            
-            if prompt:
-                transcription_params["prompt"] = prompt
-            
-            logger.info(f"Calling OpenAI API with model: {actual_model}")
-            response = openai_client.audio.transcriptions.create(**transcription_params)
-            return response.text
-            
+        rows = await asyncio.to_thread(load)
     except Exception as e:
-        logger.error(f"Transcription error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
+        logger.error(f"Error loading app usage for device_id {device_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to load app usage")
+    return {"device_id": device_id, "start_day": start_day.isoformat(), "end_day": end_day.isoformat(),
+            **summarize_app_usage(rows, daily)}
 
-@app.post("/transcribe")
-async def transcribe_audio(
-    device_id: str = Form(...),
-    language: str = Form("auto"),
-    model: str = Form("gpt-4o-transcribe"),  # Default to gpt-4o-transcribe
-    prompt: str = Form(""),
-    active_app: str = Form(""),
-    audio_file: UploadFile = File(...)
-):
+@app.get("/transcriptions")
+async def list_transcriptions(device_id: Optional[str] = None, limit: int = HISTORY_PAGE_SIZE,
+                              cursor: Optional[str] = None, fields: Optional[str] = None, stream: bool = False,
+                              claims: Optional[Dict] = Depends(device_token_claims)):
     """
-    Transcribe audio using either Realtime API (gpt-4o models) or standard API (whisper models)
+    A device's transcriptions, newest first. Pass `next_cursor` back as `cursor`
+    for the following page; `fields` (comma-separated) limits the columns, e.g.
+    fields=status,duration,active_app leaves out prompt and result. With
+    stream=true every remaining page is streamed as NDJSON, one row per line.
     """
-    logger.info(f"Transcription request received - Device ID: {device_id}, Language: {language}, Model: {model}")
+    device_id = caller_device_id(claims, device_id)
+    if not 1 <= limit <= HISTORY_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {HISTORY_MAX_PAGE_SIZE}")
+    try:
+        columns = history_columns([f.strip() for f in fields.split(",") if f.strip()] if fields else None)
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"History request for device ID: {device_id} (limit {limit}, {'next page' if cursor else 'first page'})")
     
-    if prompt:
-        logger.info(f"Custom prompt received: {prompt}")
-    if active_app:
-        logger.info(f"Active app: {active_app}")
+    if stream:
+        async def stream_rows():
+            next_cursor = cursor
+            while True:
+                rows, next_cursor = await asyncio.to_thread(
+                    fetch_transcription_page, device_id, limit, next_cursor, columns)
+                if rows:
+                    yield "".join(json.dumps(row, default=str) + "\n" for row in rows)
+                if not next_cursor:
+                    break
+        return StreamingResponse(stream_rows(), media_type="application/x-ndjson")
     
-    # Verify OpenAI API key
-    openai_api_key = os.getenv("OPENAI_API_KEY")
-    if not openai_api_key:
-        raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+    try:
+        rows, next_cursor = await asyncio.to_thread(fetch_transcription_page, device_id, limit, cursor, columns)
+    except Exception as e:
+        logger.error(f"Error listing transcriptions for device_id {device_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to load transcription history")
+    return {"transcriptions": rows, "next_cursor": next_cursor, "has_more": next_cursor is not None}
+
+@app.get("/transcriptions/export")
+async def export_transcriptions(device_id: Optional[str] = None, format: str = "ndjson", fields: Optional[str] = None,
+                                cursor: Optional[str] = None, after_id: Optional[str] = None, gzip: bool = False,
+                                claims: Optional[Dict] = Depends(device_token_claims)):
+    """
+    Download a device's whole history, newest first, as NDJSON or CSV
+    (format=csv), gzip-compressed with gzip=true. Rows are fetched and sent a
+    page at a time, so memory stays flat whatever the size. To resume a broken
+    download, pass the id of the last row received as `after_id` (or a history
+    `cursor`); a resumed CSV export has no header row.
+    """
+    device_id = caller_device_id(claims, device_id)
+    try:
+        columns = history_columns([f.strip() for f in fields.split(",") if f.strip()] if fields else None)
+        encoder = ExportEncoder(format, columns, compress=gzip, header=not (cursor or after_id))
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"Export request for device ID: {device_id} ({format}{', gzip' if gzip else ''}"
+                f"{', resumed' if cursor or after_id else ''})")
     
-    # Daily usage reset
-        logger.info("Daily reset is handled automatically by database functions")
+    if after_id:
+        def find_last_row():
+            with db_call("get_transcriptions"):
+                return storage.get_transcriptions(device_id, [after_id], columns=("id", "created_at"))
+        try:
+            last_rows = await asyncio.to_thread(find_last_row)
+        except Exception as e:
+            logger.error(f"Error resuming export for device_id {device_id}: {str(e)}")
+            raise HTTPException(status_code=500, detail="Failed to resume export")
+        if not last_rows:
+            raise HTTPException(status_code=404, detail="after_id is not a transcription of this device")
+        cursor = encode_cursor(last_rows[0])
+    
+    async def stream_export():
+        next_cursor = cursor
+        try:
+            while True:
+                rows, next_cursor = await asyncio.to_thread(
+                    fetch_transcription_page, device_id, EXPORT_PAGE_SIZE, next_cursor, columns)
+                chunk = encoder.encode(rows)
+                if chunk:
+                    yield chunk
+                if not next_cursor:
+                    break
+            yield encoder.finish()
+        except Exception as e:
+            # The response has started; ending it early leaves a truncated file the client can resume
+            logger.error(f"Export for device_id {device_id} failed after {encoder.rows} rows: {str(e)}")
+            raise
+        logger.info(f"Export for device ID: {device_id} finished ({encoder.rows} rows)")
     
-    # Get or create user
-    user_data = get_user_by_device_id(device_id)
-    if not user_data:
-        user_data = create_user(device_id)
-    user_id = user_data["id"]
+    headers = {"Content-Disposition": f'attachment; filename="{encoder.filename("transcriptions")}"'}
+    return StreamingResponse(stream_export(), media_type=encoder.media_type, headers=headers)
+
+@app.get("/transcriptions/search")
+async def search_transcriptions(q: str, device_id: Optional[str] = None, limit: int = 20,
+                                claims: Optional[Dict] = Depends(device_token_claims)):
+    """
+    Full-text search over a device's transcription results, best match first.
+    Every word of `q` must appear; each hit has a rank and a snippet with the
+    matching words wrapped in <mark></mark>.
+    """
+    device_id = caller_device_id(claims, device_id)
+    if not 1 <= limit <= SEARCH_MAX_RESULTS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SEARCH_MAX_RESULTS}")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q must not be empty")
+    logger.info(f"Search request for device ID: {device_id}")
+    
+    def search():
+        with db_call("search_transcriptions"):
+            return storage.search_transcriptions(device_id, q, limit)
+    try:
+        results = await asyncio.to_thread(search)
+    except Exception as e:
+        logger.error(f"Error searching transcriptions for device_id {device_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to search transcriptions")
+    return {"query": q, "results": results}
+
+@app.get("/transcriptions/semantic-search")
+async def semantic_search_transcriptions(q: str, device_id: Optional[str] = None, limit: int = 10,
+                                         claims: Optional[Dict] = Depends(device_token_claims)):
+    """
+    A device's transcriptions closest in meaning to `q` (e.g. "the note about the
+    Zurich contractor"), most similar first, each with its cosine similarity as
+    `score`. A device with no vectors yet has its history indexed in the background
+    (`indexing` is true until the first of it has been embedded).
+    """
+    device_id = caller_device_id(claims, device_id)
+    if not embedding_pipeline:
+        raise HTTPException(status_code=503, detail="Semantic search is disabled (SEMANTIC_SEARCH_ENABLED not set)")
+    if not 1 <= limit <= SEARCH_MAX_RESULTS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SEARCH_MAX_RESULTS}")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q must not be empty")
+    logger.info(f"Semantic search request for device ID: {device_id}")
+    
+    def search():
+        matches, indexed = embedding_pipeline.search(device_id, q, limit)
+        if not matches:
+            return [], indexed
+        with db_call("get_transcriptions"):
+            rows = storage.get_transcriptions(device_id, [row_id for row_id, _ in matches],
+                                              columns=("id", "created_at", "status", "active_app", "result"))
+        by_id = {row["id"]: row for row in rows}
+        # Transcriptions deleted since they were indexed are skipped
+        return [{**by_id[row_id], "score": round(score, 4)} for row_id, score in matches if row_id in by_id], indexed
+    try:
+        results, indexed = await asyncio.to_thread(search)
+    except Exception as e:
+        logger.error(f"Error in semantic search for device_id {device_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to search transcriptions")
+    
+    indexing = indexed == 0
+    if indexing:
+        history = iter_transcription_history(device_id, ("id", "status", "result"))
+        asyncio.create_task(asyncio.to_thread(embedding_pipeline.backfill, device_id, history))
+    return {"query": q, "results": results, "indexed": indexed, "indexing": indexing}
+
+# Transcription with per-model dispatch and fallback (see transcription_models.py)
+async def transcribe_audio_file(file_path: str, model: str, language: str, prompt: str = None,
+                                filename: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Transcribe audio file with the requested model, falling back if it is unavailable.
+    Returns (text, model_used).
+    """
+    try:
+        # Run the blocking client call off the event loop so scheduled slots overlap
+        return await asyncio.to_thread(dispatch_transcription, openai_client, file_path, model, language, prompt,
+                                       filename)
+            
+    except Exception as e:
+        logger.error(f"Transcription error: {str(e)}")
+        # The upstream rejected the audio itself: sending the same file again cannot succeed
+        if getattr(e, "status_code", None) in UPSTREAM_REJECTED_AUDIO_STATUSES:
+            raise HTTPException(status_code=422, detail=f"Transcription failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
+
+ENHANCED_PROMPT_BASE = "If this appears to be an email or formal correspondence, add appropriate line breaks between paragraphs, after greetings, before signatures, and between distinct sections. Maintain natural paragraph structure for better readability. For phone numbers, use the plus country code format."
+
+def build_transcription_prompt(prompt: Optional[str]) -> str:
+    """Formatting instructions sent upstream, followed by the client's own prompt"""
+    return f"{ENHANCED_PROMPT_BASE} {prompt}" if prompt else ENHANCED_PROMPT_BASE
+
+def resolve_user(device_id: str) -> Dict:
+    """Get or create the user for a device and apply rate limiting"""
+    with stage("resolve_user"):
+        user_data, _ = register_device(device_id)
     
     # Check rate limiting (if enabled)
     if RATE_LIMITING_ENABLED:
@@ -696,90 +1337,510 @@ async def transcribe_audio(
             )
     else:
         logger.info(f"Rate limiting disabled - allowing transcription for device ID: {device_id}")
-    
-    # Save uploaded file temporarily
-    tmp_file_path = None
+    return user_data
+
+def request_elapsed() -> Optional[float]:
+    """Seconds since the current request started (stored as transcriptions.processing_time)"""
+    timer = metrics.current_timer()
+    return round(timer.elapsed(), 3) if timer else None
+
+async def run_transcription_job(device_id: str, user_data: Dict, transcription_id: str, file_path: str,
+                                model: str, language: str, prompt: str, file_size: int,
+                                audio_duration: Optional[float], filename: Optional[str] = None) -> Dict[str, Any]:
+    """Schedule the upstream call for a stored recording, persist the result and return the payload"""
     try:
-        # Read file content
-        file_content = await audio_file.read()
-        
-        # Log file details
-        logger.info(f"Processing audio file - Name: {audio_file.filename}, Size: {len(file_content)} bytes, Type: {audio_file.content_type}")
-        
-        # Create transcription record
-        transcription_id = create_transcription_record(
-            device_id=device_id,
-            filename=audio_file.filename,
-            language=language,
-            model=model,
-            prompt=prompt,
-            active_app=active_app
-        )
-        
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            tmp_file_path = tmp_file.name
-            tmp_file.write(file_content)
-        
-        logger.info(f"Audio file saved to temporary location: {tmp_file_path}")
-        
         # Transcribe using standard OpenAI API
         logger.info(f"Starting transcription with model: {model}")
         
-        # Enhanced prompt for better formatting
-        if prompt:
-            enhanced_prompt = f"If this appears to be an email or formal correspondence, add appropriate line breaks between paragraphs, after greetings, before signatures, and between distinct sections. Maintain natural paragraph structure for better readability. For phone numbers, use the plus country code format. {prompt}"
-        else:
-            enhanced_prompt = "If this appears to be an email or formal correspondence, add appropriate line breaks between paragraphs, after greetings, before signatures, and between distinct sections. Maintain natural paragraph structure for better readability. For phone numbers, use the plus country code format."
-        
-        if enhanced_prompt:
-            logger.info(f"Enhanced prompt being sent: {enhanced_prompt}")
+        enhanced_prompt = build_transcription_prompt(prompt)
+        logger.debug(f"Enhanced prompt being sent: {enhanced_prompt}")
         
-        # Call transcription function
-        transcription_text = await transcribe_audio_file(tmp_file_path, model, language, enhanced_prompt)
+        # Call transcription function once the scheduler grants an upstream slot;
+        # shorter recordings are scheduled ahead of longer ones
+        job_cost = estimate_duration(audio_duration, file_size)
+        wait_started = time.perf_counter()
+        async with upstream_scheduler.slot(user_data.get("subscription_tier"), device_id, cost=job_cost):
+            record_stage("scheduler_wait", time.perf_counter() - wait_started)
+            with stage("upstream"):
+                transcription_text, model_used = await transcribe_audio_file(file_path, model, language, enhanced_prompt,
+                                                                                filename)
         
-        logger.info(f"Transcription completed successfully - Text length: {len(transcription_text)} characters")
+        logger.info(f"Transcription completed successfully with {model_used} - Text length: {len(transcription_text)} characters")
         
-        # Update transcription result
-        update_transcription_result(transcription_id, transcription_text)
-        
-        # Clean up temporary file
-        if tmp_file_path:
-            os.unlink(tmp_file_path)
-            logger.info(f"Temporary file cleaned up: {tmp_file_path}")
+        # Update transcription result, with the time spent on the request so far
+        with stage("update_result"):
+            update_transcription_result(transcription_id, transcription_text, processing_time=request_elapsed())
+        index_transcription(device_id, transcription_id, transcription_text)
         
         # Increment usage
-        increment_usage(device_id)
+        with stage("increment_usage"):
+            increment_usage(device_id)
         
         logger.info(f"Transcription completed successfully for device ID: {device_id}")
         
-        return JSONResponse(content={
+        return {
             "text": transcription_text,
             "usage_remaining": 999999 if not RATE_LIMITING_ENABLED else max(0, FREE_TRANSCRIPTION_LIMIT - (user_data.get("daily_transcriptions", 0) + 1)),
             "is_premium": False,
-            "model_used": model
-        })
+            "model_used": model_used
+        }
+        
+    except SchedulerQueueFull as e:
+        logger.warning(f"Transcription rejected for device ID: {device_id} - {str(e)}")
+        update_transcription_result(transcription_id, None, status="failed",
+                                    processing_time=request_elapsed(), error_message=str(e))
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+        
+    except HTTPException as e:
+        update_transcription_result(transcription_id, None, status="failed",
+                                    processing_time=request_elapsed(), error_message=str(e.detail))
+        raise
         
     except Exception as e:
         logger.error(f"Transcription error: {str(e)}")
+        update_transcription_result(transcription_id, None, status="failed",
+                                    processing_time=request_elapsed(), error_message=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def process_transcription(device_id: str, language: str, model: str, prompt: str, active_app: str,
+                                filename: str, content_type: str, file_content: bytes,
+                                user_data: Optional[Dict] = None) -> Dict[str, Any]:
+    """Run one transcription end to end and return the response payload"""
+    user_data = user_data or resolve_user(device_id)
+    
+    # Save uploaded file temporarily
+    tmp_file_path = None
+    try:
+        # Read the duration from the container header (no decoding)
+        with stage("probe"):
+            audio_duration = probe_duration_bytes(file_content)
         
+        # Log file details
+        logger.info(f"Processing audio file - Name: {filename}, Size: {len(file_content)} bytes, Duration: {audio_duration}s, Type: {content_type}")
+        
+        # Create transcription record
+        with stage("create_record"):
+            transcription_id = create_transcription_record(
+                device_id=device_id,
+                filename=filename,
+                language=language,
+                model=model,
+                prompt=prompt,
+                active_app=active_app,
+                file_size=len(file_content),
+                duration=audio_duration
+            )
+        
+        # Save to temporary file
+        with stage("write_temp_file"), \
+                tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
+            tmp_file_path = tmp_file.name
+            tmp_file.write(file_content)
+        
+        logger.info(f"Audio file saved to temporary location: {tmp_file_path}")
+        
+        return await run_transcription_job(
+            device_id, user_data, transcription_id, tmp_file_path,
+            model, language, prompt, len(file_content), audio_duration
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Transcription error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
         # Clean up temporary file if it exists
         if tmp_file_path and os.path.exists(tmp_file_path):
             os.unlink(tmp_file_path)
-        
-        # Try to update transcription with error
+            logger.info(f"Temporary file cleaned up: {tmp_file_path}")
+
+@app.post("/transcribe")
+async def transcribe_audio(
+    device_id: Optional[str] = Form(None),
+    language: str = Form("auto"),
+    model: str = Form("gpt-4o-transcribe"),  # Default to gpt-4o-transcribe
+    prompt: str = Form(""),
+    active_app: str = Form(""),
+    audio_file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None),
+    debug: bool = False,
+    claims: Optional[Dict] = Depends(device_token_claims)
+):
+    """
+    Transcribe audio with the requested model (gpt-4o-transcribe, gpt-4o-mini-transcribe
+    or whisper-1), falling back to the next model if it is unavailable
+    
+    Retries are deduplicated by the Idempotency-Key header, or by a hash of the
+    audio and parameters when no key is sent. With ?debug=true the response
+    includes a per-stage timing breakdown (always sent in Server-Timing).
+    
+    With a device token (Authorization: Bearer) the user comes from the token and
+    device_id may be left out; without one, device_id is looked up in the database.
+    """
+    device_id = caller_device_id(claims, device_id)
+    logger.info(f"Transcription request received - Device ID: {device_id}, Language: {language}, Model: {model}")
+    
+    if prompt:
+        logger.debug(f"Custom prompt received: {prompt}")
+    if active_app:
+        logger.info(f"Active app: {active_app}")
+    
+    # Verify OpenAI API key
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key:
+        raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+    
+    # Read file content
+    with stage("read_upload"):
+        file_content = await audio_file.read()
+    
+    # A retry of the same request joins the running job or replays its result
+    request_key = transcription_idempotency.derive_key(
+        device_id, idempotency_key, file_content, model, language, prompt, active_app
+    )
+    payload, replayed = await transcription_idempotency.run(
+        request_key,
+        lambda: process_transcription(
+            device_id=device_id,
+            language=language,
+            model=model,
+            prompt=prompt,
+            active_app=active_app,
+            filename=audio_file.filename,
+            content_type=audio_file.content_type,
+            file_content=file_content,
+            user_data=token_user(claims) if claims else None
+        )
+    )
+    CACHE_REQUESTS.inc(cache="idempotency", result="hit" if replayed else "miss")
+    if debug:
+        payload = {**payload, "timing": metrics.current_timer().breakdown()}
+    
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return JSONResponse(content=payload, headers=headers)
+
+# Resumable chunked upload: create a session when recording starts, append
+# chunks while recording, then finalize. User lookup and record creation happen
+# at session creation, so they overlap with the recording instead of adding to
+# the latency after the hotkey is released.
+@app.post("/uploads")
+async def create_upload_session(request: UploadSessionRequest,
+                                claims: Optional[Dict] = Depends(device_token_claims)):
+    """Start a resumable upload session for a recording in progress"""
+    device_id = caller_device_id(claims, request.device_id)
+    logger.info(f"Upload session requested - Device ID: {device_id}, Model: {request.model}")
+    
+    def start_session():
+        user_data = token_user(claims) if claims else resolve_user(device_id)
+        transcription_id = create_transcription_record(
+            device_id=device_id,
+            filename=request.filename,
+            language=request.language,
+            model=request.model,
+            prompt=request.prompt,
+            active_app=request.active_app,
+            file_size=request.total_size
+        )
+        return upload_manager.create({
+            "device_id": device_id,
+            "language": request.language,
+            "model": request.model,
+            "prompt": request.prompt,
+            "active_app": request.active_app,
+            "filename": request.filename,
+            "total_size": request.total_size,
+            "transcription_id": transcription_id,
+            "user": user_data,
+            "progress_reported": 0
+        })
+    
+    # User lookup, row insert and session files off the event loop
+    session = await asyncio.to_thread(start_session)
+    transcription_id = session["transcription_id"]
+    logger.info(f"Upload session created: {session['upload_id']} for transcription {transcription_id}")
+    return {
+        "upload_id": session["upload_id"],
+        "transcription_id": transcription_id,
+        "received": 0,
+        "max_bytes": UPLOAD_MAX_BYTES
+    }
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_session(upload_id: str):
+    """Return how many bytes the server holds, so an interrupted client can resume"""
+    try:
+        session = upload_manager.get(upload_id)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return {
+        "upload_id": upload_id,
+        "status": session["status"],
+        "received": session["received"],
+        "total_size": session.get("total_size")
+    }
+
+@app.put("/uploads/{upload_id}")
+async def append_upload_chunk(upload_id: str, request: Request, background_tasks: BackgroundTasks, offset: int = 0):
+    """Append a raw audio chunk at the given byte offset"""
+    with stage("read_upload"):
+        chunk = await request.body()
+    try:
+        session = upload_manager.get(upload_id)
+        received = upload_manager.append(upload_id, offset, chunk)
+        # Mirror bytes received into transcriptions.progress, throttled and off the response path
+        report_progress = upload_manager.claim_progress(upload_id, received, UPLOAD_PROGRESS_STEP_BYTES)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    except UploadOffsetMismatch as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "received": e.expected})
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    if report_progress:
+        background_tasks.add_task(update_transcription_upload, session["transcription_id"], received)
+    
+    return {"upload_id": upload_id, "received": received}
+
+def retryable(error: HTTPException) -> bool:
+    """Whether the same request may succeed later (busy or failing upstream, not a rejection)"""
+    return error.status_code == 429 or error.status_code >= 500
+
+async def finalize_upload(session: Dict) -> Dict[str, Any]:
+    """
+    Transcribe a completely received upload and discard the session. When the
+    failure is retryable the session stays, so the client can finalize again
+    without re-uploading.
+    """
+    upload_id = session["upload_id"]
+    file_path = upload_manager.data_path(upload_id)
+    file_size = session["received"]
+    
+    try:
         try:
-            if 'transcription_id' in locals():
-                update_transcription_result(transcription_id, str(e))
-        except:
-            pass
+            with stage("probe"), open(file_path, "rb") as f:
+                audio_duration = probe_duration(f, file_size)
+            logger.info(f"Finalizing upload {upload_id} - Size: {file_size} bytes, Duration: {audio_duration}s")
+            
+            # Progress, size and duration in one write, off the upstream path
+            await asyncio.to_thread(update_transcription_upload, session["transcription_id"], file_size, file_size,
+                                    audio_duration)
+        except Exception as e:
+            logger.error(f"Finalizing upload {upload_id} failed: {str(e)}")
+            await asyncio.to_thread(update_transcription_result, session["transcription_id"], None,
+                                    status="failed", error_message=str(e))
+            raise HTTPException(status_code=500, detail=str(e))
         
-        raise HTTPException(status_code=500, detail=str(e))
+        # The part file has no audio suffix; the client's file name tells the upstream the format
+        payload = await run_transcription_job(
+            session["device_id"], session["user"], session["transcription_id"], file_path,
+            session["model"], session["language"], session["prompt"], file_size, audio_duration,
+            filename=session.get("filename") or None
+        )
+    except HTTPException as e:
+        if retryable(e):
+            logger.warning(f"Keeping upload {upload_id} for a retried finalize ({e.status_code})")
+        else:
+            upload_manager.delete(upload_id)
+        raise
+    upload_manager.delete(upload_id)
+    return payload
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload_session(upload_id: str, debug: bool = False):
+    """Finish an upload and return the transcription (same payload as /transcribe)"""
+    try:
+        session = upload_manager.get(upload_id)
+    except UploadNotFound:
+        # Already finalized: a retried finalize may still replay the stored result
+        session = None
+    
+    if session is not None and session.get("total_size") and session["received"] < session["total_size"]:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Upload incomplete", "received": session["received"]}
+        )
+    
+    # A retried finalize joins the running job or replays the stored result
+    request_key = f"upload:{upload_id}"
+    if session is None and not await transcription_idempotency.known(request_key):
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    payload, replayed = await transcription_idempotency.run(request_key, lambda: finalize_upload(session))
+    CACHE_REQUESTS.inc(cache="idempotency", result="hit" if replayed else "miss")
+    if debug:
+        payload = {**payload, "timing": metrics.current_timer().breakdown()}
+    
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return JSONResponse(content=payload, headers=headers)
+
+# Live dictation: the client streams PCM frames while the user speaks and sends
+# {"type": "stop"} on hotkey release. Partial transcripts are pushed as they
+# arrive, so the final text follows the release almost immediately.
+class InvalidControlFrame(Exception):
+    """A text frame that is not a control message the relay understands"""
+
+    def __init__(self, code: int, reason: str):
+        super().__init__(reason)
+        self.code = code
+
+async def _relay_client_audio(websocket: WebSocket, upstream: RealtimeTranscriptionSession) -> int:
+    """Forward client audio frames upstream until the client sends stop; returns bytes relayed"""
+    relayed = 0
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("bytes"):
+            relayed += len(message["bytes"])
+            await upstream.append_audio(message["bytes"])
+        elif message.get("text"):
+            try:
+                control = json.loads(message["text"])
+            except ValueError:
+                raise InvalidControlFrame(1007, "Control frames must be JSON")
+            if not isinstance(control, dict) or control.get("type") != "stop":
+                raise InvalidControlFrame(1003, "Unsupported control frame (expected {\"type\": \"stop\"})")
+            await upstream.commit()
+            return relayed
+
+async def _push_transcripts(websocket: WebSocket, upstream: RealtimeTranscriptionSession) -> str:
+    """Send partial transcripts to the client as they arrive; returns the final text"""
+    text = ""
+    async for event in upstream.transcripts():
+        if event["type"] == "partial":
+            text += event["delta"]
+            await websocket.send_json({"type": "partial", "delta": event["delta"], "text": text})
+        else:
+            text = event["text"]
+            await websocket.send_json({"type": "final", "text": text})
+            break
+    return text
+
+async def _close_with_error(websocket: WebSocket, code: int, message: str):
+    """Send an error event and close, unless the session is already closed"""
+    if websocket.application_state != WebSocketState.CONNECTED:
+        return
+    try:
+        await websocket.send_json({"type": "error", "message": message})
+        await websocket.close(code=code)
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # The client left meanwhile
+
+def record_realtime_transcription(device_id: str, language: str, model: str, prompt: str,
+                                  active_app: str, text: str, audio_bytes: int):
+    """Persist a finished live dictation (runs off the response path)"""
+    try:
+        transcription_id = create_transcription_record(
+            device_id=device_id,
+            filename="realtime.pcm",
+            language=language,
+            model=model,
+            prompt=prompt,
+            active_app=active_app,
+            file_size=audio_bytes,
+            duration=audio_bytes / (REALTIME_SAMPLE_RATE * 2)
+        )
+        update_transcription_result(transcription_id, text)
+        index_transcription(device_id, transcription_id, text)
+        increment_usage(device_id)
+    except Exception as e:
+        logger.error(f"Failed to record realtime transcription for device ID: {device_id}: {str(e)}")
+
+@app.websocket("/ws/transcribe")
+async def websocket_transcribe(
+    websocket: WebSocket,
+    device_id: Optional[str] = None,
+    language: str = "auto",
+    model: str = "gpt-4o-transcribe",
+    prompt: str = "",
+    active_app: str = "",
+    token: Optional[str] = None
+):
+    """Live transcription relayed to a streaming upstream session"""
+    # Checked before the handshake completes: a rejected client never gets a session
+    try:
+        claims = websocket_token_claims(websocket, token)
+        device_id = caller_device_id(claims, device_id)
+    except HTTPException as e:
+        logger.warning(f"Live transcription refused - Device ID: {device_id}: {e.detail}")
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+    await websocket.accept()
+    logger.info(f"Live transcription session opened - Device ID: {device_id}, Model: {model}")
+    
+    model = resolve_model(model)
+    enhanced_prompt = build_transcription_prompt(prompt)
+    WEBSOCKET_SESSIONS.inc(route="/ws/transcribe")
+    # Resolve the user while the upstream session is being opened
+    user_lookup = asyncio.create_task(asyncio.to_thread(resolve_user, device_id))
+    try:
+        async with RealtimeTranscriptionSession(
+            OPENAI_REALTIME_URL, OPENAI_API_KEY, model, language, enhanced_prompt
+        ) as upstream:
+            await user_lookup
+            await websocket.send_json({
+                "type": "ready",
+                "audio_format": REALTIME_AUDIO_FORMAT,
+                "sample_rate": REALTIME_SAMPLE_RATE
+            })
+            
+            # Whichever side fails first (client gone, bad frame, upstream error) ends
+            # the session; the other is cancelled before the upstream session closes
+            relay = asyncio.create_task(_relay_client_audio(websocket, upstream))
+            push = asyncio.create_task(_push_transcripts(websocket, upstream))
+            try:
+                done, _ = await asyncio.wait({relay, push}, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()  # Raises the failure
+                # The client has stopped; the upstream still owes the final transcript
+                try:
+                    text = await asyncio.wait_for(push, REALTIME_FINAL_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise RealtimeUpstreamError(f"No final transcript within {REALTIME_FINAL_TIMEOUT:g}s")
+                audio_bytes = await relay
+            finally:
+                for task in (relay, push):
+                    task.cancel()
+                await asyncio.gather(relay, push, return_exceptions=True)
+        
+        await websocket.close()
+        logger.info(f"Live transcription completed for device ID: {device_id} - {len(text)} characters")
+        
+        # Persist without holding the client
+        await asyncio.to_thread(
+            record_realtime_transcription, device_id, language, model, prompt, active_app, text, audio_bytes
+        )
+        
+    except WebSocketDisconnect:
+        logger.info(f"Live transcription client disconnected - Device ID: {device_id}")
+    except RealtimeUpstreamError as e:
+        logger.error(f"Live transcription upstream error for device ID: {device_id}: {str(e)}")
+        await websocket.send_json({"type": "error", "message": str(e)})
+        await websocket.close(code=1011)
+    except InvalidControlFrame as e:
+        logger.warning(f"Live transcription closed for device ID: {device_id}: {str(e)}")
+        await websocket.send_json({"type": "error", "message": str(e)})
+        await websocket.close(code=e.code)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "message": e.detail})
+        await websocket.close(code=1008)
+    except Exception as e:
+        # Anything else (e.g. the user lookup failing) still ends with a close frame
+        logger.error(f"Live transcription failed for device ID: {device_id}: {str(e)}")
+        await _close_with_error(websocket, 1011, "Live transcription failed")
+    finally:
+        WEBSOCKET_SESSIONS.inc(-1, route="/ws/transcribe")
+        # Not awaited when opening the upstream session failed first
+        user_lookup.cancel()
+        await asyncio.gather(user_lookup, return_exceptions=True)
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat_completion(request: ChatRequest):
+async def chat_completion(request: ChatRequest, claims: Optional[Dict] = Depends(device_token_claims)):
     """Chat completion using OpenAI GPT-4o API with function calling support"""
-    logger.info(f"Chat completion request received - Message: {request.message}, Model: {request.model}, Functions enabled: {request.enable_functions}")
+    if claims:
+        logger.info(f"Chat request from device ID: {claims['device_id']}")
+    logger.info(f"Chat completion request received - Message length: {len(request.message)}, Model: {request.model}, Functions enabled: {request.enable_functions}")
+    logger.debug(f"Chat message: {request.message}")
     
     if not OPENAI_API_KEY:
         logger.error("OpenAI API key not configured")
@@ -813,10 +1874,7 @@ async def chat_completion(request: ChatRequest):
         
         # Add function calling support if enabled
         if request.enable_functions:
-            chat_params["tools"] = [
-                {"type": "function", "function": func_def} 
-                for func_def in AVAILABLE_FUNCTIONS.values()
-            ]
+            chat_params["tools"] = CHAT_TOOLS
             chat_params["tool_choice"] = "auto"
         
         response = openai_client.chat.completions.create(**chat_params) # Use openai_client
@@ -838,7 +1896,7 @@ async def chat_completion(request: ChatRequest):
                 except json.JSONDecodeError:
                     function_args = {}
                 
-                logger.info(f"Executing function: {function_name} with args: {function_args}")
+                logger.debug(f"Executing function: {function_name} with args: {function_args}")
                 
                 # Execute the function
                 function_result = execute_function(function_name, function_args)
@@ -887,6 +1945,51 @@ async def chat_completion(request: ChatRequest):
         logger.error(f"Chat completion failed - Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Chat completion failed: {str(e)}")
 
+@app.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """Get upstream scheduler queue depths and wait times per lane"""
+    logger.info("Scheduler stats requested")
+    return {**upstream_scheduler.stats(), "idempotency": transcription_idempotency.stats()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics, summed across all workers sharing METRICS_DIR"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/loop", dependencies=[Depends(require_service_key)])
+async def get_loop_offenders(limit: int = 10):
+    """Call sites that blocked this worker's event loop longest, with the stack captured mid-stall"""
+    return {
+        "pid": os.getpid(),
+        "enabled": LOOP_WATCHDOG_ENABLED,
+        "threshold_ms": LOOP_LAG_THRESHOLD_MS,
+        "offenders": loop_watchdog.offenders(limit),
+    }
+
+@app.get("/debug/profile", dependencies=[Depends(require_service_key)])
+async def profile_worker(seconds: float = 10.0, interval_ms: float = 5.0, all_workers: bool = False):
+    """
+    Sample this worker's stacks for `seconds` and return them as collapsed stacks
+    (flamegraph.pl / speedscope input). With all_workers=true every gunicorn worker
+    is profiled over the same window and each stack is rooted at `worker-<pid>`.
+    """
+    if not 0 < seconds <= profiler.MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {profiler.MAX_SECONDS:g}")
+    interval = interval_ms / 1000
+    logger.info(f"🔬 Profiling {'all workers' if all_workers else f'worker {os.getpid()}'} for {seconds:g}s")
+    
+    sibling_request = profiler.request_siblings(seconds, interval) if all_workers else None
+    try:
+        stacks = await asyncio.to_thread(profiler.sample, seconds, interval)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    output = profiler.collapse(stacks, root=f"worker-{os.getpid()}" if all_workers else None)
+    if sibling_request:
+        siblings = await asyncio.to_thread(profiler.collect_siblings, sibling_request)
+        output += "".join(siblings.values())
+    return PlainTextResponse(output)
+
 @app.get("/functions")
 async def get_available_functions():
     """Get list of available functions for the assistant"""
@@ -897,26 +2000,31 @@ async def get_available_functions():
     }
 
 @app.post("/upgrade/{device_id}")
-async def upgrade_user(device_id: str, tier: str = "premium"):
+async def upgrade_user(device_id: str, tier: str = "premium", claims: Optional[Dict] = Depends(device_token_claims)):
     """Upgrade user to premium (integrate with payment system)"""
+    caller_device_id(claims, device_id)
     # This is a mock endpoint. In a real implementation, verify payment here.
     logger.info(f"Upgrading user {device_id} to {tier}")
     
     try:
         # First, check if the user exists
-        user_response = supabase.table('users').select('id').eq('device_id', device_id).execute()
-        if not user_response.data:
+        with db_call("get_user"):
+            existing = storage.find_user(device_id)
+        if not existing:
             logger.warning(f"Upgrade failed: user with device_id {device_id} not found.")
             raise HTTPException(status_code=404, detail="User not found")
 
         # If user exists, update their subscription tier
-        update_response = supabase.table('users').update({'subscription_tier': tier}).eq('device_id', device_id).execute()
+        with db_call("update_subscription"):
+            updated = storage.update_user(device_id, {'subscription_tier': tier})
         
-        if not update_response.data:
+        if not updated:
              logger.error(f"Failed to upgrade user {device_id} even though they exist.")
              raise HTTPException(status_code=500, detail="Failed to update user subscription")
 
         logger.info(f"User {device_id} upgraded to {tier} successfully.")
+        # Tokens carry the old tier; the client registers again for one with the new tier
+        await asyncio.to_thread(device_tokens.revoke_device, device_id)
         return {"message": f"User upgraded to {tier}", "device_id": device_id}
         
     except HTTPException:
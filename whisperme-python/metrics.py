@@ -0,0 +1,498 @@
+"""
+In-process metrics for WhisperMe Backend
+Counters, gauges and histograms rendered in the Prometheus text format.
+With several gunicorn workers each process writes a snapshot to a shared
+directory and /metrics merges them, so any worker returns the server total.
+"""
+
+import contextvars
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from scheduler import WAIT_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Family:
+    """One metric name with a fixed set of label names"""
+
+    def __init__(self, registry: "MetricsRegistry", kind: str, name: str, help_text: str,
+                 labelnames: Sequence[str], buckets: Optional[Sequence[float]] = None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+        # label values -> number, or [bucket counts..., +Inf count, sum] for histograms
+        self.values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.touch()
+
+    def set(self, value: float, **labels):
+        with self.registry.lock:
+            self.values[self._key(labels)] = value
+        self.registry.touch()
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+        self.registry.touch()
+
+    def set_histogram(self, bucket_counts: Sequence[int], total: float, **labels):
+        """Replace a histogram with counts kept elsewhere (non-cumulative, +Inf last)"""
+        with self.registry.lock:
+            self.values[self._key(labels)] = list(bucket_counts) + [total]
+        self.registry.touch()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Gauge of blocks currently running"""
+        self.inc(1, **labels)
+        try:
+            yield
+        finally:
+            self.inc(-1, **labels)
+
+    def snapshot(self) -> Dict:
+        return {
+            "kind": self.kind,
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "buckets": list(self.buckets) if self.buckets else None,
+            "samples": [[list(key), list(value) if isinstance(value, list) else value]
+                        for key, value in self.values.items()],
+        }
+
+
+class MetricsRegistry:
+    """
+    Metric families for this process.
+
+    When `directory` is set, a background thread writes this process's values
+    to `<directory>/<pid>.json` every `flush_seconds` (only if something
+    changed) and `render()` merges every snapshot in the directory: counters
+    and histograms are summed across all workers, including ones that have
+    exited, and gauges across the workers that are still alive. Clear the
+    directory when the server starts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families: Dict[str, _Family] = {}
+        self.collectors: List[Callable[[], None]] = []
+        self.directory: Optional[str] = None
+        self.flush_seconds = 5.0
+        self._dirty = threading.Event()
+        self._pid = os.getpid()
+        self._flusher: Optional[threading.Thread] = None
+        self._local = threading.local()
+
+    def configure(self, directory: Optional[str] = None, flush_seconds: float = 5.0):
+        self.directory = directory or None
+        self.flush_seconds = flush_seconds
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> _Family:
+        return self._register(_Family(self, "counter", name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> _Family:
+        return self._register(_Family(self, "gauge", name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> _Family:
+        return self._register(_Family(self, "histogram", name, help_text, labelnames, buckets))
+
+    def _register(self, family: _Family) -> _Family:
+        if family.name in self.families:
+            raise ValueError(f"Metric {family.name} is already registered")
+        self.families[family.name] = family
+        return family
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Register a callback that refreshes values kept elsewhere (e.g. scheduler stats)"""
+        self.collectors.append(collector)
+
+    def collect(self):
+        # Values set by collectors are refreshed on every flush anyway, so they
+        # must not mark the registry dirty (that would flush forever when idle)
+        self._local.collecting = True
+        try:
+            for collector in self.collectors:
+                try:
+                    collector()
+                except Exception as e:
+                    logger.error(f"Metrics collector failed: {str(e)}")
+        finally:
+            self._local.collecting = False
+
+    def touch(self):
+        if not self.directory or getattr(self._local, "collecting", False):
+            return
+        if self._pid != os.getpid():
+            # Forked worker: values recorded in the parent belong to the parent
+            self._pid = os.getpid()
+            self._flusher = None
+            with self.lock:
+                for family in self.families.values():
+                    family.values.clear()
+        self._dirty.set()
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.flush_seconds)
+            self._dirty.clear()
+            self.flush()
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "families": {name: family.snapshot() for name, family in self.families.items()},
+            }
+
+    def flush(self):
+        """Write this process's snapshot for the other workers to merge"""
+        if not self.directory:
+            return
+        self.collect()
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Failed to write metrics snapshot: {str(e)}")
+
+    def _snapshots(self) -> List[Dict]:
+        own = self.snapshot()
+        snapshots = [own]
+        if not self.directory:
+            return snapshots
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name == f"{own['pid']}.json":
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshot["alive"] = _pid_alive(snapshot.get("pid"))
+            snapshots.append(snapshot)
+        return snapshots
+
+    def render(self) -> str:
+        """Prometheus text exposition of the merged values"""
+        self.collect()
+        merged: Dict[str, Dict] = {}
+        for snapshot in self._snapshots():
+            for name, family in snapshot["families"].items():
+                if family["kind"] == "gauge" and not snapshot.get("alive", True):
+                    continue
+                target = merged.setdefault(name, {**family, "samples": {}})
+                for labels, value in family["samples"]:
+                    key = tuple(labels)
+                    current = target["samples"].get(key)
+                    if current is None:
+                        target["samples"][key] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        target["samples"][key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        target["samples"][key] = current + value
+
+        lines = []
+        for name in sorted(merged):
+            family = merged[name]
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['kind']}")
+            labelnames = family["labelnames"]
+            for key, value in sorted(family["samples"].items()):
+                labels = list(zip(labelnames, key))
+                if family["kind"] != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(family["buckets"]) + [math.inf], value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + [('le', _number(bound))])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+registry = MetricsRegistry()
+
+# HTTP
+HTTP_REQUESTS = registry.counter(
+    "whisperme_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = registry.histogram(
+    "whisperme_http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+HTTP_IN_FLIGHT = registry.gauge(
+    "whisperme_http_requests_in_flight", "HTTP requests being handled", ("route",))
+WEBSOCKET_SESSIONS = registry.gauge(
+    "whisperme_websocket_sessions_in_flight", "Open live transcription sessions", ("route",))
+
+# Transcription pipeline
+STAGE_LATENCY = registry.histogram(
+    "whisperme_stage_duration_seconds", "Time spent in each transcription pipeline stage", ("stage",))
+UPSTREAM_LATENCY = registry.histogram(
+    "whisperme_upstream_request_duration_seconds", "OpenAI call latency per model attempt", ("model", "outcome"))
+
+# Database
+DB_LATENCY = registry.histogram(
+    "whisperme_db_query_duration_seconds", "Supabase call latency", ("operation",))
+DB_ROUND_TRIPS = registry.histogram(
+    "whisperme_db_round_trips_per_request", "Supabase calls made while handling one request",
+    ("route",), buckets=ROUND_TRIP_BUCKETS)
+
+# Upstream scheduler (refreshed from UpstreamScheduler.stats() by a collector)
+SCHEDULER_ACTIVE = registry.gauge(
+    "whisperme_scheduler_active", "Upstream slots in use")
+SCHEDULER_QUEUED = registry.gauge(
+    "whisperme_scheduler_queued", "Jobs waiting for an upstream slot", ("lane",))
+SCHEDULER_DISPATCHED = registry.counter(
+    "whisperme_scheduler_dispatched_total", "Jobs granted an upstream slot", ("lane",))
+SCHEDULER_REJECTED = registry.counter(
+    "whisperme_scheduler_rejected_total", "Jobs rejected because the queue was full", ("lane",))
+SCHEDULER_WAIT = registry.histogram(
+    "whisperme_scheduler_wait_seconds", "Time queued before an upstream slot was granted",
+    ("lane",), buckets=WAIT_BUCKETS)
+
+# Process
+PROCESS_MEMORY = registry.gauge(
+    "whisperme_process_memory_bytes",
+    "Worker memory: rss, pss (shared pages split between processes) and private", ("pid", "kind"))
+
+# Event loop (fed by loop_watchdog.LoopWatchdog)
+LOOP_LAG = registry.histogram(
+    "whisperme_event_loop_lag_seconds", "How late the event loop ran a timer due now",
+    buckets=LOOP_LAG_BUCKETS)
+LOOP_BLOCKS = registry.counter(
+    "whisperme_event_loop_blocks_total", "Event loop stalls over the threshold by blocking call site", ("site",))
+LOOP_BLOCKED_SECONDS = registry.counter(
+    "whisperme_event_loop_blocked_seconds_total", "Event loop time lost to stalls by blocking call site", ("site",))
+
+# Write outbox (refreshed from WriteOutbox.stats() by a collector)
+OUTBOX_PENDING = registry.gauge(
+    "whisperme_outbox_writes", "Queued transcription writes by state (pending or dead)", ("state",))
+OUTBOX_OLDEST = registry.gauge(
+    "whisperme_outbox_oldest_pending_seconds", "Age of the oldest write not yet replayed")
+OUTBOX_REPLAYED = registry.counter(
+    "whisperme_outbox_replayed_total", "Writes replayed to the database by this worker")
+
+# Semantic search indexing (refreshed from EmbeddingPipeline.stats() by a collector)
+EMBEDDINGS = registry.counter(
+    "whisperme_embeddings_total", "Finished transcriptions by indexing outcome (indexed, failed or dropped)",
+    ("outcome",))
+EMBEDDING_QUEUE = registry.gauge(
+    "whisperme_embedding_queue", "Transcriptions waiting to be embedded")
+
+# Device tokens (refreshed from DeviceTokens.stats() by a collector)
+DEVICE_TOKEN_CHECKS = registry.counter(
+    "whisperme_device_token_checks_total", "Device tokens presented, by result (valid, expired, invalid or revoked)",
+    ("result",))
+
+# Retention (refreshed from RetentionJob.stats() by a collector)
+TRANSCRIPTIONS_ARCHIVED = registry.counter(
+    "whisperme_transcriptions_archived_total", "Transcriptions moved to the compressed archive tier by this worker")
+
+# Caches
+CACHE_REQUESTS = registry.counter(
+    "whisperme_cache_requests_total", "Cache lookups by result (hit or miss)", ("cache", "result"))
+CACHE_ENTRIES = registry.gauge(
+    "whisperme_cache_entries", "Entries held per cache", ("cache",))
+
+
+def process_memory() -> Dict[str, int]:
+    """
+    Memory of this process in bytes. `private` is what the process does not share
+    with the other workers; pages inherited from a preloaded master stay shared
+    until written. Linux only; elsewhere just the peak RSS.
+    """
+    try:
+        fields = {}
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0]) * 1024
+        return {
+            "rss": fields["Rss"],
+            "pss": fields["Pss"],
+            "private": fields["Private_Clean"] + fields["Private_Dirty"],
+        }
+    except (OSError, KeyError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        return {"rss": peak if sys.platform == "darwin" else peak * 1024}
+
+
+def collect_process_metrics():
+    pid = os.getpid()
+    for kind, value in process_memory().items():
+        PROCESS_MEMORY.set(value, pid=pid, kind=kind)
+
+
+registry.add_collector(collect_process_metrics)
+
+
+class StageTimer:
+    """Stage durations and DB round trips for one request"""
+
+    __slots__ = ("started", "stages", "db_calls", "db_seconds")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}  # stage -> seconds, in the order first seen
+        self.db_calls = 0
+        self.db_seconds = 0.0
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Value for the Server-Timing response header (durations in ms)"""
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        if self.db_calls:
+            entries.append(f'db;desc="{self.db_calls} calls";dur={self.db_seconds * 1000:.1f}')
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def breakdown(self) -> Dict:
+        return {
+            "total_ms": round(self.elapsed() * 1000, 1),
+            "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+            "db_calls": self.db_calls,
+            "db_ms": round(self.db_seconds * 1000, 1),
+        }
+
+
+# The current request's timer; the object is shared with tasks and threads
+# started by the request (they copy the context), so their stages count too
+_request_timer: contextvars.ContextVar[Optional[StageTimer]] = contextvars.ContextVar(
+    "request_timer", default=None)
+
+
+def start_request() -> contextvars.Token:
+    return _request_timer.set(StageTimer())
+
+
+def finish_request(token: contextvars.Token) -> StageTimer:
+    timer = _request_timer.get()
+    _request_timer.reset(token)
+    return timer
+
+
+def current_timer() -> Optional[StageTimer]:
+    return _request_timer.get()
+
+
+def record_stage(name: str, seconds: float):
+    """Add a pipeline stage duration to the stage histogram and the current request"""
+    STAGE_LATENCY.observe(seconds, stage=name)
+    timer = _request_timer.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Time the block as a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def db_call(operation: str):
+    """Time one Supabase round trip and count it against the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        DB_LATENCY.observe(seconds, operation=operation)
+        timer = _request_timer.get()
+        if timer is not None:
+            timer.db_calls += 1
+            timer.db_seconds += seconds
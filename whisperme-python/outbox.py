@@ -0,0 +1,235 @@
+"""
+Durable write outbox for WhisperMe Backend
+Transcription writes are appended to a local SQLite file and acknowledged at
+once; a background thread replays them to the primary database in batches,
+retrying with backoff, so database latency and short outages neither slow
+requests down nor lose writes. Writes for one transcription replay in order.
+Until then the primary database does not have them: reads see a queued
+transcription once its create has been replayed.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    op TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(state, seq);
+"""
+
+# Writes of this op carry {"fields": {...}}; consecutive ones for a key are merged
+MERGEABLE_OP = "update_transcription"
+
+SQL_APPEND = "INSERT INTO outbox (key, op, params, created_at) VALUES (?, ?, ?, ?)"
+# Keys with a write waiting out its backoff are skipped entirely, keeping their order
+SQL_BATCH = (
+    "SELECT seq, key, op, params, attempts FROM outbox WHERE state = 'pending' AND key NOT IN "
+    "(SELECT key FROM outbox WHERE state = 'pending' AND next_attempt > ?) ORDER BY seq LIMIT ?"
+)
+SQL_DONE = "DELETE FROM outbox WHERE seq = ?"
+SQL_RETRY = "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE seq = ?"
+SQL_DEAD = "UPDATE outbox SET state = 'dead', attempts = ?, last_error = ? WHERE seq = ?"
+SQL_STATS = (
+    "SELECT state, COUNT(*), MIN(created_at) FROM outbox GROUP BY state"
+)
+
+
+class WriteOutbox:
+    """
+    `record(op, key, params)` appends a write; `apply(op, params)` (given at
+    construction) performs it against the primary database and raises to have
+    it retried. `apply_many(op, params_list)`, when given, performs several
+    writes of one op in a single round trip. All workers append to the same
+    file; whichever holds the replay lock replays, so the order of writes is
+    kept across processes.
+    """
+
+    def __init__(self, path: str, apply: Callable[[str, Dict], Any], batch_size: int = 100,
+                 max_attempts: int = 20, max_backoff: float = 60.0, poll_interval: float = 1.0,
+                 apply_many: Optional[Callable[[str, List[Dict]], Any]] = None):
+        self.path = path
+        self.apply = apply
+        self.apply_many = apply_many
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.replayed = 0
+        self.failed_attempts = 0
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock_file = None
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = f"{path}.lock"
+
+    def _connect(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(OUTBOX_SCHEMA)
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+    def record(self, op: str, key: str, params: Dict):
+        """Durably queue a write (one local insert) and wake the replay thread"""
+        self._connect().execute(SQL_APPEND, (key, op, json.dumps(params), time.time()))
+        self._wake.set()
+
+    # Replay
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-replay", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop replaying; whatever is left stays in the file for the next start"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def replaying(self) -> bool:
+        """Whether this process is the one replaying the shared file"""
+        return self._lock_file is not None
+
+    def _holds_replay_lock(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self._lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        # Held until this process exits; the OS releases it if the worker dies
+        self._lock_file = lock_file
+        logger.info(f"📮 Outbox replay running in worker {os.getpid()}")
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                while self._holds_replay_lock() and self.replay_batch() and not self._stop.is_set():
+                    pass
+            except Exception as e:
+                logger.error(f"Outbox replay failed: {str(e)}")
+
+    def replay_batch(self) -> int:
+        """
+        Apply the oldest due writes; returns how many were applied. After a failure,
+        later writes for the same key wait for the next round so they stay in order.
+        Consecutive field updates of one key are merged into a single write.
+
+        Writes are applied in waves, each holding the next write of every key, so
+        the same op for many keys (typically each new row's create) goes to
+        apply_many together. Order is kept per key, not across keys.
+        """
+        conn = self._connect()
+        rows = [(seq, key, op, json.loads(params), attempts)
+                for seq, key, op, params, attempts in conn.execute(SQL_BATCH, (time.time(), self.batch_size))]
+        merged_into: Dict[int, List[int]] = {}
+        latest_update: Dict[str, int] = {}
+        for index, (seq, key, op, params, _) in enumerate(rows):
+            if op != MERGEABLE_OP:
+                latest_update.pop(key, None)
+                continue
+            previous = latest_update.get(key)
+            if previous is not None:
+                earlier = rows[previous]
+                params["fields"] = {**earlier[3]["fields"], **params["fields"]}
+                merged_into[seq] = merged_into.pop(earlier[0], []) + [earlier[0]]
+            latest_update[key] = index
+        superseded = {seq for seqs in merged_into.values() for seq in seqs}
+
+        queues: Dict[str, List[Tuple]] = {}
+        for row in rows:
+            if row[0] not in superseded:
+                queues.setdefault(row[1], []).append(row)
+
+        blocked = set()
+        applied: List[int] = []
+        wave = 0
+        while True:
+            heads = [queue[wave] for key, queue in queues.items() if key not in blocked and wave < len(queue)]
+            if not heads:
+                break
+            by_op: Dict[str, List[Tuple]] = {}
+            for row in heads:
+                by_op.setdefault(row[2], []).append(row)
+            for op, group in by_op.items():
+                if self.apply_many is not None and len(group) > 1:
+                    try:
+                        self.apply_many(op, [params for _, _, _, params, _ in group])
+                    except Exception as e:
+                        # One write may be at fault: apply them one by one so only it waits
+                        logger.warning(f"Outbox batch of {len(group)} {op} writes failed, applying them singly: {str(e)}")
+                    else:
+                        for seq, *_ in group:
+                            applied.append(seq)
+                            applied.extend(merged_into.get(seq, ()))
+                        continue
+                for seq, key, _, params, attempts in group:
+                    try:
+                        self.apply(op, params)
+                        applied.append(seq)
+                        applied.extend(merged_into.get(seq, ()))
+                    except Exception as e:
+                        blocked.add(key)
+                        self._failed(conn, seq, key, op, attempts + 1, e)
+            wave += 1
+        if applied:
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany(SQL_DONE, [(seq,) for seq in applied])
+            self.replayed += len(applied)
+        return len(applied)
+
+    def _failed(self, conn: sqlite3.Connection, seq: int, key: str, op: str, attempts: int, error: Exception):
+        self.failed_attempts += 1
+        if attempts >= self.max_attempts:
+            logger.error(f"Outbox write {op} for {key} failed {attempts} times, moved to dead letters: {str(error)}")
+            conn.execute(SQL_DEAD, (attempts, str(error), seq))
+            return
+        backoff = min(self.max_backoff, 0.5 * 2 ** (attempts - 1))
+        logger.warning(f"Outbox write {op} for {key} failed (attempt {attempts}, retry in {backoff:.1f}s): {str(error)}")
+        conn.execute(SQL_RETRY, (attempts, time.time() + backoff, str(error), seq))
+
+    def stats(self) -> Dict:
+        counts = {"pending": 0, "dead": 0}
+        oldest = None
+        for state, count, created_at in self._connect().execute(SQL_STATS):
+            counts[state] = count
+            if state == "pending":
+                oldest = created_at
+        return {
+            **counts,
+            "oldest_pending_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+            "replayed": self.replayed,
+            "failed_attempts": self.failed_attempts,
+        }
@@ -0,0 +1,241 @@
+"""
+On-demand sampling profiler for WhisperMe Backend
+Samples the stacks of every thread in the worker for a fixed window and returns
+them in collapsed-stack format (one `frame;frame;frame count` line per stack),
+as read by flamegraph.pl, speedscope and inferno. Nothing runs between profiles.
+
+Sibling gunicorn workers are profiled by writing a request file to a shared
+directory and sending them SIGPROF; each writes its own collapsed stacks back.
+Only workers that installed the handler (and registered in that directory) are
+signalled, since SIGPROF terminates a process that does not handle it.
+"""
+
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SIGNAL = signal.SIGPROF
+REQUEST_FILE = "request.json"
+WORKERS_DIR = "workers"  # One file per worker with the handler installed: name pid, content start time
+MAX_SECONDS = 60.0
+MIN_INTERVAL = 0.001
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is already running in this worker"""
+
+
+_running = threading.Lock()
+_profile_dir: Optional[str] = None
+_path_prefixes: List[str] = []
+_labels: Dict[object, str] = {}
+
+
+def _frame_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        for prefix in _path_prefixes:
+            if path.startswith(prefix):
+                path = path[len(prefix):]
+                break
+        label = f"{code.co_name} ({path}:{code.co_firstlineno})"
+        _labels[code] = label
+    return label
+
+
+def sample(seconds: float, interval: float = 0.005) -> Counter:
+    """
+    Sample all threads except this one every `interval` seconds for `seconds`.
+    Returns a Counter of collapsed stacks (root first, thread name as the root frame).
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running in this worker")
+    try:
+        # Longest first, so site-packages wins over the stdlib directory containing it
+        _path_prefixes[:] = sorted({os.path.join(p, "") for p in sys.path if p}, key=len, reverse=True)
+        me = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + min(seconds, MAX_SECONDS)
+        interval = max(interval, MIN_INTERVAL)
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                frames.append(names.get(ident, f"thread-{ident}"))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _labels.clear()
+        _running.release()
+
+
+def collapse(stacks: Counter, root: Optional[str] = None) -> str:
+    """Collapsed-stack text, heaviest stacks first; `root` is prepended to every stack"""
+    prefix = f"{root};" if root else ""
+    return "".join(f"{prefix}{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+# Multi-worker profiling
+
+def install_signal_handler(profile_dir: str):
+    """Let sibling workers request a profile of this process (call from the main thread)"""
+    global _profile_dir
+    _profile_dir = profile_dir
+    os.makedirs(os.path.join(profile_dir, WORKERS_DIR), exist_ok=True)
+    signal.signal(PROFILE_SIGNAL, _on_profile_signal)
+    _register_worker()
+
+
+def _start_time(pid) -> str:
+    """Process start time (/proc/<pid>/stat field 22), which tells a reused pid apart"""
+    with open(f"/proc/{pid}/stat") as f:
+        # pid (comm) state ppid ... starttime; comm may contain spaces
+        return f.read().rsplit(")", 1)[1].split()[19]
+
+
+def _register_worker():
+    directory = os.path.join(_profile_dir, WORKERS_DIR)
+    for entry in os.listdir(directory):
+        # Drop workers that have exited
+        path = os.path.join(directory, entry)
+        try:
+            with open(path) as f:
+                alive = entry.isdigit() and f.read() == _start_time(entry)
+        except (OSError, IndexError):
+            alive = False
+        if not alive:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    try:
+        start_time = _start_time(os.getpid())
+    except (OSError, IndexError):
+        return  # No /proc: siblings cannot be found either
+    path = os.path.join(directory, str(os.getpid()))
+    with open(f"{path}.tmp", "w") as f:
+        f.write(start_time)
+    os.replace(f"{path}.tmp", path)
+
+
+def _on_profile_signal(signum, frame):
+    # Runs between bytecodes on the main thread: only read the request and hand off
+    try:
+        with open(os.path.join(_profile_dir, REQUEST_FILE)) as f:
+            request = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring profile signal: {str(e)}")
+        return
+    threading.Thread(target=_profile_to_file, args=(request,), name="profiler", daemon=True).start()
+
+
+def _profile_to_file(request: Dict):
+    try:
+        stacks = sample(request["seconds"], request["interval"])
+    except ProfilerBusy:
+        stacks = Counter()
+    result_path = os.path.join(_profile_dir, f"{request['id']}-{os.getpid()}.txt")
+    tmp_path = f"{result_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(collapse(stacks, root=f"worker-{os.getpid()}"))
+    os.replace(tmp_path, result_path)
+
+
+def _cmdline(pid) -> bytes:
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        return f.read()
+
+
+def sibling_workers() -> List[int]:
+    """
+    Other children of this process's parent (the gunicorn master) running the same
+    command line, i.e. forked workers; Linux only
+    """
+    parent, me, siblings = os.getppid(), os.getpid(), []
+    try:
+        entries = os.listdir("/proc")
+        own_cmdline = _cmdline(me)
+    except OSError:
+        return siblings
+    for entry in entries:
+        if not entry.isdigit() or int(entry) == me:
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # pid (comm) state ppid ...; comm may contain spaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            if ppid == parent and _cmdline(entry) == own_cmdline:
+                siblings.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return siblings
+
+
+def registered_siblings() -> List[int]:
+    """Sibling workers that installed the profile signal handler"""
+    directory = os.path.join(_profile_dir, WORKERS_DIR)
+    registered = []
+    for pid in sibling_workers():
+        try:
+            with open(os.path.join(directory, str(pid))) as f:
+                if f.read() == _start_time(pid):
+                    registered.append(pid)
+        except (OSError, IndexError):
+            continue
+    return registered
+
+
+def request_siblings(seconds: float, interval: float) -> Dict:
+    """Ask every registered sibling worker to profile itself; returns the request (with its target pids)"""
+    request = {"id": uuid.uuid4().hex, "seconds": seconds, "interval": interval, "pids": []}
+    if _profile_dir is None:
+        return request
+    request_path = os.path.join(_profile_dir, REQUEST_FILE)
+    with open(f"{request_path}.tmp", "w") as f:
+        json.dump(request, f)
+    os.replace(f"{request_path}.tmp", request_path)
+    for pid in registered_siblings():
+        try:
+            os.kill(pid, PROFILE_SIGNAL)
+            request["pids"].append(pid)
+        except OSError as e:
+            logger.warning(f"Could not signal worker {pid} to profile: {str(e)}")
+    return request
+
+
+def collect_siblings(request: Dict, timeout: float = 5.0) -> Dict[int, str]:
+    """
+    Collapsed stacks written by the signalled workers (rooted at `worker-<pid>`),
+    waiting up to `timeout` for stragglers
+    """
+    results, pending = {}, set(request["pids"])
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for pid in list(pending):
+            path = os.path.join(_profile_dir, f"{request['id']}-{pid}.txt")
+            if os.path.exists(path):
+                with open(path) as f:
+                    results[pid] = f.read()
+                os.remove(path)
+                pending.discard(pid)
+        if pending:
+            time.sleep(0.05)
+    if pending:
+        logger.warning(f"No profile from workers {sorted(pending)} within {timeout}s")
+    return results
@@ -0,0 +1,98 @@
+"""
+Transcription retention for WhisperMe Backend
+Once a day (by default) the text of finished transcriptions older than the
+retention period is moved to the compressed archive tier, a batch at a time, so
+the hot table stays small. Reads still return archived text. One worker on the
+box runs the job: whichever holds the lock file.
+"""
+
+import fcntl
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionJob:
+    """
+    Calls `archive(cutoff, batch_size)` (StorageBackend.archive_transcriptions)
+    until a batch comes back short, pausing `batch_pause` seconds between
+    batches to leave the database to requests, then sleeps `interval` seconds.
+    """
+
+    def __init__(self, archive: Callable[[str, int], int], days: int, lock_path: str, batch_size: int = 500,
+                 interval: float = 3600.0, batch_pause: float = 0.5):
+        self.archive = archive
+        self.days = days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.batch_pause = batch_pause
+        self.archived = 0
+        self.failed_runs = 0
+        self.last_run_at: Optional[float] = None
+        self._lock_path = lock_path
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+
+    def cutoff(self) -> str:
+        return (datetime.now(timezone.utc) - timedelta(days=self.days)).isoformat(timespec="microseconds")
+
+    def run_once(self) -> int:
+        """Archive everything currently past the retention period; returns how many rows"""
+        cutoff = self.cutoff()
+        total = 0
+        while not self._stop.is_set():
+            archived = self.archive(cutoff, self.batch_size)
+            total += archived
+            self.archived += archived
+            if archived < self.batch_size:
+                break
+            self._stop.wait(self.batch_pause)
+        self.last_run_at = time.time()
+        if total:
+            logger.info(f"🗄️  Archived {total} transcriptions older than {self.days} days")
+        return total
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="transcription-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _holds_lock(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self._lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        # Held until this process exits; the OS releases it if the worker dies
+        self._lock_file = lock_file
+        logger.info(f"🗄️  Transcription retention running in worker {os.getpid()}")
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._holds_lock():
+                    self.run_once()
+            except Exception as e:
+                self.failed_runs += 1
+                logger.error(f"Archiving old transcriptions failed: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def stats(self) -> Dict:
+        return {"archived": self.archived, "failed_runs": self.failed_runs, "last_run_at": self.last_run_at,
+                "running": self._lock_file is not None}
@@ -0,0 +1,271 @@
+"""
+Upstream scheduler for WhisperMe Backend
+Weighted priority lanes per subscription tier with fair queueing per device
+and shortest-job-first ordering by expected audio duration
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the wait-time histogram buckets
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class SchedulerQueueFull(Exception):
+    """Raised when a lane (or a device inside it) has no room for another job"""
+
+    def __init__(self, lane: str, reason: str):
+        self.lane = lane
+        self.reason = reason
+        super().__init__(f"Scheduler queue full for lane '{lane}': {reason}")
+
+
+def parse_lane_weights(spec: str) -> Dict[str, int]:
+    """Parse a lane weight spec such as 'premium:4,free:1'"""
+    weights = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition(":")
+        weights[name.strip()] = max(1, int(weight or 1))
+    if not weights:
+        raise ValueError("At least one scheduler lane is required")
+    return weights
+
+
+class _Job:
+    __slots__ = ("device_id", "cost", "future", "enqueued_at")
+
+    def __init__(self, device_id: str, cost: float, future: asyncio.Future):
+        self.device_id = device_id
+        self.cost = cost
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class _Lane:
+    """
+    One priority lane: per-device queues served in fair-queueing order.
+
+    A job's cost is its expected upstream time (seconds of audio), so within a
+    lane short dictations are tagged ahead of long recordings, both across
+    devices and inside one device's queue. A waiting device keeps its start tag
+    while virtual time advances with every dispatch, so long jobs age forward
+    instead of starving.
+    """
+
+    def __init__(self, name: str, weight: int, max_queue: int):
+        self.name = name
+        self.weight = weight
+        self.max_queue = max_queue
+        self.devices: Dict[str, List[tuple]] = {}
+        self.device_start: Dict[str, float] = {}
+        self.device_finish: Dict[str, float] = {}
+        self.virtual_time = 0.0
+        self.current_weight = 0
+        self.size = 0
+        self._seq = itertools.count()
+        # Metrics
+        self.enqueued = 0
+        self.dispatched = 0
+        self.rejected = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+
+    def push(self, job: _Job):
+        queue = self.devices.get(job.device_id)
+        if queue is None:
+            queue = self.devices[job.device_id] = []
+            self.device_start[job.device_id] = max(
+                self.virtual_time, self.device_finish.get(job.device_id, 0.0)
+            )
+        heapq.heappush(queue, (job.cost, next(self._seq), job))
+        self.size += 1
+        self.enqueued += 1
+
+    def remove(self, job: _Job):
+        queue = self.devices.get(job.device_id)
+        if not queue:
+            return
+        for i, entry in enumerate(queue):
+            if entry[2] is job:
+                queue.pop(i)
+                heapq.heapify(queue)
+                self.size -= 1
+                break
+        if not queue:
+            del self.devices[job.device_id]
+            del self.device_start[job.device_id]
+
+    def pop(self) -> _Job:
+        # Lowest finish tag (device start + head job cost) is served next
+        best_device = None
+        best_tag = 0.0
+        for device_id, queue in self.devices.items():
+            tag = self.device_start[device_id] + queue[0][0]
+            if best_device is None or tag < best_tag:
+                best_device, best_tag = device_id, tag
+
+        queue = self.devices[best_device]
+        job = heapq.heappop(queue)[2]
+        self.size -= 1
+        # Self-clocked: virtual time moves to the finish tag of the job served
+        self.virtual_time = max(self.virtual_time, best_tag)
+        self.device_finish[best_device] = best_tag
+        if queue:
+            self.device_start[best_device] = best_tag
+        else:
+            del self.devices[best_device]
+            del self.device_start[best_device]
+
+        # Forget idle devices that are no longer ahead of virtual time
+        if len(self.device_finish) > len(self.devices) * 2 + 16:
+            self.device_finish = {
+                d: f for d, f in self.device_finish.items()
+                if d in self.devices or f > self.virtual_time
+            }
+        return job
+
+    def record_wait(self, wait: float):
+        self.dispatched += 1
+        self.wait_sum += wait
+        self.wait_max = max(self.wait_max, wait)
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if wait <= bound:
+                self.wait_buckets[i] += 1
+                break
+        else:
+            self.wait_buckets[-1] += 1
+
+    def stats(self) -> Dict:
+        return {
+            "weight": self.weight,
+            "queued": self.size,
+            "devices_waiting": len(self.devices),
+            "max_queue": self.max_queue,
+            "enqueued": self.enqueued,
+            "dispatched": self.dispatched,
+            "rejected": self.rejected,
+            "wait_seconds_sum": round(self.wait_sum, 6),
+            "wait_seconds_max": round(self.wait_max, 6),
+            "wait_seconds_avg": round(self.wait_sum / self.dispatched, 6) if self.dispatched else 0.0,
+            "wait_seconds_buckets": {
+                **{str(bound): count for bound, count in zip(WAIT_BUCKETS, self.wait_buckets)},
+                "+Inf": self.wait_buckets[-1],
+            },
+        }
+
+
+class UpstreamScheduler:
+    """
+    Admission control in front of the upstream (OpenAI) pool.
+
+    At most `concurrency` jobs run at once. Waiting jobs sit in a lane chosen by
+    subscription tier; lanes are served by smooth weighted round-robin and the
+    devices inside a lane are served fairly, so one busy device cannot starve
+    the others. Inside a lane, cheaper (shorter) jobs are dispatched first.
+    """
+
+    def __init__(self, concurrency: int, lane_weights: Dict[str, int],
+                 max_queue_per_lane: int = 64, max_queue_per_device: int = 8):
+        if concurrency < 1:
+            raise ValueError("Scheduler concurrency must be at least 1")
+        self.concurrency = concurrency
+        self.max_queue_per_device = max_queue_per_device
+        self.lanes: Dict[str, _Lane] = {
+            name: _Lane(name, weight, max_queue_per_lane)
+            for name, weight in lane_weights.items()
+        }
+        ordered = sorted(self.lanes.values(), key=lambda lane: lane.weight)
+        self._lowest_lane = ordered[0].name
+        self._highest_lane = ordered[-1].name
+        self._active = 0
+        self._queued = 0
+
+    def lane_for_tier(self, tier: Optional[str]) -> str:
+        """Map a subscription tier to a lane; unknown paid tiers get the top lane"""
+        if tier in self.lanes:
+            return tier
+        if not tier or tier == "free":
+            return self._lowest_lane
+        return self._highest_lane
+
+    @asynccontextmanager
+    async def slot(self, tier: Optional[str], device_id: str, cost: float = 1.0):
+        """
+        Wait for an upstream slot; raises SchedulerQueueFull if the lane is full.
+        `cost` is the job's expected size, normally its audio duration in seconds.
+        """
+        lane = self.lanes[self.lane_for_tier(tier)]
+        job = self._enqueue(lane, device_id, cost)
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job.future.done() and not job.future.cancelled():
+                self._release()
+            else:
+                lane.remove(job)
+                self._queued -= 1
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _enqueue(self, lane: _Lane, device_id: str, cost: float) -> _Job:
+        if lane.size >= lane.max_queue:
+            lane.rejected += 1
+            raise SchedulerQueueFull(lane.name, "lane is at capacity")
+        if len(lane.devices.get(device_id, ())) >= self.max_queue_per_device:
+            lane.rejected += 1
+            raise SchedulerQueueFull(lane.name, "too many pending requests for this device")
+
+        job = _Job(device_id, cost, asyncio.get_running_loop().create_future())
+        lane.push(job)
+        self._queued += 1
+        self._dispatch()
+        return job
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _pick_lane(self) -> _Lane:
+        # Smooth weighted round-robin (as used by nginx) over non-empty lanes
+        candidates = [lane for lane in self.lanes.values() if lane.size]
+        total = 0
+        best = None
+        for lane in candidates:
+            lane.current_weight += lane.weight
+            total += lane.weight
+            if best is None or lane.current_weight > best.current_weight:
+                best = lane
+        best.current_weight -= total
+        return best
+
+    def _dispatch(self):
+        while self._active < self.concurrency and self._queued:
+            lane = self._pick_lane()
+            job = lane.pop()
+            self._queued -= 1
+            if job.future.done():
+                continue
+            self._active += 1
+            lane.record_wait(time.monotonic() - job.enqueued_at)
+            job.future.set_result(None)
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "queued": self._queued,
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+        }
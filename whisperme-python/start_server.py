@@ -27,12 +27,11 @@ def main():
     print(f"👥 Workers: {workers}")
     print(f"🌍 Environment: {'Production' if is_production else 'Development'}")
     
-    # Validate required environment variables
-    required_vars = [
-        "OPENAI_API_KEY",
-        "SUPABASE_URL", 
-        "SUPABASE_SERVICE_ROLE_KEY"
-    ]
+    # Validate required environment variables (Supabase is not used with a SQLite DATABASE_URL)
+    uses_sqlite = os.getenv("DATABASE_URL", "").startswith("sqlite:///")
+    required_vars = ["OPENAI_API_KEY"]
+    if not uses_sqlite:
+        required_vars += ["SUPABASE_URL", "SUPABASE_SERVICE_ROLE_KEY"]
     
     missing_vars = []
     for var in required_vars:
@@ -45,6 +44,7 @@ def main():
         print("   OPENAI_API_KEY=your_openai_api_key")
         print("   SUPABASE_URL=your_supabase_url") 
         print("   SUPABASE_SERVICE_ROLE_KEY=your_supabase_service_role_key")
+        print("   (or DATABASE_URL=sqlite:///whisperme.db instead of the two Supabase variables)")
         print("   SECRET_KEY=your_jwt_secret_key (optional)")
         print("   PORT=8000 (optional)")
         print("   HOST=0.0.0.0 (optional)")
@@ -55,19 +55,17 @@ def main():
     
     # Start the server
     if is_production and workers > 1:
-        # Use gunicorn for production with multiple workers
-        import subprocess
+        # Use gunicorn for production with multiple workers (preloaded app,
+        # per-worker warmup and shared metrics; see gunicorn.conf.py)
         cmd = [
             "gunicorn",
             "main:app",
+            "--config=gunicorn.conf.py",
             f"--bind={host}:{port}",
-            f"--workers={workers}",
-            "--worker-class=uvicorn.workers.UvicornWorker",
-            "--access-logfile=-",
-            "--error-logfile=-",
-            "--log-level=info"
+            f"--workers={workers}"
         ]
-        subprocess.run(cmd)
+        # Replace this process so gunicorn receives the platform's signals directly
+        os.execvp(cmd[0], cmd)
     else:
         # Use uvicorn for development or single worker
         uvicorn.run(
@@ -0,0 +1,846 @@
+"""
+Storage backends for WhisperMe Backend
+The user, transcription and usage operations main.py needs, backed either by
+Supabase (the public.users / public.transcriptions tables and their RPCs) or by
+a local SQLite file for single-node installs, selected through DATABASE_URL.
+"""
+
+import base64
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Columns main.py may change on a transcription outside the RPCs
+TRANSCRIPTION_UPDATE_FIELDS = {"progress", "file_size", "duration", "status", "result", "error_message"}
+USER_UPDATE_FIELDS = {"subscription_tier", "full_name", "monthly_limit"}
+# Columns a history page may return; id and created_at are always included (they form the cursor)
+HISTORY_COLUMNS = (
+    "id", "created_at", "completed_at", "status", "progress", "filename", "file_size", "duration",
+    "language", "model", "active_app", "processing_time", "error_message", "prompt", "screen_context", "result",
+    "archived_at"
+)
+# Moved to the compressed archive tier once a transcription is past its retention period
+ARCHIVED_COLUMNS = ("result", "screen_context", "error_message")
+APP_USAGE_COLUMNS = ("day", "active_app", "transcriptions", "failed", "words", "audio_seconds",
+                     "processing_seconds")
+
+
+def history_columns(fields: Optional[Sequence[str]] = None) -> Tuple[str, ...]:
+    """Validated projection for list_transcriptions (all HISTORY_COLUMNS when fields is empty)"""
+    if not fields:
+        return HISTORY_COLUMNS
+    unknown = set(fields) - set(HISTORY_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(column for column in HISTORY_COLUMNS if column in {"id", "created_at", *fields})
+
+
+def encode_cursor(row: Dict) -> str:
+    """Opaque page cursor: the (created_at, id) of the last row on the page"""
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(created_at, str) or not isinstance(row_id, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return created_at, row_id
+
+
+class StorageBackend:
+    """
+    Operations return plain rows (dicts with the column names of the Supabase
+    tables) so callers do not depend on which backend is configured.
+    """
+
+    name = "storage"
+
+    def check(self):
+        """Open the connection and fail loudly if the schema is unusable"""
+        raise NotImplementedError
+
+    def find_user(self, device_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def get_user(self, user_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def get_or_create_user(self, device_id: str) -> str:
+        """User id for a device, creating the user on first contact"""
+        raise NotImplementedError
+
+    def register_device(self, device_id: str) -> Tuple[Dict, bool]:
+        """The device's full user row, created on first contact, and whether this call created it"""
+        raise NotImplementedError
+
+    def update_user(self, device_id: str, fields: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    def increment_transcriptions(self, device_id: str) -> int:
+        """Add one to the device's usage count and return the new count"""
+        raise NotImplementedError
+
+    def create_transcription(self, device_id: str, filename: Optional[str] = None, language: str = "auto",
+                             model: str = "gpt-4o-transcribe", prompt: Optional[str] = None,
+                             active_app: Optional[str] = None, screen_context: Optional[str] = None,
+                             file_size: Optional[int] = None, duration: Optional[float] = None,
+                             transcription_id: Optional[str] = None) -> str:
+        """
+        Insert a transcription in 'processing' state and return its id. With a
+        caller-chosen transcription_id, inserting the same id again is a no-op.
+        """
+        raise NotImplementedError
+
+    def update_transcription_result(self, transcription_id: str, result: Optional[str], status: str = "completed",
+                                    processing_time: Optional[float] = None,
+                                    error_message: Optional[str] = None) -> bool:
+        raise NotImplementedError
+
+    def update_transcription(self, transcription_id: str, fields: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    # Batched forms of the three writes above, one round trip each (outbox replay)
+
+    def create_transcriptions(self, rows: Sequence[Dict[str, Any]]) -> int:
+        """
+        Insert several transcriptions, each given as create_transcription keyword
+        arguments including transcription_id; ids already present are skipped.
+        Returns how many were inserted.
+        """
+        raise NotImplementedError
+
+    def update_transcription_results(self, results: Sequence[Dict[str, Any]]) -> int:
+        """update_transcription_result for each keyword-argument dict; returns how many rows were found"""
+        raise NotImplementedError
+
+    def update_transcriptions(self, updates: Dict[str, Dict[str, Any]]) -> int:
+        """update_transcription for each id -> fields; returns how many rows were found"""
+        raise NotImplementedError
+
+    def list_transcriptions(self, device_id: str, limit: int, before: Optional[Tuple[str, str]] = None,
+                            columns: Sequence[str] = HISTORY_COLUMNS) -> List[Dict]:
+        """
+        A device's transcriptions, newest first, strictly older than the
+        (created_at, id) `before` key. Keyset pagination: every page is one
+        index range scan, however deep into the history it is.
+        """
+        raise NotImplementedError
+
+    def get_transcriptions(self, device_id: str, ids: Sequence[str],
+                           columns: Sequence[str] = HISTORY_COLUMNS) -> List[Dict]:
+        """The device's transcriptions with these ids, in no particular order"""
+        raise NotImplementedError
+
+    def search_transcriptions(self, device_id: str, query: str, limit: int = 20) -> List[Dict]:
+        """
+        A device's transcriptions whose result contains every word of `query`,
+        best match first: id, created_at, status, active_app, rank (higher is
+        better) and a snippet with the matches wrapped in <mark></mark>.
+        """
+        raise NotImplementedError
+
+    def archive_transcriptions(self, cutoff: str, limit: int = 500) -> int:
+        """
+        Move the ARCHIVED_COLUMNS of up to `limit` finished transcriptions created
+        before `cutoff` (ISO timestamp), oldest first, to the compressed archive
+        tier; returns how many. Reads keep returning the archived text.
+        """
+        raise NotImplementedError
+
+    def app_usage(self, device_id: str, start_day: str, end_day: str) -> List[Dict]:
+        """
+        The device's app_usage_daily rows from start_day to end_day (YYYY-MM-DD,
+        inclusive): one per app and day, kept up to date as transcriptions finish.
+        """
+        raise NotImplementedError
+
+
+def pack_archived(row: Dict) -> bytes:
+    """A row's archived columns as zlib-compressed JSON (SQLite archive tier)"""
+    values = {column: row[column] for column in ARCHIVED_COLUMNS if row[column] is not None}
+    return zlib.compress(json.dumps(values, ensure_ascii=False, separators=(",", ":")).encode(), 9)
+
+
+def unpack_archived(payload: bytes) -> Dict:
+    return json.loads(zlib.decompress(payload))
+
+
+def archived_result(payload: Optional[bytes]) -> Optional[str]:
+    """SQL function archived_result(payload): the result text of an archive row"""
+    return unpack_archived(payload).get("result") if payload is not None else None
+
+
+def _checked_fields(fields: Dict[str, Any], allowed: set) -> Dict[str, Any]:
+    unknown = set(fields) - allowed
+    if unknown:
+        raise ValueError(f"Cannot update columns: {', '.join(sorted(unknown))}")
+    return fields
+
+
+class SupabaseStorage(StorageBackend):
+    """Remote Postgres through supabase-py; each call is one HTTP round trip"""
+
+    name = "supabase"
+
+    def __init__(self, client):
+        # A LazyClient: the SDK is only loaded when the first query runs
+        self.client = client
+
+    def check(self):
+        self.client.table('users').select("id").limit(1).execute()
+
+    def find_user(self, device_id: str) -> Optional[Dict]:
+        response = self.client.table('users').select('*').eq('device_id', device_id).execute()
+        return response.data[0] if response.data else None
+
+    def get_user(self, user_id: str) -> Optional[Dict]:
+        response = self.client.table('users').select('*').eq('id', user_id).execute()
+        return response.data[0] if response.data else None
+
+    def get_or_create_user(self, device_id: str) -> str:
+        return self.client.rpc('get_or_create_user_by_device_id', {'device_id_param': device_id}).execute().data
+
+    def register_device(self, device_id: str) -> Tuple[Dict, bool]:
+        # One round trip, no bcrypt (20261024090000_register_device.sql)
+        user = dict(self.client.rpc('register_device', {'device_id_param': device_id}).execute().data)
+        return user, bool(user.pop('created'))
+
+    def update_user(self, device_id: str, fields: Dict[str, Any]) -> bool:
+        fields = _checked_fields(fields, USER_UPDATE_FIELDS)
+        response = self.client.table('users').update(fields).eq('device_id', device_id).execute()
+        return bool(response.data)
+
+    def increment_transcriptions(self, device_id: str) -> int:
+        return self.client.rpc('increment_transcriptions', {'device_id_param': device_id}).execute().data
+
+    def create_transcription(self, device_id, filename=None, language="auto", model="gpt-4o-transcribe",
+                             prompt=None, active_app=None, screen_context=None, file_size=None,
+                             duration=None, transcription_id=None) -> str:
+        params = {
+            'device_id_param': device_id,
+            'filename_param': filename,
+            'language_param': language,
+            'model_param': model,
+            'prompt_param': prompt,
+            'active_app_param': active_app,
+            'screen_context_param': screen_context,
+            'file_size_param': file_size,
+            'duration_param': duration
+        }
+        if transcription_id:
+            # Needs the id_param signature from 20261020090000_create_transcription_id_param.sql
+            params['id_param'] = transcription_id
+        return self.client.rpc('create_transcription', params).execute().data
+
+    def update_transcription_result(self, transcription_id, result, status="completed", processing_time=None,
+                                    error_message=None) -> bool:
+        return self.client.rpc('update_transcription_result', {
+            'transcription_id_param': transcription_id,
+            'result_param': result,
+            'status_param': status,
+            'processing_time_param': processing_time,
+            'error_message_param': error_message
+        }).execute().data
+
+    def update_transcription(self, transcription_id: str, fields: Dict[str, Any]) -> bool:
+        fields = _checked_fields(fields, TRANSCRIPTION_UPDATE_FIELDS)
+        response = self.client.table('transcriptions').update(fields).eq('id', transcription_id).execute()
+        return bool(response.data)
+
+    def create_transcriptions(self, rows) -> int:
+        # Batch RPCs from 20261026090000_transcription_write_batches.sql
+        return self.client.rpc('create_transcriptions', {'rows_param': [{
+            'id': row['transcription_id'],
+            'device_id': row['device_id'],
+            'filename': row.get('filename'),
+            'language': row.get('language', 'auto'),
+            'model': row.get('model', 'gpt-4o-transcribe'),
+            'prompt': row.get('prompt'),
+            'active_app': row.get('active_app'),
+            'screen_context': row.get('screen_context'),
+            'file_size': row.get('file_size'),
+            'duration': row.get('duration')
+        } for row in rows]}).execute().data
+
+    def update_transcription_results(self, results) -> int:
+        return self.client.rpc('update_transcription_results', {'results_param': [{
+            'id': result['transcription_id'],
+            'result': result['result'],
+            'status': result.get('status', 'completed'),
+            'processing_time': result.get('processing_time'),
+            'error_message': result.get('error_message')
+        } for result in results]}).execute().data
+
+    def update_transcriptions(self, updates) -> int:
+        return self.client.rpc('update_transcriptions', {'updates_param': [
+            {'id': transcription_id, 'fields': _checked_fields(fields, TRANSCRIPTION_UPDATE_FIELDS)}
+            for transcription_id, fields in updates.items()
+        ]}).execute().data
+
+    def list_transcriptions(self, device_id, limit, before=None, columns=HISTORY_COLUMNS) -> List[Dict]:
+        # transcriptions_full fills in prompts and archived text (20261025090000_transcription_retention.sql)
+        query = self.client.table('transcriptions_full').select(",".join(columns)).eq('device_id', device_id)
+        if before:
+            # PostgREST has no row comparison; spell out (created_at, id) < before
+            created_at, row_id = before
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{row_id})')
+        query = query.order('created_at', desc=True).order('id', desc=True).limit(limit)
+        return query.execute().data
+
+    def get_transcriptions(self, device_id, ids, columns=HISTORY_COLUMNS) -> List[Dict]:
+        if not ids:
+            return []
+        return self.client.table('transcriptions_full').select(",".join(columns)).eq(
+            'device_id', device_id).in_('id', list(ids)).execute().data
+
+    def search_transcriptions(self, device_id, query, limit=20) -> List[Dict]:
+        # Ranking and ts_headline snippets happen in the database (20261022090000_transcription_search.sql)
+        return self.client.rpc('search_transcriptions', {
+            'device_id_param': device_id,
+            'query_param': query,
+            'limit_param': limit
+        }).execute().data
+
+    def archive_transcriptions(self, cutoff, limit=500) -> int:
+        return self.client.rpc('archive_transcriptions', {
+            'cutoff_param': cutoff,
+            'limit_param': limit
+        }).execute().data
+
+    def app_usage(self, device_id, start_day, end_day) -> List[Dict]:
+        # Filled by the rollup_app_usage trigger (20261023090000_app_usage_rollups.sql)
+        return self.client.table('app_usage_daily').select(",".join(APP_USAGE_COLUMNS)).eq(
+            'device_id', device_id).gte('day', start_day).lte('day', end_day).execute().data
+
+
+# Same tables and columns as supabase/migrations, without auth.users and RLS
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    device_id TEXT UNIQUE,
+    full_name TEXT,
+    subscription_tier TEXT DEFAULT 'free',
+    transcriptions_used INTEGER DEFAULT 0,
+    monthly_limit INTEGER DEFAULT 10,
+    last_reset TEXT DEFAULT (date('now')),
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS transcriptions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT REFERENCES users(id) ON DELETE CASCADE,
+    device_id TEXT,
+    filename TEXT,
+    file_path TEXT,
+    file_size INTEGER,
+    duration REAL,
+    language TEXT DEFAULT 'auto',
+    model TEXT DEFAULT 'gpt-4o-transcribe',
+    prompt TEXT,
+    prompt_id INTEGER REFERENCES prompt_templates(id),
+    active_app TEXT,
+    screen_context TEXT,
+    status TEXT DEFAULT 'processing',
+    progress INTEGER DEFAULT 0,
+    result TEXT,
+    error_message TEXT,
+    processing_time REAL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    completed_at TEXT,
+    archived_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_users_subscription_tier ON users(subscription_tier);
+CREATE INDEX IF NOT EXISTS idx_transcriptions_user_id ON transcriptions(user_id);
+CREATE INDEX IF NOT EXISTS idx_transcriptions_device_id ON transcriptions(device_id);
+CREATE INDEX IF NOT EXISTS idx_transcriptions_status ON transcriptions(status);
+CREATE INDEX IF NOT EXISTS idx_transcriptions_created_at ON transcriptions(created_at);
+CREATE INDEX IF NOT EXISTS idx_transcriptions_active_app ON transcriptions(active_app);
+CREATE INDEX IF NOT EXISTS idx_transcriptions_device_history ON transcriptions(device_id, created_at DESC, id DESC);
+
+-- Full-text index over result, kept in step by triggers. The device is indexed too,
+-- as one hex token, so a search only ever ranks that device's rows. The index stores
+-- no text of its own and refers to rows by rowid, which VACUUM may renumber:
+-- rebuild it after a VACUUM. Archived rows stay indexed: their text is read back
+-- from transcriptions_archive through archived_result(), registered on each connection
+
+-- Archive tier: the ARCHIVED_COLUMNS of old transcriptions as zlib-compressed JSON
+CREATE TABLE IF NOT EXISTS transcriptions_archive (
+    id TEXT PRIMARY KEY REFERENCES transcriptions(id) ON DELETE CASCADE,
+    payload BLOB NOT NULL,
+    archived_at TEXT NOT NULL
+);
+CREATE VIEW IF NOT EXISTS transcriptions_fts_content AS
+    SELECT t.rowid AS row_id, coalesce(t.result, archived_result(a.payload)) AS result,
+           hex(t.device_id) AS device
+    FROM transcriptions t LEFT JOIN transcriptions_archive a ON a.id = t.id;
+CREATE VIRTUAL TABLE IF NOT EXISTS transcriptions_fts USING fts5(
+    result, device, content='transcriptions_fts_content', content_rowid='row_id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS transcriptions_fts_insert AFTER INSERT ON transcriptions BEGIN
+    INSERT INTO transcriptions_fts (rowid, result, device) VALUES (new.rowid, new.result, hex(new.device_id));
+END;
+-- BEFORE, so the archived text is still there to remove (the archive row cascades away)
+CREATE TRIGGER IF NOT EXISTS transcriptions_fts_delete BEFORE DELETE ON transcriptions BEGIN
+    INSERT INTO transcriptions_fts (transcriptions_fts, rowid, result, device)
+    VALUES ('delete', old.rowid,
+            coalesce(old.result, (SELECT archived_result(payload) FROM transcriptions_archive WHERE id = old.id)),
+            hex(old.device_id));
+END;
+-- Archiving clears result after the archive row is written, so the new text is the archived one
+CREATE TRIGGER IF NOT EXISTS transcriptions_fts_update AFTER UPDATE OF result, device_id ON transcriptions BEGIN
+    INSERT INTO transcriptions_fts (transcriptions_fts, rowid, result, device)
+    VALUES ('delete', old.rowid,
+            coalesce(old.result, (SELECT archived_result(payload) FROM transcriptions_archive WHERE id = old.id)),
+            hex(old.device_id));
+    INSERT INTO transcriptions_fts (rowid, result, device)
+    VALUES (new.rowid,
+            coalesce(new.result, (SELECT archived_result(payload) FROM transcriptions_archive WHERE id = new.id)),
+            hex(new.device_id));
+END;
+
+-- Per-device, per-app, per-day totals, added to as each transcription finishes
+CREATE TABLE IF NOT EXISTS app_usage_daily (
+    device_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    active_app TEXT NOT NULL DEFAULT '',
+    transcriptions INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    words INTEGER NOT NULL DEFAULT 0,
+    audio_seconds REAL NOT NULL DEFAULT 0,
+    processing_seconds REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (device_id, day, active_app)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS app_usage_rollup AFTER UPDATE OF status ON transcriptions
+WHEN new.status IN ('completed', 'failed') AND old.status IS NOT new.status AND new.device_id IS NOT NULL
+BEGIN
+    INSERT INTO app_usage_daily (device_id, day, active_app, transcriptions, failed, words, audio_seconds,
+                                 processing_seconds)
+    VALUES (new.device_id, substr(new.created_at, 1, 10), coalesce(new.active_app, ''),
+            new.status = 'completed', new.status = 'failed',
+            CASE WHEN trim(coalesce(new.result, '')) = '' THEN 0
+                 ELSE length(trim(new.result)) - length(replace(trim(new.result), ' ', '')) + 1 END,
+            coalesce(new.duration, 0), coalesce(new.processing_time, 0))
+    ON CONFLICT (device_id, day, active_app) DO UPDATE SET
+        transcriptions = transcriptions + excluded.transcriptions,
+        failed = failed + excluded.failed,
+        words = words + excluded.words,
+        audio_seconds = audio_seconds + excluded.audio_seconds,
+        processing_seconds = processing_seconds + excluded.processing_seconds;
+END;
+
+-- Each distinct prompt is stored once; new rows keep only its prompt_id
+CREATE TABLE IF NOT EXISTS prompt_templates (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL UNIQUE
+);
+CREATE TRIGGER IF NOT EXISTS transcriptions_dedupe_prompt AFTER INSERT ON transcriptions
+WHEN new.prompt IS NOT NULL AND new.prompt <> ''
+BEGIN
+    INSERT INTO prompt_templates (text) VALUES (new.prompt) ON CONFLICT (text) DO NOTHING;
+    UPDATE transcriptions SET prompt = NULL, prompt_id = (SELECT id FROM prompt_templates WHERE text = new.prompt)
+    WHERE rowid = new.rowid;
+END;
+
+-- The retention job's next batches: rows not yet moved to transcriptions_archive
+CREATE INDEX IF NOT EXISTS idx_transcriptions_unarchived ON transcriptions(created_at) WHERE archived_at IS NULL;
+"""
+# 2: transcriptions_fts, 3: app_usage_daily, 4: prompt_templates and transcriptions_archive,
+# 5: archived rows kept in transcriptions_fts
+SCHEMA_VERSION = 5
+# Version 4 objects that dropped archived rows from the full-text index, recreated by SQLITE_SCHEMA
+SQL_DROP_FTS_V4 = (
+    "DROP TRIGGER IF EXISTS transcriptions_fts_delete",
+    "DROP TRIGGER IF EXISTS transcriptions_fts_update",
+    "DROP VIEW IF EXISTS transcriptions_fts_content",
+)
+
+# Columns the version 4 schema adds to existing transcriptions tables
+RETENTION_COLUMNS = {
+    "prompt_id": "INTEGER REFERENCES prompt_templates(id)",
+    "archived_at": "TEXT",
+}
+# Prompts stored before prompt_templates existed
+SQL_DEDUPE_PROMPTS = (
+    "INSERT INTO prompt_templates (text) SELECT DISTINCT prompt FROM transcriptions "
+    "WHERE prompt IS NOT NULL AND prompt <> '' ON CONFLICT (text) DO NOTHING",
+    "UPDATE transcriptions SET prompt_id = (SELECT id FROM prompt_templates p WHERE p.text = transcriptions.prompt), "
+    "prompt = NULL WHERE prompt IS NOT NULL AND prompt <> ''",
+)
+
+# Totals for transcriptions that finished before app_usage_daily existed
+SQL_BACKFILL_APP_USAGE = """
+INSERT INTO app_usage_daily (device_id, day, active_app, transcriptions, failed, words, audio_seconds,
+                             processing_seconds)
+SELECT device_id, substr(created_at, 1, 10), coalesce(active_app, ''),
+       sum(status = 'completed'), sum(status = 'failed'),
+       sum(CASE WHEN trim(coalesce(result, '')) = '' THEN 0
+                ELSE length(trim(result)) - length(replace(trim(result), ' ', '')) + 1 END),
+       coalesce(sum(duration), 0), coalesce(sum(processing_time), 0)
+FROM transcriptions
+WHERE status IN ('completed', 'failed') AND device_id IS NOT NULL
+GROUP BY 1, 2, 3
+ON CONFLICT (device_id, day, active_app) DO NOTHING
+"""
+
+# Fixed statement text, so each connection's statement cache reuses the prepared statements
+SQL_FIND_USER = "SELECT * FROM users WHERE device_id = ?"
+SQL_GET_USER = "SELECT * FROM users WHERE id = ?"
+SQL_USER_ID = "SELECT id FROM users WHERE device_id = ?"
+SQL_INSERT_USER = (
+    "INSERT INTO users (id, device_id, created_at, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(device_id) DO NOTHING"
+)
+SQL_INCREMENT = (
+    "UPDATE users SET transcriptions_used = transcriptions_used + 1, updated_at = ? WHERE device_id = ?"
+)
+SQL_USAGE = "SELECT transcriptions_used FROM users WHERE device_id = ?"
+SQL_INSERT_TRANSCRIPTION = (
+    "INSERT INTO transcriptions (id, user_id, device_id, filename, language, model, prompt, active_app, "
+    "screen_context, file_size, duration, status, created_at, updated_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'processing', ?, ?) ON CONFLICT(id) DO NOTHING"
+)
+SQL_UPDATE_RESULT = (
+    "UPDATE transcriptions SET result = ?, status = ?, processing_time = ?, error_message = ?, "
+    "completed_at = CASE WHEN ? = 'completed' THEN ? ELSE NULL END, updated_at = ? WHERE id = ?"
+)
+SQL_HISTORY = (
+    "SELECT {columns} FROM transcriptions t {joins} WHERE t.device_id = ? "
+    "ORDER BY t.created_at DESC, t.id DESC LIMIT ?"
+)
+SQL_HISTORY_BEFORE = (
+    "SELECT {columns} FROM transcriptions t {joins} WHERE t.device_id = ? AND (t.created_at, t.id) < (?, ?) "
+    "ORDER BY t.created_at DESC, t.id DESC LIMIT ?"
+)
+SQL_ARCHIVE_BATCH = (
+    "SELECT id, result, screen_context, error_message FROM transcriptions "
+    "WHERE archived_at IS NULL AND created_at < ? AND status IN ('completed', 'failed') "
+    "ORDER BY created_at LIMIT ?"
+)
+SQL_INSERT_ARCHIVE = "INSERT INTO transcriptions_archive (id, payload, archived_at) VALUES (?, ?, ?) ON CONFLICT(id) DO NOTHING"
+SQL_SLIM_ARCHIVED = (
+    "UPDATE transcriptions SET result = NULL, screen_context = NULL, error_message = NULL, archived_at = ? "
+    "WHERE id = ?"
+)
+# bm25 weights: the device column only narrows the match and must not affect the rank
+SQL_SEARCH = (
+    "SELECT t.id, t.created_at, t.status, t.active_app, -bm25(transcriptions_fts, 1.0, 0.0) AS rank, "
+    "snippet(transcriptions_fts, 0, '<mark>', '</mark>', ' … ', 16) AS snippet "
+    "FROM transcriptions_fts JOIN transcriptions t ON t.rowid = transcriptions_fts.rowid "
+    "WHERE transcriptions_fts MATCH ? AND t.device_id = ? "
+    "ORDER BY bm25(transcriptions_fts, 1.0, 0.0), t.created_at DESC LIMIT ?"
+)
+
+
+def fts5_query(device_id: str, text: str) -> Optional[str]:
+    """
+    FTS5 query for every word of free text within one device's rows. Words are
+    quoted, so operators and punctuation in user input cannot form a syntax error.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    terms = " ".join(f'"{word}"' for word in words)
+    return f'device : "{device_id.encode().hex()}" AND result : ({terms})'
+
+
+def _now() -> str:
+    # Fixed width, so timestamps sort correctly as text
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    A local SQLite file in WAL mode: readers never block the writer and a commit
+    is an append to the log, so each operation costs microseconds instead of a
+    network round trip. One connection per thread (and per process after a fork).
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False,
+                                   cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # durable across app crashes in WAL mode
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.create_function("archived_result", 1, archived_result, deterministic=True)
+            local.conn, local.pid = conn, os.getpid()
+            if not self._schema_ready:
+                self._ensure_schema(conn)
+        return local.conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection):
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0:
+                # whisperme.db from before Supabase has an incompatible users table; keep it aside
+                legacy = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone()
+                if legacy:
+                    logger.warning(f"Renaming legacy users table in {self.path} to users_legacy")
+                    conn.execute("ALTER TABLE users RENAME TO users_legacy")
+            if 0 < version < 4:
+                existing = {row[1] for row in conn.execute("PRAGMA table_info(transcriptions)")}
+                for column, definition in RETENTION_COLUMNS.items():
+                    if column not in existing:
+                        conn.execute(f"ALTER TABLE transcriptions ADD COLUMN {column} {definition}")
+            if 1 < version < 5:
+                for statement in SQL_DROP_FTS_V4:
+                    conn.execute(statement)
+            conn.executescript(SQLITE_SCHEMA)
+            if 0 < version < 2:
+                logger.info(f"Building the full-text index for existing transcriptions in {self.path}")
+                conn.execute("INSERT INTO transcriptions_fts (transcriptions_fts) VALUES ('rebuild')")
+            if 0 < version < 3:
+                conn.execute(SQL_BACKFILL_APP_USAGE)
+            if 0 < version < 4:
+                for statement in SQL_DEDUPE_PROMPTS:
+                    conn.execute(statement)
+            if 1 < version < 5:
+                logger.info(f"Re-indexing archived transcriptions in {self.path}")
+                conn.execute("INSERT INTO transcriptions_fts (transcriptions_fts) VALUES ('rebuild')")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._schema_ready = True
+
+    def _write(self, fn):
+        """Run fn(conn) in a write transaction; BEGIN IMMEDIATE avoids upgrade deadlocks"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def check(self):
+        self._connect().execute("SELECT 1 FROM users LIMIT 1").fetchall()
+
+    def find_user(self, device_id: str) -> Optional[Dict]:
+        row = self._connect().execute(SQL_FIND_USER, (device_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_user(self, user_id: str) -> Optional[Dict]:
+        row = self._connect().execute(SQL_GET_USER, (user_id,)).fetchone()
+        return dict(row) if row else None
+
+    @staticmethod
+    def _user_id(conn: sqlite3.Connection, device_id: str) -> str:
+        row = conn.execute(SQL_USER_ID, (device_id,)).fetchone()
+        if row:
+            return row[0]
+        now = _now()
+        conn.execute(SQL_INSERT_USER, (str(uuid.uuid4()), device_id, now, now))
+        return conn.execute(SQL_USER_ID, (device_id,)).fetchone()[0]
+
+    def get_or_create_user(self, device_id: str) -> str:
+        row = self._connect().execute(SQL_USER_ID, (device_id,)).fetchone()
+        if row:
+            return row[0]
+        return self._write(lambda conn: self._user_id(conn, device_id))
+
+    def register_device(self, device_id: str) -> Tuple[Dict, bool]:
+        row = self._connect().execute(SQL_FIND_USER, (device_id,)).fetchone()
+        if row:
+            return dict(row), False
+
+        def insert(conn):
+            now = _now()
+            created = conn.execute(SQL_INSERT_USER, (str(uuid.uuid4()), device_id, now, now)).rowcount > 0
+            return dict(conn.execute(SQL_FIND_USER, (device_id,)).fetchone()), created
+        return self._write(insert)
+
+    def update_user(self, device_id: str, fields: Dict[str, Any]) -> bool:
+        fields = _checked_fields(fields, USER_UPDATE_FIELDS)
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        sql = f"UPDATE users SET {assignments}, updated_at = ? WHERE device_id = ?"
+        cursor = self._write(lambda conn: conn.execute(sql, (*fields.values(), _now(), device_id)))
+        return cursor.rowcount > 0
+
+    def increment_transcriptions(self, device_id: str) -> int:
+        def increment(conn):
+            self._user_id(conn, device_id)
+            conn.execute(SQL_INCREMENT, (_now(), device_id))
+            return conn.execute(SQL_USAGE, (device_id,)).fetchone()[0]
+        return self._write(increment)
+
+    def create_transcription(self, device_id, filename=None, language="auto", model="gpt-4o-transcribe",
+                             prompt=None, active_app=None, screen_context=None, file_size=None,
+                             duration=None, transcription_id=None) -> str:
+        transcription_id = transcription_id or str(uuid.uuid4())
+
+        def insert(conn):
+            now = _now()
+            conn.execute(SQL_INSERT_TRANSCRIPTION, (
+                transcription_id, self._user_id(conn, device_id), device_id, filename, language, model,
+                prompt, active_app, screen_context, file_size, duration, now, now
+            ))
+        self._write(insert)
+        return transcription_id
+
+    def update_transcription_result(self, transcription_id, result, status="completed", processing_time=None,
+                                    error_message=None) -> bool:
+        now = _now()
+        cursor = self._write(lambda conn: conn.execute(SQL_UPDATE_RESULT, (
+            result, status, processing_time, error_message, status, now, now, transcription_id
+        )))
+        return cursor.rowcount > 0
+
+    def update_transcription(self, transcription_id: str, fields: Dict[str, Any]) -> bool:
+        fields = _checked_fields(fields, TRANSCRIPTION_UPDATE_FIELDS)
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        sql = f"UPDATE transcriptions SET {assignments}, updated_at = ? WHERE id = ?"
+        cursor = self._write(lambda conn: conn.execute(sql, (*fields.values(), _now(), transcription_id)))
+        return cursor.rowcount > 0
+
+    def create_transcriptions(self, rows) -> int:
+        def insert(conn):
+            now = _now()
+            return conn.executemany(SQL_INSERT_TRANSCRIPTION, [(
+                row["transcription_id"], self._user_id(conn, row["device_id"]), row["device_id"],
+                row.get("filename"), row.get("language", "auto"), row.get("model", "gpt-4o-transcribe"),
+                row.get("prompt"), row.get("active_app"), row.get("screen_context"), row.get("file_size"),
+                row.get("duration"), now, now
+            ) for row in rows]).rowcount
+        return self._write(insert)
+
+    def update_transcription_results(self, results) -> int:
+        now = _now()
+        return self._write(lambda conn: conn.executemany(SQL_UPDATE_RESULT, [(
+            result["result"], result.get("status", "completed"), result.get("processing_time"),
+            result.get("error_message"), result.get("status", "completed"), now, now, result["transcription_id"]
+        ) for result in results]).rowcount)
+
+    def update_transcriptions(self, updates) -> int:
+        # One statement per distinct set of columns
+        by_columns: Dict[Tuple[str, ...], List[Tuple]] = {}
+        now = _now()
+        for transcription_id, fields in updates.items():
+            fields = _checked_fields(fields, TRANSCRIPTION_UPDATE_FIELDS)
+            by_columns.setdefault(tuple(fields), []).append((*fields.values(), now, transcription_id))
+
+        def update(conn):
+            found = 0
+            for columns, params in by_columns.items():
+                assignments = ", ".join(f"{column} = ?" for column in columns)
+                sql = f"UPDATE transcriptions SET {assignments}, updated_at = ? WHERE id = ?"
+                found += conn.executemany(sql, params).rowcount
+            return found
+        return self._write(update)
+
+    @staticmethod
+    def _projection(columns: Sequence[str]) -> Dict[str, str]:
+        """Select list and joins for `columns` of transcriptions t, with prompts and archived text filled in"""
+        selected = ["coalesce(t.prompt, p.text) AS prompt" if column == "prompt" else f"t.{column}"
+                    for column in columns]
+        joins = []
+        if "prompt" in columns:
+            joins.append("LEFT JOIN prompt_templates p ON p.id = t.prompt_id")
+        if set(columns) & set(ARCHIVED_COLUMNS):
+            selected.append("a.payload AS archived_payload")
+            joins.append("LEFT JOIN transcriptions_archive a ON a.id = t.id")
+        return {"columns": ", ".join(selected), "joins": " ".join(joins)}
+
+    @staticmethod
+    def _unarchived(rows) -> List[Dict]:
+        results = []
+        for row in rows:
+            row = dict(row)
+            payload = row.pop("archived_payload", None)
+            if payload is not None:
+                archived = unpack_archived(payload)
+                for column in ARCHIVED_COLUMNS:
+                    if column in row and row[column] is None:
+                        row[column] = archived.get(column)
+            results.append(row)
+        return results
+
+    def list_transcriptions(self, device_id, limit, before=None, columns=HISTORY_COLUMNS) -> List[Dict]:
+        projection = self._projection(columns)
+        if before:
+            rows = self._connect().execute(SQL_HISTORY_BEFORE.format(**projection), (device_id, *before, limit))
+        else:
+            rows = self._connect().execute(SQL_HISTORY.format(**projection), (device_id, limit))
+        return self._unarchived(rows)
+
+    def get_transcriptions(self, device_id, ids, columns=HISTORY_COLUMNS) -> List[Dict]:
+        if not ids:
+            return []
+        projection = self._projection(columns)
+        placeholders = ", ".join("?" for _ in ids)
+        sql = (f"SELECT {projection['columns']} FROM transcriptions t {projection['joins']} "
+               f"WHERE t.device_id = ? AND t.id IN ({placeholders})")
+        return self._unarchived(self._connect().execute(sql, (device_id, *ids)))
+
+    def search_transcriptions(self, device_id, query, limit=20) -> List[Dict]:
+        match = fts5_query(device_id, query)
+        if match is None:
+            return []
+        rows = self._connect().execute(SQL_SEARCH, (match, device_id, limit))
+        return [dict(row) for row in rows]
+
+    def archive_transcriptions(self, cutoff, limit=500) -> int:
+        def archive(conn):
+            rows = conn.execute(SQL_ARCHIVE_BATCH, (cutoff, limit)).fetchall()
+            now = _now()
+            conn.executemany(SQL_INSERT_ARCHIVE, [(row["id"], pack_archived(row), now) for row in rows])
+            conn.executemany(SQL_SLIM_ARCHIVED, [(now, row["id"]) for row in rows])
+            return len(rows)
+        return self._write(archive)
+
+    def app_usage(self, device_id, start_day, end_day) -> List[Dict]:
+        sql = (f"SELECT {', '.join(APP_USAGE_COLUMNS)} FROM app_usage_daily "
+               "WHERE device_id = ? AND day BETWEEN ? AND ?")
+        return [dict(row) for row in self._connect().execute(sql, (device_id, start_day, end_day))]
+
+
+def sqlite_path(database_url: str) -> Optional[str]:
+    """File path of a sqlite:/// URL (relative to the working directory), or None for other URLs"""
+    if not database_url.startswith("sqlite:///"):
+        return None
+    path = database_url[len("sqlite:///"):]
+    if not path or path == ":memory:":
+        raise ValueError("DATABASE_URL must name a SQLite file shared by all workers")
+    return path
+
+
+def create_storage(database_url: Optional[str], supabase_client) -> StorageBackend:
+    """SQLite when DATABASE_URL is a sqlite:/// URL, otherwise Supabase"""
+    path = sqlite_path(database_url) if database_url else None
+    if path is not None:
+        return SQLiteStorage(path)
+    if database_url:
+        # Hosts often set DATABASE_URL for their own Postgres; it is not ours to use
+        scheme = database_url.split(":", 1)[0]
+        logger.warning(f"Ignoring DATABASE_URL with scheme {scheme} (only sqlite:/// is supported); using Supabase")
+    return SupabaseStorage(supabase_client)
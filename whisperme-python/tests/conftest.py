@@ -0,0 +1,103 @@
+"""
+Shared fixtures. The backend modules are imported from the directory above;
+main.py is imported once, configured for a throwaway SQLite database and
+temporary state files, with OpenAI replaced by fakes.FakeOpenAI.
+"""
+
+import io
+import os
+import sys
+import tempfile
+import uuid
+import wave
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+STATE_DIR = tempfile.mkdtemp(prefix="whisperme-tests-")
+
+# main.py reads its configuration at import
+os.environ.update({
+    "OPENAI_API_KEY": "test",
+    "SUPABASE_URL": "http://supabase.invalid",
+    "SUPABASE_SERVICE_ROLE_KEY": "test",
+    "DATABASE_URL": f"sqlite:///{os.path.join(STATE_DIR, 'whisperme.db')}",
+    "SECRET_KEY": "tests-" + "k" * 40,
+    "PYTHON_SERVICE_API_KEY": "tests-service-key",
+    "LOG_FILE": "",
+    "LOG_LEVEL": "WARNING",
+    "LOOP_WATCHDOG_ENABLED": "false",
+    "UPLOAD_DIR": os.path.join(STATE_DIR, "uploads"),
+    "IDEMPOTENCY_PATH": os.path.join(STATE_DIR, "idempotency.db"),
+    "TOKEN_DENYLIST_PATH": os.path.join(STATE_DIR, "token-denylist.json"),
+    "RETENTION_LOCK_PATH": os.path.join(STATE_DIR, "retention.lock"),
+    "VECTOR_INDEX_DIR": os.path.join(STATE_DIR, "vectors"),
+    "PROFILE_DIR": os.path.join(STATE_DIR, "profiles"),
+})
+for name in ("METRICS_DIR", "OUTBOX_PATH", "DEVICE_TOKEN_REQUIRED", "RETENTION_DAYS"):
+    os.environ.pop(name, None)
+
+TRANSCRIPT = "Hello from the test suite."
+
+
+def wav_bytes(seconds: float = 1.0, rate: int = 16000) -> bytes:
+    """Silent 16-bit mono WAV of the given length"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\0\0" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="session")
+def backend():
+    import main
+    from fakes import FakeOpenAI
+
+    main.openai_client.set(FakeOpenAI(transcript=TRANSCRIPT))
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(backend):
+    from fastapi.testclient import TestClient
+
+    with TestClient(backend.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def device(client):
+    """A freshly registered device: (device_id, bearer token)"""
+    device_id = f"test-{uuid.uuid4().hex[:12]}"
+    response = client.post("/register", json={"device_id": device_id})
+    assert response.status_code == 200
+    return device_id, response.json()["token"]["access_token"]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """A SQLite storage backend of its own"""
+    from storage import SQLiteStorage
+
+    return SQLiteStorage(str(tmp_path / "whisperme.db"))
+
+
+def add_transcriptions(storage, device_id, count, status="completed"):
+    """Insert `count` transcriptions (finished with text "text <i>" unless status is None)"""
+    ids = []
+    for i in range(count):
+        transcription_id = storage.create_transcription(device_id, filename=f"clip{i}.wav")
+        if status:
+            storage.update_transcription_result(transcription_id, f"text {i}", status=status)
+        ids.append(transcription_id)
+    return ids
+
+
+def set_created_at(storage, ids, created_at):
+    storage._connect().executemany("UPDATE transcriptions SET created_at = ? WHERE id = ?",
+                                   [(created_at, i) for i in ids])
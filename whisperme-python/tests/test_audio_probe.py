@@ -0,0 +1,58 @@
+import os
+import struct
+
+import pytest
+
+from audio_probe import estimate_duration, probe_duration_bytes
+from conftest import BACKEND_DIR, wav_bytes
+
+SAMPLE_MP3 = os.path.join(os.path.dirname(BACKEND_DIR), "g.mp3")
+
+
+def box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def m4a_bytes(seconds: int, timescale: int = 1000) -> bytes:
+    mvhd = box(b"mvhd", b"\0\0\0\0" + struct.pack(">IIII", 0, 0, timescale, seconds * timescale))
+    return box(b"ftyp", b"M4A \0\0\0\0") + box(b"moov", mvhd) + box(b"mdat", b"\0" * 32)
+
+
+def test_wav_duration():
+    assert probe_duration_bytes(wav_bytes(2.5)) == pytest.approx(2.5)
+
+
+def test_m4a_duration():
+    assert probe_duration_bytes(m4a_bytes(7)) == pytest.approx(7.0)
+
+
+@pytest.mark.skipif(not os.path.exists(SAMPLE_MP3), reason="sample recording not in the checkout")
+def test_mp3_duration():
+    with open(SAMPLE_MP3, "rb") as f:
+        duration = probe_duration_bytes(f.read())
+    assert duration is not None and duration > 0
+
+
+@pytest.mark.parametrize("data", [
+    pytest.param(wav_bytes(0.1), id="wav"),
+    pytest.param(m4a_bytes(3), id="m4a"),
+    pytest.param(b"ID3\x03\x00\x00\x00\x00\x02\x00" + b"\0" * 256 + b"\xff\xfb\x90\x64" + b"\0" * 64, id="id3"),
+    pytest.param(b"\xff\xfb\x90\x64" + b"\0" * 64, id="mpeg"),
+])
+def test_truncated_headers_give_no_duration_instead_of_raising(data):
+    # Every prefix of a header is a plausible interrupted upload
+    for cut in range(len(data)):
+        duration = probe_duration_bytes(data[:cut])
+        assert duration is None or duration >= 0, cut
+
+
+def test_estimate_falls_back_to_size():
+    assert estimate_duration(3.0, 10) == 3.0
+    assert estimate_duration(None, 32000) == pytest.approx(2.0)
+
+
+def test_transcribe_accepts_a_truncated_header(client, device):
+    device_id, _ = device
+    response = client.post("/transcribe", data={"device_id": device_id},
+                           files={"audio_file": ("clip.mp3", b"ID3\x03", "audio/mpeg")})
+    assert response.status_code == 200
@@ -0,0 +1,124 @@
+import time
+
+import jwt
+import pytest
+
+from device_tokens import DeviceTokens, InvalidDeviceToken, TokenDenylist
+
+SECRET = "s" * 32
+USER = {"id": "user-1", "device_id": "device-1", "subscription_tier": "premium"}
+
+
+@pytest.fixture
+def denylist_path(tmp_path):
+    return str(tmp_path / "denylist.json")
+
+
+def tokens(denylist_path, **options):
+    return DeviceTokens(SECRET, denylist=TokenDenylist(denylist_path, refresh_interval=0), **options)
+
+
+def test_issued_token_verifies_to_its_claims(denylist_path):
+    issuer = tokens(denylist_path)
+    claims = issuer.verify(issuer.issue(USER)["access_token"])
+    assert (claims["sub"], claims["device_id"], claims["tier"]) == ("user-1", "device-1", "premium")
+    assert issuer.stats()["valid"] == 1
+
+
+def test_expired_forged_and_foreign_tokens_are_rejected(denylist_path):
+    issuer = tokens(denylist_path)
+    expired = tokens(denylist_path, ttl=-10).issue(USER)["access_token"]
+    forged = DeviceTokens("f" * 32).issue(USER)["access_token"]
+    not_a_device_token = jwt.encode({"sub": "x", "jti": "j", "iat": time.time(), "exp": time.time() + 60},
+                                    SECRET, algorithm="HS256")
+    for token in (expired, forged, not_a_device_token, "garbage"):
+        with pytest.raises(InvalidDeviceToken):
+            issuer.verify(token)
+    assert issuer.stats()["expired"] == 1 and issuer.stats()["invalid"] == 3
+
+
+@pytest.mark.parametrize("secret", [None, "", "short-secret"])
+def test_weak_secret_disables_tokens(secret):
+    weak = DeviceTokens(secret)
+    assert not weak.enabled
+    assert weak.issue(USER) is None
+    with pytest.raises(InvalidDeviceToken):
+        weak.verify(DeviceTokens(SECRET).issue(USER)["access_token"])
+
+
+def test_revoked_token_is_rejected_by_every_worker(denylist_path):
+    worker_a, worker_b = tokens(denylist_path), tokens(denylist_path)
+    revoked = worker_a.issue(USER)["access_token"]
+    kept = worker_a.issue(USER)["access_token"]
+    worker_a.revoke(worker_a.verify(revoked))
+
+    with pytest.raises(InvalidDeviceToken, match="revoked"):
+        worker_b.verify(revoked)
+    assert worker_b.verify(kept)["device_id"] == "device-1"
+
+
+def test_revoking_a_device_covers_only_tokens_issued_before(denylist_path):
+    worker_a, worker_b = tokens(denylist_path), tokens(denylist_path)
+    old = worker_a.issue(USER)["access_token"]
+    worker_b.revoke_device("device-1")
+    time.sleep(0.01)
+    new = worker_a.issue(USER)["access_token"]
+
+    with pytest.raises(InvalidDeviceToken, match="revoked"):
+        worker_a.verify(old)
+    assert worker_a.verify(new)["device_id"] == "device-1"
+
+
+def test_denylist_drops_entries_once_the_tokens_expire(denylist_path):
+    denylist = TokenDenylist(denylist_path, refresh_interval=0)
+    denylist.revoke_token("expired-jti", time.time() - 1)
+    denylist.revoke_token("live-jti", time.time() + 60)
+    assert len(denylist) == 1
+    reloaded = TokenDenylist(denylist_path, refresh_interval=0)
+    assert reloaded.is_revoked({"jti": "live-jti", "device_id": "d", "iat": 0})
+    assert not reloaded.is_revoked({"jti": "expired-jti", "device_id": "d", "iat": 0})
+
+
+def test_token_endpoints(client, device):
+    device_id, token = device
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get(f"/user/{device_id}/status", headers=headers).status_code == 200
+    assert client.get("/transcriptions", params={"device_id": "someone-else"}, headers=headers).status_code == 403
+
+    assert client.post("/tokens/revoke", headers=headers).json() == {"revoked": True}
+    assert client.get("/transcriptions", headers=headers).status_code == 401
+
+    # Registering again is how a client gets a fresh token
+    fresh = client.post("/register", json={"device_id": device_id}).json()["token"]["access_token"]
+    fresh_headers = {"Authorization": f"Bearer {fresh}"}
+    assert client.get("/transcriptions", headers=fresh_headers).status_code == 200
+
+    assert client.post(f"/devices/{device_id}/tokens/revoke").status_code == 401
+    admin = {"X-API-Key": "tests-service-key"}
+    assert client.post(f"/devices/{device_id}/tokens/revoke", headers=admin).status_code == 200
+    assert client.get("/transcriptions", headers=fresh_headers).status_code == 401
+
+
+def test_required_token_is_enforced_on_every_device_route(client, backend, device, monkeypatch):
+    from starlette.websockets import WebSocketDisconnect
+
+    device_id, token = device
+    other_id, other_token = f"{device_id}-other", client.post(
+        "/register", json={"device_id": f"{device_id}-other"}).json()["token"]["access_token"]
+    monkeypatch.setattr(backend, "DEVICE_TOKEN_REQUIRED", True)
+    headers = {"Authorization": f"Bearer {token}"}
+    upload = {"device_id": device_id, "filename": "clip.wav"}
+
+    assert client.post("/uploads", json=upload).status_code == 401
+    assert client.post("/uploads", json=upload, headers={"Authorization": f"Bearer {other_token}"}).status_code == 403
+    assert client.post("/uploads", json={"filename": "clip.wav"}, headers=headers).status_code == 200
+
+    assert client.post(f"/upgrade/{device_id}").status_code == 401
+    assert client.post(f"/upgrade/{other_id}", headers=headers).status_code == 403
+
+    for url in (f"/ws/transcribe?device_id={device_id}", f"/ws/transcribe?device_id={other_id}&token={token}",
+                "/ws/transcribe?token=garbage"):
+        with pytest.raises(WebSocketDisconnect) as refused:
+            with client.websocket_connect(url):
+                pass
+        assert refused.value.code == 1008
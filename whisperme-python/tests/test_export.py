@@ -0,0 +1,72 @@
+import csv
+import gzip
+import io
+import json
+import zlib
+
+import pytest
+
+from export import ExportEncoder
+
+
+def rows(start, count):
+    return [{"id": f"row{i}", "status": "completed", "result": f"text, {i}"} for i in range(start, start + count)]
+
+
+def test_csv_has_one_header_and_quotes_values():
+    encoder = ExportEncoder("csv", ["id", "result"])
+    data = encoder.encode(rows(0, 2)) + encoder.encode(rows(2, 1)) + encoder.finish()
+    parsed = list(csv.reader(io.StringIO(data.decode())))
+    assert parsed == [["id", "result"], ["row0", "text, 0"], ["row1", "text, 1"], ["row2", "text, 2"]]
+    assert encoder.rows == 3
+
+
+def test_empty_csv_export_still_has_a_header():
+    encoder = ExportEncoder("csv", ["id"])
+    assert encoder.encode([]) + encoder.finish() == b"id\r\n"
+
+
+def test_gzip_pages_are_readable_as_they_arrive_and_members_concatenate():
+    first = ExportEncoder("ndjson", ["id"], compress=True)
+    interrupted = first.encode(rows(0, 2))  # flushed page; the connection then dropped
+    assert first.media_type == "application/gzip" and first.filename("t") == "t.ndjson.gz"
+    received = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(interrupted).decode().splitlines()
+    assert [json.loads(line)["id"] for line in received] == ["row0", "row1"]
+
+    # The resumed export is a gzip member of its own
+    resumed = ExportEncoder("ndjson", ["id"], compress=True, header=False)
+    rest = resumed.encode(rows(2, 2)) + resumed.finish()
+    assert [json.loads(line)["id"] for line in gzip.decompress(rest).decode().splitlines()] == ["row2", "row3"]
+
+    whole = interrupted + first.finish() + rest
+    assert [json.loads(line)["id"] for line in gzip.decompress(whole).decode().splitlines()] == [
+        "row0", "row1", "row2", "row3"]
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        ExportEncoder("xml", ["id"])
+
+
+def test_export_resumes_after_the_last_row_received(client, backend, device, monkeypatch):
+    device_id, token = device
+    for i in range(5):
+        transcription_id = backend.storage.create_transcription(device_id, filename=f"clip{i}.wav")
+        backend.storage.update_transcription_result(transcription_id, f"text {i}")
+    monkeypatch.setattr(backend, "EXPORT_PAGE_SIZE", 2)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    full = client.get("/transcriptions/export", params={"format": "csv", "fields": "result"}, headers=headers)
+    assert full.status_code == 200
+    assert 'filename="transcriptions.csv"' in full.headers["content-disposition"]
+    table = list(csv.reader(io.StringIO(full.text)))
+    assert table[0] == ["id", "created_at", "result"]
+    assert [row[2] for row in table[1:]] == [f"text {i}" for i in reversed(range(5))]
+
+    # The download broke after two rows: continue after the last id received
+    resumed = client.get("/transcriptions/export", headers=headers,
+                         params={"format": "csv", "fields": "result", "after_id": table[2][0]})
+    assert list(csv.reader(io.StringIO(resumed.text))) == table[3:]
+
+    unknown = client.get("/transcriptions/export", params={"after_id": "missing"}, headers=headers)
+    assert unknown.status_code == 404
@@ -0,0 +1,56 @@
+import pytest
+
+from conftest import add_transcriptions, set_created_at
+from storage import decode_cursor, encode_cursor, history_columns
+
+
+def all_pages(storage, device_id, limit):
+    pages, before = [], None
+    while True:
+        rows = storage.list_transcriptions(device_id, limit, before=before)
+        if not rows:
+            return pages
+        pages.append([row["id"] for row in rows])
+        before = decode_cursor(encode_cursor(rows[-1]))
+
+
+def test_cursor_round_trip():
+    row = {"created_at": "2026-01-01T00:00:00.000001+00:00", "id": "abc"}
+    assert decode_cursor(encode_cursor(row)) == (row["created_at"], row["id"])
+    for bad in ("not-a-cursor", encode_cursor({"created_at": 1, "id": "x"})):
+        with pytest.raises(ValueError):
+            decode_cursor(bad)
+
+
+def test_history_columns_are_validated():
+    assert set(history_columns(["status"])) == {"id", "created_at", "status"}
+    with pytest.raises(ValueError):
+        history_columns(["password"])
+
+
+def test_pages_cover_every_row_once_even_with_equal_timestamps(storage):
+    ids = add_transcriptions(storage, "d", 7)
+    set_created_at(storage, ids[2:6], "2026-01-01T00:00:00.000000+00:00")
+    add_transcriptions(storage, "other-device", 3)
+
+    pages = all_pages(storage, "d", 3)
+    seen = [row_id for page in pages for row_id in page]
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sorted(seen) == sorted(ids)
+
+
+def test_history_endpoint_pages_with_next_cursor(client, backend, device):
+    device_id, token = device
+    ids = add_transcriptions(backend.storage, device_id, 5)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/transcriptions", params=params, headers={"Authorization": f"Bearer {token}"}).json()
+        seen += [row["id"] for row in page["transcriptions"]]
+        cursor = page["next_cursor"]
+        assert page["has_more"] == (cursor is not None)
+        if not cursor:
+            break
+    assert seen == list(reversed(ids))
+    assert client.get("/transcriptions", params={"device_id": device_id, "cursor": "garbage"}).status_code == 400
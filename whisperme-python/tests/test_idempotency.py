@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import pytest
+
+from conftest import wav_bytes
+from idempotency import IdempotencyStore
+
+
+def counted(result, delay: float = 0.05):
+    """A job returning `result` after `delay`, and the list of its runs"""
+    runs = []
+
+    async def job():
+        runs.append(1)
+        await asyncio.sleep(delay)
+        return result
+    return job, runs
+
+
+def test_derive_key_scopes_client_keys_to_the_device():
+    a = IdempotencyStore.derive_key("device-a", "retry-1", b"audio")
+    b = IdempotencyStore.derive_key("device-b", "retry-1", b"audio")
+    assert a != b
+    assert IdempotencyStore.derive_key("d", None, b"audio", "en") == IdempotencyStore.derive_key("d", None, b"audio", "en")
+    assert IdempotencyStore.derive_key("d", None, b"audio", "en") != IdempotencyStore.derive_key("d", None, b"audio", "de")
+
+
+def test_duplicate_joins_the_running_job_and_later_retry_replays():
+    async def scenario():
+        store = IdempotencyStore()
+        job, runs = counted({"text": "hi"})
+        first, second = await asyncio.gather(store.run("k", job), store.run("k", job))
+        third = await store.run("k", job)
+        return runs, first, second, third, store.stats()
+
+    runs, first, second, third, stats = asyncio.run(scenario())
+    assert len(runs) == 1
+    assert first == ({"text": "hi"}, False)
+    assert second == ({"text": "hi"}, True)
+    assert third == ({"text": "hi"}, True)
+    assert (stats["started"], stats["joined"], stats["replayed"]) == (1, 1, 1)
+
+
+def test_failed_job_is_forgotten():
+    async def scenario():
+        store = IdempotencyStore()
+
+        async def fail():
+            raise RuntimeError("upstream down")
+        with pytest.raises(RuntimeError):
+            await store.run("k", fail)
+        job, runs = counted({"text": "ok"})
+        return await store.run("k", job), runs
+
+    result, runs = asyncio.run(scenario())
+    assert result == ({"text": "ok"}, False)
+    assert len(runs) == 1
+
+
+def test_disconnected_client_does_not_cancel_the_job():
+    async def scenario():
+        store = IdempotencyStore()
+        job, runs = counted({"text": "hi"}, delay=0.1)
+        request = asyncio.create_task(store.run("k", job))
+        await asyncio.sleep(0.01)
+        request.cancel()
+        return await store.run("k", job), runs
+
+    result, runs = asyncio.run(scenario())
+    assert result == ({"text": "hi"}, True)
+    assert len(runs) == 1
+
+
+def test_results_expire_after_retention():
+    async def scenario():
+        store = IdempotencyStore(retention_seconds=0.05)
+        job, runs = counted({"text": "hi"}, delay=0)
+        await store.run("k", job)
+        await asyncio.sleep(0.1)
+        return await store.run("k", job), runs
+
+    result, runs = asyncio.run(scenario())
+    assert result == ({"text": "hi"}, False)
+    assert len(runs) == 2
+
+
+def test_workers_sharing_a_file_run_a_job_once(tmp_path):
+    """Two stores on one file stand in for two gunicorn workers"""
+    path = str(tmp_path / "idempotency.db")
+
+    async def scenario():
+        worker_a = IdempotencyStore(path=path, poll_interval=0.01)
+        worker_b = IdempotencyStore(path=path, poll_interval=0.01)
+        job, runs = counted({"text": "hi"}, delay=0.1)
+        first, joined = await asyncio.gather(worker_a.run("k", job), worker_b.run("k", job))
+        # A retry after the first worker forgot the key (e.g. it restarted)
+        worker_c = IdempotencyStore(path=path)
+        return runs, first, joined, await worker_c.known("k"), await worker_c.run("k", job)
+
+    runs, first, joined, known, replayed = asyncio.run(scenario())
+    assert len(runs) == 1
+    # Whichever worker claims the key first runs the job; the other waits for it
+    assert sorted([first, joined], key=lambda r: r[1]) == [({"text": "hi"}, False), ({"text": "hi"}, True)]
+    assert known
+    assert replayed == ({"text": "hi"}, True)
+
+
+def test_shared_claim_of_a_failed_or_dead_worker_is_released(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+
+    async def scenario():
+        store = IdempotencyStore(path=path)
+
+        async def fail():
+            raise RuntimeError("upstream down")
+        with pytest.raises(RuntimeError):
+            await store.run("failed", fail)
+        known_after_failure = await store.known("failed")
+
+        # A claim left behind by a worker that no longer exists
+        store._connect().execute(
+            "INSERT INTO idempotency (key, state, owner, result, updated_at) VALUES (?, 'running', ?, NULL, ?)",
+            ("orphaned", 2 ** 22 + 1, time.time()))
+        job, runs = counted({"text": "taken over"}, delay=0)
+        return known_after_failure, await store.run("orphaned", job), runs
+
+    known_after_failure, result, runs = asyncio.run(scenario())
+    assert not known_after_failure
+    assert result == ({"text": "taken over"}, False)
+    assert len(runs) == 1
+
+
+def test_transcribe_retry_is_replayed(client, device):
+    device_id, token = device
+    request = dict(
+        data={"device_id": device_id},
+        files={"audio_file": ("clip.wav", wav_bytes(), "audio/wav")},
+        headers={"Idempotency-Key": "retry-me"},
+    )
+    first = client.post("/transcribe", **request)
+    retry = client.post("/transcribe", **request)
+    assert first.status_code == retry.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json()["text"] == first.json()["text"]
+
+    history = client.get("/transcriptions", params={"device_id": device_id}).json()["transcriptions"]
+    assert len(history) == 1
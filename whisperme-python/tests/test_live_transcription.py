@@ -0,0 +1,191 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from fakes import DEFAULT_TRANSCRIPT, FakeRealtimeUpstream
+
+PCM_FRAME = b"\0" * 4800  # 100 ms of 24 kHz 16-bit mono
+
+
+@pytest.fixture(scope="module")
+def upstream():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    fake = asyncio.run_coroutine_threadsafe(FakeRealtimeUpstream().start(), loop).result()
+    yield fake
+    asyncio.run_coroutine_threadsafe(fake.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+@pytest.fixture
+def live(client, backend, upstream, monkeypatch):
+    """A client of its own: a session stuck in the handler must not hold up the shared one"""
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(backend, "OPENAI_REALTIME_URL", upstream.url)
+    upstream.fail_with = None
+    upstream.delta_delay = 0.0
+    return TestClient(backend.app)
+
+
+def open_sessions(backend) -> float:
+    return backend.WEBSOCKET_SESSIONS.values.get(("/ws/transcribe",), 0)
+
+
+def within(seconds, fn):
+    """Run fn in a thread; a session that never ends fails the test instead of hanging it"""
+    errors = []
+
+    def run():
+        try:
+            fn()
+        except BaseException as e:
+            errors.append(e)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), "websocket session did not end"
+    if errors:
+        raise errors[0]
+
+
+def test_dictation_streams_partials_then_the_final_text(live, backend, device):
+    device_id, _ = device
+    with live.websocket_connect(f"/ws/transcribe?device_id={device_id}&language=en") as ws:
+        assert ws.receive_json()["type"] == "ready"
+        for _ in range(3):
+            ws.send_bytes(PCM_FRAME)
+        ws.send_text(json.dumps({"type": "stop"}))
+        messages = []
+        while not messages or messages[-1]["type"] != "final":
+            messages.append(ws.receive_json())
+    assert messages[-1]["text"] == DEFAULT_TRANSCRIPT
+    assert any(m["type"] == "partial" for m in messages[:-1])
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        history = live.get("/transcriptions", params={"device_id": device_id}).json()["transcriptions"]
+        if history:
+            break
+        time.sleep(0.02)
+    assert history[0]["result"] == DEFAULT_TRANSCRIPT
+
+
+def test_device_token_in_the_query_stands_in_for_device_id(live, backend, device, monkeypatch):
+    _, token = device
+    monkeypatch.setattr(backend, "DEVICE_TOKEN_REQUIRED", True)
+
+    def session():
+        with live.websocket_connect(f"/ws/transcribe?token={token}") as ws:
+            assert ws.receive_json()["type"] == "ready"
+    within(5, session)
+
+
+@pytest.mark.parametrize("frame,code", [
+    ("not json", 1007),
+    (json.dumps({"type": "pause"}), 1003),
+    (json.dumps(["stop"]), 1003),
+])
+def test_bad_control_frame_closes_the_session(live, backend, device, frame, code):
+    device_id, _ = device
+
+    def session():
+        with live.websocket_connect(f"/ws/transcribe?device_id={device_id}") as ws:
+            ws.receive_json()
+            ws.send_bytes(PCM_FRAME)
+            ws.send_text(frame)
+            assert ws.receive_json()["type"] == "error"
+            with pytest.raises(WebSocketDisconnect) as closed:
+                ws.receive_json()
+            assert closed.value.code == code
+    within(5, session)
+    assert open_sessions(backend) == 0
+
+
+def test_client_leaving_mid_dictation_ends_the_session(live, backend, device):
+    device_id, _ = device
+
+    def session():
+        with live.websocket_connect(f"/ws/transcribe?device_id={device_id}") as ws:
+            ws.receive_json()
+            assert open_sessions(backend) == 1
+            ws.send_bytes(PCM_FRAME)
+    within(5, session)
+
+    deadline = time.monotonic() + 5
+    while open_sessions(backend) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert open_sessions(backend) == 0
+
+
+def test_upstream_error_is_reported(live, upstream, device):
+    device_id, _ = device
+    upstream.fail_with = "model overloaded"
+
+    def session():
+        with live.websocket_connect(f"/ws/transcribe?device_id={device_id}") as ws:
+            ws.receive_json()
+            ws.send_bytes(PCM_FRAME)
+            ws.send_text(json.dumps({"type": "stop"}))
+            message = ws.receive_json()
+            while message["type"] == "partial":
+                message = ws.receive_json()
+            assert message["type"] == "error" and "model overloaded" in message["message"]
+            with pytest.raises(WebSocketDisconnect) as closed:
+                ws.receive_json()
+            assert closed.value.code == 1011
+    within(5, session)
+
+
+def expect_error_then_close(ws, code):
+    message = ws.receive_json()
+    while message["type"] == "partial":
+        message = ws.receive_json()
+    assert message["type"] == "error"
+    with pytest.raises(WebSocketDisconnect) as closed:
+        ws.receive_json()
+    assert closed.value.code == code
+    return message
+
+
+def test_failed_user_lookup_closes_with_an_error(live, backend, device, monkeypatch):
+    device_id, _ = device
+
+    def unavailable(device_id):
+        raise Exception("database unavailable")
+    monkeypatch.setattr(backend, "resolve_user", unavailable)
+
+    def session():
+        with live.websocket_connect(f"/ws/transcribe?device_id={device_id}") as ws:
+            expect_error_then_close(ws, 1011)
+    within(5, session)
+    assert open_sessions(backend) == 0
+
+
+def test_unreachable_upstream_closes_with_an_error(live, backend, device, monkeypatch):
+    device_id, _ = device
+    monkeypatch.setattr(backend, "OPENAI_REALTIME_URL", "ws://127.0.0.1:9")
+
+    def session():
+        with live.websocket_connect(f"/ws/transcribe?device_id={device_id}") as ws:
+            expect_error_then_close(ws, 1011)
+    within(5, session)
+    assert open_sessions(backend) == 0
+
+
+def test_missing_final_transcript_times_out(live, backend, upstream, device, monkeypatch):
+    device_id, _ = device
+    upstream.delta_delay = 1.0
+    monkeypatch.setattr(backend, "REALTIME_FINAL_TIMEOUT", 0.1)
+
+    def session():
+        with live.websocket_connect(f"/ws/transcribe?device_id={device_id}") as ws:
+            ws.receive_json()
+            ws.send_bytes(PCM_FRAME)
+            ws.send_text(json.dumps({"type": "stop"}))
+            assert "No final transcript" in expect_error_then_close(ws, 1011)["message"]
+    within(5, session)
@@ -0,0 +1,151 @@
+import time
+import uuid
+
+import pytest
+
+from outbox import MERGEABLE_OP, WriteOutbox
+
+
+class Database:
+    """Records applied writes and round trips; raises for keys listed in `down`"""
+
+    def __init__(self):
+        self.applied = []
+        self.round_trips = 0
+        self.down = set()
+
+    def apply(self, op, params):
+        self.apply_many(op, [params])
+
+    def apply_many(self, op, params_list):
+        self.round_trips += 1
+        if any(params["key"] in self.down for params in params_list):
+            raise ConnectionError("database unreachable")
+        self.applied.extend((op, params) for params in params_list)
+
+
+@pytest.fixture
+def database():
+    return Database()
+
+
+@pytest.fixture
+def outbox(tmp_path, database):
+    return WriteOutbox(str(tmp_path / "outbox.db"), database.apply, max_attempts=3, max_backoff=0)
+
+
+def record(outbox, op, key, **params):
+    outbox.record(op, key, {"key": key, **params})
+
+
+def test_writes_replay_in_order_with_updates_merged(outbox, database):
+    record(outbox, "create_transcription", "t1", n=1)
+    record(outbox, MERGEABLE_OP, "t1", fields={"progress": 10})
+    record(outbox, MERGEABLE_OP, "t1", fields={"progress": 20, "duration": 3.0})
+    record(outbox, "create_transcription", "t2", n=2)
+
+    assert outbox.replay_batch() == 4
+    assert [(op, params) for op, params in database.applied if params["key"] == "t1"] == [
+        ("create_transcription", {"key": "t1", "n": 1}),
+        (MERGEABLE_OP, {"key": "t1", "fields": {"progress": 20, "duration": 3.0}}),
+    ]
+    assert ("create_transcription", {"key": "t2", "n": 2}) in database.applied
+    assert outbox.stats()["pending"] == 0
+
+
+def test_writes_of_one_op_replay_in_one_round_trip(tmp_path, database):
+    outbox = WriteOutbox(str(tmp_path / "outbox.db"), database.apply, apply_many=database.apply_many)
+    for i in range(10):
+        record(outbox, "create_transcription", f"t{i}")
+        record(outbox, MERGEABLE_OP, f"t{i}", fields={"progress": 1})
+        record(outbox, "update_transcription_result", f"t{i}")
+
+    assert outbox.replay_batch() == 30
+    assert database.round_trips == 3
+    assert [op for op, params in database.applied if params["key"] == "t3"] == [
+        "create_transcription", MERGEABLE_OP, "update_transcription_result"]
+
+
+def test_failing_write_in_a_batch_only_holds_up_its_key(tmp_path, database):
+    outbox = WriteOutbox(str(tmp_path / "outbox.db"), database.apply, apply_many=database.apply_many,
+                         max_backoff=0)
+    database.down.add("t1")
+    for i in range(3):
+        record(outbox, "create_transcription", f"t{i}")
+    record(outbox, "update_transcription_result", "t1")
+
+    assert outbox.replay_batch() == 2
+    assert sorted(params["key"] for _, params in database.applied) == ["t0", "t2"]
+    assert outbox.stats()["pending"] == 2
+
+
+def test_failed_key_waits_without_blocking_others(outbox, database):
+    database.down.add("t1")
+    record(outbox, "create_transcription", "t1")
+    record(outbox, "update_transcription_result", "t1")
+    record(outbox, "create_transcription", "t2")
+
+    assert outbox.replay_batch() == 1
+    assert [params["key"] for _, params in database.applied] == ["t2"]
+    assert outbox.stats()["pending"] == 2
+
+    database.down.clear()
+    assert outbox.replay_batch() == 2
+    assert [op for op, params in database.applied if params["key"] == "t1"] == [
+        "create_transcription", "update_transcription_result"]
+
+
+def test_write_failing_too_often_becomes_a_dead_letter(outbox, database):
+    database.down.add("t1")
+    record(outbox, "create_transcription", "t1")
+    for _ in range(3):
+        outbox.replay_batch()
+    stats = outbox.stats()
+    assert (stats["pending"], stats["dead"], stats["failed_attempts"]) == (0, 1, 3)
+
+
+def test_pending_writes_survive_a_restart(tmp_path, database):
+    path = str(tmp_path / "outbox.db")
+    record(WriteOutbox(path, database.apply), "create_transcription", "t1")
+    restarted = WriteOutbox(path, database.apply)
+    assert restarted.stats()["pending"] == 1
+    assert restarted.replay_batch() == 1
+    assert database.applied[0][1]["key"] == "t1"
+
+
+def test_one_worker_replays_what_every_worker_records(tmp_path, database):
+    path = str(tmp_path / "outbox.db")
+    workers = [WriteOutbox(path, database.apply, poll_interval=0.01) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    try:
+        for i in range(10):
+            record(workers[i % 2], "create_transcription", f"t{i}")
+        deadline = time.monotonic() + 5
+        while len(database.applied) < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        for worker in workers:
+            worker.stop()
+    assert [params["key"] for _, params in database.applied] == [f"t{i}" for i in range(10)]
+    assert [worker.replaying for worker in workers].count(True) == 1
+
+
+def test_batched_writes_reach_the_database(storage, backend):
+    ids = [str(uuid.uuid4()) for _ in range(3)]
+    rows = [{"transcription_id": i, "device_id": "d", "filename": f"clip{n}.wav"} for n, i in enumerate(ids)]
+    assert storage.create_transcriptions(rows) == 3
+    assert storage.create_transcriptions(rows) == 0  # a replayed create is a no-op
+
+    assert storage.update_transcriptions({ids[0]: {"progress": 50}, ids[1]: {"progress": 10, "duration": 2.0}}) == 2
+    results = [{"transcription_id": i, "result": f"text {n}", "processing_time": 0.5} for n, i in enumerate(ids[:2])]
+    assert storage.update_transcription_results(results + [{"transcription_id": "missing", "result": None}]) == 2
+
+    stored = {row["id"]: row for row in storage.get_transcriptions("d", ids)}
+    assert (stored[ids[0]]["progress"], stored[ids[1]]["duration"]) == (50, 2.0)
+    assert [stored[i]["status"] for i in ids] == ["completed", "completed", "processing"]
+    assert stored[ids[1]]["result"] == "text 1"
+
+    with pytest.raises(LookupError):
+        backend.apply_outbox_writes("update_transcription_result", [
+            {"transcription_id": str(uuid.uuid4()), "result": "lost"}])
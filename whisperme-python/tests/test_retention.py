@@ -0,0 +1,57 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from conftest import add_transcriptions, set_created_at
+from retention import RetentionJob
+
+
+def test_archived_text_is_still_returned(storage):
+    old = add_transcriptions(storage, "d", 5)
+    pending = add_transcriptions(storage, "d", 1, status=None)
+    recent = add_transcriptions(storage, "d", 1)
+    long_ago = (datetime.now(timezone.utc) - timedelta(days=90)).isoformat(timespec="microseconds")
+    set_created_at(storage, old + pending, long_ago)
+
+    job = RetentionJob(storage.archive_transcriptions, days=30, lock_path=str(storage.path) + ".lock",
+                       batch_size=2, batch_pause=0)
+    assert job.run_once() == 5
+    assert job.run_once() == 0
+
+    conn = storage._connect()
+    slimmed = "SELECT COUNT(*) FROM transcriptions WHERE archived_at IS NOT NULL AND result IS NULL"
+    assert conn.execute(slimmed).fetchone()[0] == 5
+    rows = {row["id"]: row for row in storage.get_transcriptions("d", old + pending + recent)}
+    assert [rows[i]["result"] for i in old] == [f"text {i}" for i in range(5)]
+    assert rows[pending[0]]["status"] != "completed"
+
+
+def test_archived_rows_are_still_found_by_search(storage):
+    old = add_transcriptions(storage, "d", 3)
+    set_created_at(storage, old, "2020-01-01T00:00:00.000000+00:00")
+    assert storage.archive_transcriptions("2021-01-01T00:00:00+00:00") == 3
+
+    found = storage.search_transcriptions("d", "text")
+    assert sorted(row["id"] for row in found) == sorted(old)
+    assert all("<mark>text</mark>" in row["snippet"] for row in found)
+
+    # Deleting an archived row takes its words out of the index too
+    storage._connect().execute("DELETE FROM transcriptions WHERE id = ?", (old[0],))
+    conn = storage._connect()
+    conn.execute("INSERT INTO transcriptions_fts (transcriptions_fts, rank) VALUES ('integrity-check', 1)")
+    assert len(storage.search_transcriptions("d", "text")) == 2
+
+
+def test_one_retention_worker_per_lock(tmp_path):
+    calls = []
+    lock_path = str(tmp_path / "retention.lock")
+    jobs = [RetentionJob(lambda cutoff, limit, name=name: calls.append(name) or 0, days=30,
+                         lock_path=lock_path, interval=60) for name in ("a", "b")]
+    for job in jobs:
+        job.start()
+    deadline = time.monotonic() + 5
+    while not calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for job in jobs:
+        job.stop()
+    assert len(calls) == 1
+    assert [job.stats()["running"] for job in jobs].count(True) == 1
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from scheduler import SchedulerQueueFull, UpstreamScheduler, parse_lane_weights
+
+
+async def dispatch_order(scheduler, jobs):
+    """Queue (tier, device_id, cost, label) jobs behind a held slot; labels in dispatch order"""
+    order = []
+    release = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot("free", "holder"):
+            await release.wait()
+
+    async def job(tier, device_id, cost, label):
+        async with scheduler.slot(tier, device_id, cost):
+            order.append(label)
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(job(*spec)) for spec in jobs]
+    await asyncio.sleep(0)
+    assert scheduler.stats()["queued"] == len(jobs)
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    return order
+
+
+def test_parse_lane_weights():
+    assert parse_lane_weights("premium:4, free:1") == {"premium": 4, "free": 1}
+    assert parse_lane_weights("free") == {"free": 1}
+    with pytest.raises(ValueError):
+        parse_lane_weights(" , ")
+
+
+def test_lanes_are_served_by_weight():
+    scheduler = UpstreamScheduler(1, {"premium": 3, "free": 1})
+    jobs = [("premium", f"p{i}", 1.0, "premium") for i in range(4)]
+    jobs += [("free", f"f{i}", 1.0, "free") for i in range(4)]
+    order = asyncio.run(dispatch_order(scheduler, jobs))
+    assert order[:4].count("premium") == 3
+    assert sorted(order) == sorted(label for *_, label in jobs)
+
+
+def test_unknown_paid_tier_gets_top_lane():
+    scheduler = UpstreamScheduler(1, {"premium": 3, "free": 1})
+    assert scheduler.lane_for_tier(None) == "free"
+    assert scheduler.lane_for_tier("enterprise") == "premium"
+
+
+def test_shorter_jobs_of_a_device_go_first():
+    scheduler = UpstreamScheduler(1, {"free": 1})
+    order = asyncio.run(dispatch_order(scheduler, [("free", "d", cost, cost) for cost in (5.0, 1.0, 3.0)]))
+    assert order == [1.0, 3.0, 5.0]
+
+
+def test_busy_device_does_not_starve_others():
+    scheduler = UpstreamScheduler(1, {"free": 1})
+    jobs = [("free", "busy", 1.0, f"busy{i}") for i in range(3)] + [("free", "quiet", 1.0, "quiet")]
+    order = asyncio.run(dispatch_order(scheduler, jobs))
+    assert order.index("quiet") == 1
+
+
+def test_queue_limits():
+    async def fill():
+        scheduler = UpstreamScheduler(1, {"free": 1}, max_queue_per_lane=4, max_queue_per_device=2)
+        release = asyncio.Event()
+
+        async def job(device_id):
+            async with scheduler.slot("free", device_id):
+                await release.wait()
+
+        # The first job takes the slot, the rest queue
+        tasks = [asyncio.create_task(job(device_id)) for device_id in ("a", "a", "a", "b")]
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerQueueFull, match="this device"):
+            async with scheduler.slot("free", "a"):
+                pass
+        tasks.append(asyncio.create_task(job("c")))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerQueueFull, match="capacity"):
+            async with scheduler.slot("free", "d"):
+                pass
+        assert scheduler.stats()["lanes"]["free"]["rejected"] == 2
+        release.set()
+        await asyncio.gather(*tasks)
+        return scheduler.stats()
+
+    stats = asyncio.run(fill())
+    assert stats["active"] == 0 and stats["queued"] == 0
+    assert stats["lanes"]["free"]["dispatched"] == 5
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def cancel_one():
+        scheduler = UpstreamScheduler(1, {"free": 1})
+        release = asyncio.Event()
+        ran = []
+
+        async def job(label):
+            async with scheduler.slot("free", label):
+                ran.append(label)
+                await release.wait()
+
+        first = asyncio.create_task(job("first"))
+        waiting = asyncio.create_task(job("cancelled"))
+        last = asyncio.create_task(job("last"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == 1
+        release.set()
+        await asyncio.gather(first, last)
+        return ran, scheduler.stats()
+
+    ran, stats = asyncio.run(cancel_one())
+    assert ran == ["first", "last"]
+    assert stats["active"] == 0 and stats["queued"] == 0
@@ -0,0 +1,183 @@
+import threading
+
+import pytest
+
+from conftest import TRANSCRIPT, wav_bytes
+from fakes import FakeOpenAI
+from idempotency import IdempotencyStore
+from uploads import UploadManager, UploadNotFound, UploadOffsetMismatch, UploadTooLarge
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    return UploadManager(str(tmp_path), max_bytes=64)
+
+
+def test_chunks_resume_from_the_received_offset(uploads):
+    upload_id = uploads.create({"device_id": "d"})["upload_id"]
+    assert uploads.append(upload_id, 0, b"0123456789") == 10
+    with pytest.raises(UploadOffsetMismatch) as mismatch:
+        uploads.append(upload_id, 20, b"x")
+    assert mismatch.value.expected == 10
+    # A retried chunk that overlaps stored bytes only adds its new tail
+    assert uploads.append(upload_id, 5, b"56789abc") == 13
+    assert uploads.append(upload_id, 0, b"0123") == 13
+    with open(uploads.data_path(upload_id), "rb") as f:
+        assert f.read() == b"0123456789abc"
+    assert uploads.get(upload_id)["received"] == 13
+
+
+def test_upload_limits(uploads):
+    upload_id = uploads.create({})["upload_id"]
+    with pytest.raises(UploadTooLarge):
+        uploads.append(upload_id, 0, b"x" * 65)
+    with pytest.raises(UploadNotFound):
+        uploads.get("../../etc/passwd")
+    uploads.delete(upload_id)
+    with pytest.raises(UploadNotFound):
+        uploads.append(upload_id, 0, b"x")
+
+
+def test_expired_sessions_are_swept(tmp_path):
+    uploads = UploadManager(str(tmp_path), max_bytes=64, ttl_seconds=-1)
+    upload_id = uploads.create({})["upload_id"]
+    uploads.sweep()
+    with pytest.raises(UploadNotFound):
+        uploads.get(upload_id)
+
+
+def test_progress_is_claimed_once_per_step_and_never_backwards(uploads):
+    upload_id = uploads.create({"progress_reported": 0})["upload_id"]
+    claims = []
+
+    def report(received):
+        claims.append((received, uploads.claim_progress(upload_id, received, step=10)))
+
+    threads = [threading.Thread(target=report, args=(received,)) for received in (10, 12, 25, 30, 31)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    claimed = [received for received, ok in claims if ok]
+    assert claimed == sorted(claimed)
+    assert all(b - a >= 10 for a, b in zip(claimed, claimed[1:]))
+    assert uploads.get(upload_id)["progress_reported"] == claimed[-1]
+
+
+@pytest.fixture
+def upstream(backend):
+    """Swap in a fake OpenAI client of the test's own: upstream(**FakeOpenAI options)"""
+    shared = backend.openai_client.get()
+
+    def use(**options):
+        fake = FakeOpenAI(transcript=TRANSCRIPT, **options)
+        backend.openai_client.set(fake)
+        return fake
+    yield use
+    backend.openai_client.set(shared)
+
+
+def start_upload(client, device_id, total_size, filename="clip.wav"):
+    response = client.post("/uploads", json={"device_id": device_id, "filename": filename,
+                                             "total_size": total_size})
+    assert response.status_code == 200
+    return response.json()["upload_id"]
+
+
+def test_interrupted_upload_resumes_and_finalizes(client, device):
+    device_id, _ = device
+    audio = wav_bytes(1.0)
+    upload_id = start_upload(client, device_id, len(audio))
+
+    half = len(audio) // 2
+    assert client.put(f"/uploads/{upload_id}", params={"offset": 0}, content=audio[:half]).json()["received"] == half
+    assert client.post(f"/uploads/{upload_id}/finalize").status_code == 409
+
+    # The client lost track of what was sent: ask, then continue from there
+    received = client.get(f"/uploads/{upload_id}").json()["received"]
+    assert received == half
+    gap = client.put(f"/uploads/{upload_id}", params={"offset": half + 100}, content=audio[half + 100:])
+    assert gap.status_code == 409 and gap.json()["detail"]["received"] == half
+    client.put(f"/uploads/{upload_id}", params={"offset": received}, content=audio[received:])
+
+    finalized = client.post(f"/uploads/{upload_id}/finalize")
+    assert finalized.status_code == 200
+    assert finalized.json()["text"] == TRANSCRIPT
+    assert client.get(f"/uploads/{upload_id}").status_code == 404
+
+
+def test_finalize_retry_on_another_worker_replays_the_result(client, backend, device, monkeypatch):
+    device_id, _ = device
+    audio = wav_bytes(0.5)
+    upload_id = start_upload(client, device_id, len(audio))
+    client.put(f"/uploads/{upload_id}", content=audio)
+    first = client.post(f"/uploads/{upload_id}/finalize")
+    assert first.status_code == 200
+
+    # A worker that did not run the finalize only shares the file
+    other_worker = IdempotencyStore(path=backend.IDEMPOTENCY_PATH)
+    monkeypatch.setattr(backend, "transcription_idempotency", other_worker)
+    retry = client.post(f"/uploads/{upload_id}/finalize")
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+    assert client.post("/uploads/0123456789abcdef/finalize").status_code == 404
+
+
+def test_failed_probe_marks_the_transcription_failed(client, backend, device, monkeypatch):
+    device_id, _ = device
+    audio = wav_bytes(0.5)
+    upload_id = start_upload(client, device_id, len(audio))
+    client.put(f"/uploads/{upload_id}", content=audio)
+
+    def unreadable(f, size):
+        raise OSError("disk went away")
+    with monkeypatch.context() as patched:
+        patched.setattr(backend, "probe_duration", unreadable)
+        assert client.post(f"/uploads/{upload_id}/finalize").status_code == 500
+
+    history = client.get("/transcriptions", params={"device_id": device_id}).json()["transcriptions"]
+    assert history[0]["status"] == "failed"
+    assert "disk went away" in history[0]["error_message"]
+    # Kept for a retry, which needs no re-upload
+    assert client.get(f"/uploads/{upload_id}").json()["received"] == len(audio)
+    assert client.post(f"/uploads/{upload_id}/finalize").json()["text"] == TRANSCRIPT
+
+
+def test_finalize_sends_the_original_file_name(client, device, upstream):
+    device_id, _ = device
+    fake = upstream()
+    audio = wav_bytes(0.5)
+    upload_id = start_upload(client, device_id, len(audio), filename="memo.wav")
+    client.put(f"/uploads/{upload_id}", content=audio)
+    assert client.post(f"/uploads/{upload_id}/finalize").status_code == 200
+    assert fake.audio.transcriptions.file_names == ["memo.wav"]
+
+
+def test_upstream_failure_keeps_the_session_for_a_retry(client, device, upstream):
+    device_id, _ = device
+    audio = wav_bytes(0.5)
+    upload_id = start_upload(client, device_id, len(audio))
+    client.put(f"/uploads/{upload_id}", content=audio)
+
+    upstream(error_rate=1.0, error_kind="server")
+    assert client.post(f"/uploads/{upload_id}/finalize").status_code == 500
+    assert client.get(f"/uploads/{upload_id}").status_code == 200
+
+    upstream()
+    retry = client.post(f"/uploads/{upload_id}/finalize")
+    assert retry.status_code == 200 and retry.json()["text"] == TRANSCRIPT
+    assert client.get(f"/uploads/{upload_id}").status_code == 404
+    history = client.get("/transcriptions", params={"device_id": device_id}).json()["transcriptions"]
+    assert history[0]["status"] == "completed"
+
+
+def test_rejected_audio_discards_the_session(client, device, upstream):
+    device_id, _ = device
+    audio = wav_bytes(0.5)
+    upload_id = start_upload(client, device_id, len(audio))
+    client.put(f"/uploads/{upload_id}", content=audio)
+
+    upstream(error_rate=1.0, error_kind="bad_request")
+    assert client.post(f"/uploads/{upload_id}/finalize").status_code == 422
+    assert client.get(f"/uploads/{upload_id}").status_code == 404
@@ -0,0 +1,115 @@
+"""
+Transcription model dispatch for WhisperMe Backend
+Honors the requested model, streams where the model supports it and falls
+back along a per-model chain when the upstream model is unavailable
+"""
+
+import logging
+import time
+from typing import Any, List, Optional, Tuple
+
+from metrics import UPSTREAM_LATENCY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-4o-transcribe"
+
+# stream: the model can return transcript.text.delta events
+# fallback: model to try next when this one fails with a transient or
+#           availability error
+MODEL_PROFILES = {
+    "gpt-4o-transcribe": {"stream": True, "fallback": "gpt-4o-mini-transcribe"},
+    "gpt-4o-mini-transcribe": {"stream": True, "fallback": "whisper-1"},
+    "whisper-1": {"stream": False, "fallback": None},
+}
+
+MODEL_ALIASES = {
+    "whisper": "whisper-1",
+    "gpt-4o": "gpt-4o-transcribe",
+    "gpt-4o-mini": "gpt-4o-mini-transcribe",
+}
+
+
+def fallback_errors() -> Tuple[type, ...]:
+    """Errors that say nothing about the audio itself, so another model may succeed"""
+    # Imported here so loading this module does not pull in the OpenAI SDK
+    import openai
+
+    return (
+        openai.APIConnectionError,  # includes APITimeoutError
+        openai.RateLimitError,
+        openai.InternalServerError,
+        openai.NotFoundError,
+    )
+
+
+def resolve_model(requested: Optional[str]) -> str:
+    """Map a client-supplied model name to a known model, defaulting unknown names"""
+    model = MODEL_ALIASES.get(requested, requested)
+    if model not in MODEL_PROFILES:
+        if requested:
+            logger.warning(f"Unknown transcription model '{requested}', using {DEFAULT_MODEL}")
+        return DEFAULT_MODEL
+    return model
+
+
+def model_chain(requested: Optional[str]) -> List[str]:
+    """The requested model followed by its fallbacks"""
+    chain = []
+    model = resolve_model(requested)
+    while model and model not in chain:
+        chain.append(model)
+        model = MODEL_PROFILES[model]["fallback"]
+    return chain
+
+
+def transcribe_with_model(client: Any, model: str, file_path: str, language: Optional[str],
+                          prompt: Optional[str], filename: Optional[str] = None) -> str:
+    """
+    Transcribe with exactly one model (blocking); streams when the model supports it.
+    The upstream infers the audio format from the file name, so `filename` (the
+    client's original name) replaces file_path's own when it has no usable suffix.
+    """
+    stream = MODEL_PROFILES[model]["stream"]
+    with open(file_path, "rb") as audio_file:
+        params = {"file": (filename, audio_file) if filename else audio_file, "model": model}
+        if language and language != "auto":
+            params["language"] = language
+        if prompt:
+            params["prompt"] = prompt
+
+        if not stream:
+            return client.audio.transcriptions.create(**params).text
+
+        parts = []
+        for event in client.audio.transcriptions.create(stream=True, **params):
+            if event.type == "transcript.text.delta":
+                parts.append(event.delta)
+            elif event.type == "transcript.text.done":
+                # The done event carries the full text; prefer it over our join
+                return event.text
+        return "".join(parts)
+
+
+def dispatch_transcription(client: Any, file_path: str, requested_model: Optional[str],
+                           language: Optional[str], prompt: Optional[str],
+                           filename: Optional[str] = None) -> Tuple[str, str]:
+    """Transcribe with the requested model or its fallbacks; returns (text, model_used)"""
+    chain = model_chain(requested_model)
+    for i, model in enumerate(chain):
+        # Falling back is faster than retrying the same model, so only the last
+        # model in the chain uses the client's own retries
+        attempt_client = client
+        if i < len(chain) - 1 and hasattr(client, "with_options"):
+            attempt_client = client.with_options(max_retries=0)
+        started = time.perf_counter()
+        try:
+            logger.info(f"Calling OpenAI API with model: {model}")
+            text = transcribe_with_model(attempt_client, model, file_path, language, prompt, filename)
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, model=model, outcome="ok")
+            return text, model
+        except Exception as e:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, model=model, outcome=type(e).__name__)
+            if not isinstance(e, fallback_errors()) or i == len(chain) - 1:
+                raise
+            logger.warning(f"Model {model} failed ({type(e).__name__}: {str(e)}), falling back to {chain[i + 1]}")
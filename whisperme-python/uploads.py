@@ -0,0 +1,162 @@
+"""
+Resumable chunked uploads for WhisperMe Backend
+Sessions live on disk so any worker can accept the next chunk or the finalize call
+"""
+
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """Base class for upload session errors"""
+
+
+class UploadNotFound(UploadError):
+    pass
+
+
+class UploadOffsetMismatch(UploadError):
+    """The client sent a chunk for an offset other than the bytes already received"""
+
+    def __init__(self, expected: int, got: int):
+        self.expected = expected
+        self.got = got
+        super().__init__(f"Chunk offset {got} does not match received bytes {expected}")
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+class UploadManager:
+    """
+    Stores each session as `<id>.json` (metadata) plus `<id>.part` (audio bytes).
+
+    The size of the `.part` file is the authoritative received offset, so an
+    interrupted client asks for it and continues from there instead of
+    re-sending the recording.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: int = 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def _meta_path(self, upload_id: str) -> str:
+        if not upload_id.isalnum():
+            raise UploadNotFound(upload_id)
+        return os.path.join(self.directory, f"{upload_id}.json")
+
+    def data_path(self, upload_id: str) -> str:
+        if not upload_id.isalnum():
+            raise UploadNotFound(upload_id)
+        return os.path.join(self.directory, f"{upload_id}.part")
+
+    def create(self, metadata: Dict) -> Dict:
+        self.sweep()
+        upload_id = uuid.uuid4().hex
+        session = {
+            **metadata,
+            "upload_id": upload_id,
+            "status": "receiving",
+            "created_at": time.time(),
+        }
+        open(self.data_path(upload_id), "wb").close()
+        self.save(session)
+        return session
+
+    def get(self, upload_id: str) -> Dict:
+        try:
+            with open(self._meta_path(upload_id)) as f:
+                session = json.load(f)
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id)
+        session["received"] = self.received(upload_id)
+        return session
+
+    def save(self, session: Dict):
+        path = self._meta_path(session["upload_id"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({k: v for k, v in session.items() if k != "received"}, f)
+        os.replace(tmp_path, path)
+
+    def received(self, upload_id: str) -> int:
+        try:
+            return os.path.getsize(self.data_path(upload_id))
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id)
+
+    def append(self, upload_id: str, offset: int, chunk: bytes) -> int:
+        """Append a chunk at `offset`; returns the new received size"""
+        path = self.data_path(upload_id)
+        try:
+            f = open(path, "r+b")
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id)
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            received = os.fstat(f.fileno()).st_size
+            if offset > received:
+                raise UploadOffsetMismatch(received, offset)
+            # A retried chunk may overlap bytes already stored; keep only the new tail
+            chunk = chunk[received - offset:]
+            if not chunk:
+                return received
+            if received + len(chunk) > self.max_bytes:
+                raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+            f.seek(received)
+            f.write(chunk)
+            return received + len(chunk)
+
+    def claim_progress(self, upload_id: str, received: int, step: int) -> bool:
+        """
+        Record `received` as the session's reported progress when it is at least
+        `step` bytes past the last report; True if the caller should report it.
+        Holds the same lock as append(), so concurrent chunks never move the
+        reported progress backwards or report one step twice.
+        """
+        try:
+            f = open(self.data_path(upload_id), "rb")
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id)
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            session = self.get(upload_id)
+            if received - session.get("progress_reported", 0) < step:
+                return False
+            session["progress_reported"] = received
+            self.save(session)
+            return True
+
+    def delete(self, upload_id: str):
+        for path in (self._meta_path(upload_id), self.data_path(upload_id)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def sweep(self):
+        """Remove sessions idle for longer than the TTL"""
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            upload_id = name[:-len(".json")]
+            try:
+                last_activity = max(
+                    os.path.getmtime(self._meta_path(upload_id)),
+                    os.path.getmtime(self.data_path(upload_id)),
+                )
+            except FileNotFoundError:
+                last_activity = 0
+            if last_activity < cutoff:
+                self.delete(upload_id)
@@ -0,0 +1,159 @@
+"""
+Vector index for WhisperMe semantic search
+One device's embeddings as a NumPy matrix of unit vectors. Up to `exact_max`
+vectors a query is a single matrix-vector product over all of them; above that
+an inverted-file index (k-means cells, searching only the `nprobe` cells nearest
+the query) keeps each query to a small fraction of the matrix.
+"""
+
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_CELL = 64
+MIN_CELLS, MAX_CELLS = 16, 1024
+
+
+def normalized(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first"""
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class VectorIndex:
+    """
+    Cosine similarity search over (id, vector) pairs. Adding an id again replaces
+    its vector. The cells are trained once the index passes `exact_max` and again
+    each time it doubles; vectors added in between join their nearest cell.
+    """
+
+    def __init__(self, dimensions: int, exact_max: int = 5000, nprobe: int = 8):
+        self.dimensions = dimensions
+        self.exact_max = exact_max
+        self.nprobe = nprobe
+        self.ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._data = np.zeros((0, dimensions), dtype=np.float32)  # grows by doubling; rows past len are unused
+        self.centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self.trained_size = 0
+        self._cells: Optional[Tuple[np.ndarray, np.ndarray]] = None  # (rows ordered by cell, cell bounds)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._data[:len(self.ids)]
+
+    @property
+    def approximate(self) -> bool:
+        return self.centroids is not None
+
+    def add(self, ids: Sequence[str], vectors: np.ndarray):
+        vectors = normalized(vectors).reshape(-1, self.dimensions)
+        for row_id, vector in zip(ids, vectors):
+            position = self._positions.get(row_id)
+            if position is None:
+                position = len(self.ids)
+                if position == len(self._data):
+                    grown = np.zeros((max(64, 2 * len(self._data)), self.dimensions), dtype=np.float32)
+                    grown[:position] = self._data[:position]
+                    self._data = grown
+                    self._assignments = np.resize(self._assignments, len(grown))
+                self.ids.append(row_id)
+                self._positions[row_id] = position
+            self._data[position] = vector
+            if self.centroids is not None:
+                self._assignments[position] = int(np.argmax(self.centroids @ vector))
+        self._cells = None
+        if len(self) > self.exact_max and len(self) >= 2 * self.trained_size:
+            self.train()
+
+    def search(self, query: np.ndarray, k: int = 10) -> List[Tuple[str, float]]:
+        """(id, cosine similarity) of the k nearest vectors, most similar first"""
+        if not self.ids:
+            return []
+        query = normalized(query).reshape(self.dimensions)
+        if self.centroids is None:
+            scores = self.matrix @ query
+            return [(self.ids[i], float(scores[i])) for i in _top(scores, k)]
+        order, bounds = self._cell_lists()
+        probe = _top(self.centroids @ query, self.nprobe)
+        rows = np.concatenate([order[bounds[cell]:bounds[cell + 1]] for cell in probe])
+        scores = self._data[rows] @ query
+        return [(self.ids[rows[i]], float(scores[i])) for i in _top(scores, k)]
+
+    def train(self, seed: int = 0):
+        """Spherical k-means over a sample, then assign every vector to its nearest cell"""
+        count = len(self)
+        cells = min(count, int(np.clip(np.sqrt(count), MIN_CELLS, MAX_CELLS)))
+        rng = np.random.default_rng(seed)
+        sample = self.matrix[rng.choice(count, min(count, cells * KMEANS_SAMPLE_PER_CELL), replace=False)]
+        centroids = sample[rng.choice(len(sample), cells, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            nearest = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, sample)
+            filled = np.bincount(nearest, minlength=cells) > 0
+            centroids[filled] = normalized(sums[filled])  # an empty cell keeps its old centroid
+        self.centroids = centroids
+        self._assignments[:count] = self._assign(self.matrix)
+        self.trained_size = count
+        self._cells = None
+
+    def _assign(self, vectors: np.ndarray, chunk: int = 8192) -> np.ndarray:
+        return np.concatenate([np.argmax(vectors[i:i + chunk] @ self.centroids.T, axis=1)
+                               for i in range(0, len(vectors), chunk)]).astype(np.int32)
+
+    def _cell_lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._cells is None:
+            assignments = self._assignments[:len(self)]
+            order = np.argsort(assignments, kind="stable")
+            bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            self._cells = (order, bounds)
+        return self._cells
+
+    # Persistence: vectors are stored as float16 (half the size, well within cosine precision)
+
+    def save(self, path: str, model: str):
+        """Write atomically, so readers in other workers never see a partial file"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        arrays = {
+            "ids": np.array([row_id.encode() for row_id in self.ids], dtype=bytes),
+            "vectors": self.matrix.astype(np.float16),
+            "model": np.array(model),
+            "trained_size": np.array(self.trained_size),
+        }
+        if self.centroids is not None:
+            arrays.update(centroids=self.centroids, assignments=self._assignments[:len(self)])
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, exact_max: int = 5000, nprobe: int = 8) -> Tuple["VectorIndex", str]:
+        """The index stored at `path` and the embedding model that produced it"""
+        with np.load(path, allow_pickle=False) as stored:
+            vectors = normalized(stored["vectors"])
+            index = cls(vectors.shape[1], exact_max=exact_max, nprobe=nprobe)
+            index.ids = [row_id.decode() for row_id in stored["ids"].tolist()]
+            index._positions = {row_id: i for i, row_id in enumerate(index.ids)}
+            index._data = vectors
+            index._assignments = np.zeros(len(vectors), dtype=np.int32)
+            index.trained_size = int(stored["trained_size"])
+            if "centroids" in stored:
+                index.centroids = stored["centroids"]
+                index._assignments = stored["assignments"].astype(np.int32)
+            return index, str(stored["model"])